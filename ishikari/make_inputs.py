@@ -1,10 +1,16 @@
 import os 
+import sys
 import numpy as np
 
 
 scratch_dir = '/Users/anitamiddleton/Documents/python/tsunami_proj/scratch'
 
-which_test = input("Which test in the scratch directory from this project would you like to run? ")
+# shared helpers in the tools directory at the top of the repo
+sys.path.insert(0, os.environ.get('PROJ', os.path.dirname(scratch_dir)))
+
+# set TSUNAMI_TEST=<test> to run without the prompt
+from tools import which_test as _which_test
+which_test = _which_test('ishikari')
 test_dir = os.path.join(scratch_dir, 'ishikari', which_test)
 
 def make_topo():
@@ -135,9 +141,22 @@ def make_fgmax():
                                                           padding=0, verbose=True)
         rr.write(os.path.join(scratch_dir, 'ishikari/RuledRectangle_fgmax.txt'))
 
+# crops the fgmax mask to each site in tools/fgmax_sites.py, for params.fgmax_sites
+def make_fgmax_sites():
+    from tools.fgmax_sites import write_site_masks
+
+    fgmax_pts_fname = scratch_dir + '/ishikari/fgmax_pts_topostyle.txt'
+    if os.path.exists(fgmax_pts_fname):
+        write_site_masks(fgmax_pts_fname, os.path.join(scratch_dir, 'ishikari'))
+
 def check_B0():
     fgmax_ptsB0_fname = scratch_dir + '/ishikari/ishikari_B0.txt' # or other name of the fgmax grid's B0 file
-    if os.path.exists(fgmax_ptsB0_fname):
+    # set aside a B0 file made for other fgmax grids (use_fgmax_sites or
+    # fgmax_sites changed in params.py), its lattice no longer matches
+    from tools.fgmax_sites import check_b0_layout, expected_layout
+    params_fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'params.py')
+    layout = expected_layout(params_fname, os.path.join(scratch_dir, 'ishikari'))
+    if check_b0_layout(fgmax_ptsB0_fname, layout):
         print("B0 file for fgmax points exists, no further steps needed.")
     else:
         print()
@@ -158,4 +177,5 @@ if __name__=='__main__':
     make_topo()
     make_dtopo()
     make_fgmax()
+    make_fgmax_sites()
     check_B0()
\ No newline at end of file
@@ -3,6 +3,7 @@ Parameters specific to the earthquake source (and the location).
 """
 
 import os
+import sys
 
 # topography directory
 
@@ -20,16 +21,37 @@ except:
 root_dir = '/Users/anitamiddleton/Documents/python/tsunami_proj'
 scratch_dir = os.path.join(root_dir, 'scratch')
 
-# ADJUST
-which_test = input("Which test in the scratch directory from this project would you like to run? ")
-test_dir = os.path.join(scratch_dir, 'ishikari', which_test)
+# shared helpers in the tools directory at the top of the repo
+sys.path.insert(0, os.environ.get('PROJ', root_dir))
+
+# ADJUST: set TSUNAMI_TEST=<test> to run without the prompt
+from tools import which_test as _which_test
+project = 'ishikari'
+which_test = _which_test(project)
+test_dir = os.path.join(scratch_dir, project, which_test)
 
 makeB0 = False
 
 amr_max = 5
+# refinement ratio from each level to the next: 2 degree, 24', 4', 1', 10", 1"
+# (python -m tools.amr_design <project> suggests ratios for target resolutions)
+refinement_ratios = [5, 6, 4, 6, 10]
 
 num_output_times = 36
+# frame output: 'binary64' (default), 'binary32' (half the size, single
+# precision) or 'ascii'; setplot.py and the notebooks read it from claw.data
+output_format = 'binary64'
 end_time = 3*3600.
+# checkpoint about every checkpt_minutes of wall time (0 for none), so a
+# killed run restarts from there (see tools/checkpoint.py)
+checkpt_minutes = 30
+
+# shorter end_time from tools/early_stop.py if the maxima have settled
+# earlier, keeping the time between frames
+from tools.refinement_plan import planned_end_time, plan_path
+_full_end_time = end_time
+end_time = planned_end_time(plan_path(test_dir), end_time)
+num_output_times = max(1, int(round(num_output_times * end_time / _full_end_time)))
 
 # computational domain
 lower = [138.0, 38]
@@ -38,6 +60,9 @@ upper = [148.0, 46]
 # coarsest grid [x,y]
 # 2 degrees resolution
 num_cells = [5, 4]
+# smaller domain from tools/domain_size.py, if one has been made for this test
+from tools.refinement_plan import planned_domain
+lower, upper, num_cells = planned_domain(plan_path(test_dir), lower, upper, num_cells)
 
 from clawpack.geoclaw import fgmax_tools
 from clawpack.amrclaw.data import FlagRegion
@@ -126,20 +151,60 @@ fgmax_grids = []  # empty list to start
 # Now append to this list objects of class fgmax_tools.FGmaxGrid
 # specifying any fgmax grids.
 
-fg = fgmax_tools.FGmaxGrid()
-fg.fgno = 1
-# fgmax grid point_style==4 means grid specified as topo_type==3 file:
-fg.point_style = 4
-fg.xy_fname = os.path.join(scratch_dir, 'ishikari/fgmax_pts_topostyle.txt')  # file of 0/1 values in tt3 format
-fg.tstart_max = 5. # after rupture (hopefully)
-fg.tend_max = end_time # same as final time for whole run
-fg.dt_check = 0 # monitor every time step
-fg.min_level_check = amr_max
-fgmax_grids=[fg]
+# One fgmax grid per site we report on, each cropped from the coastline mask
+# by make_inputs.py (site extents are in tools/fgmax_sites.py), so fgmax work in
+# the solver only covers these ports.
+# use_fgmax_sites = False monitors the whole coastline mask as one grid, which
+# is what the B0 file in scratch was made from.  With True, make_inputs.py sets
+# that B0 file aside and it has to be made again (makeB0, writeB0.py).
+use_fgmax_sites = False
+fgmax_sites = {
+    # name: [tstart_max, tend_max, dt_check]
+    'urakawa':   [5., end_time, 0],
+    'erimo':     [5., end_time, 0],
+    'tomakomai': [5., end_time, 0],
+}
+
+if use_fgmax_sites:
+    from tools.fgmax_sites import make_site_fgmax_grids
+    fgmax_grids = make_site_fgmax_grids(fgmax_sites, os.path.join(scratch_dir, 'ishikari'),
+                                        min_level_check=amr_max)
+else:
+    fg = fgmax_tools.FGmaxGrid()
+    fg.fgno = 1
+    # fgmax grid point_style==4 means grid specified as topo_type==3 file:
+    fg.point_style = 4
+    fg.xy_fname = os.path.join(scratch_dir, 'ishikari/fgmax_pts_topostyle.txt')  # file of 0/1 values in tt3 format
+    fg.tstart_max = 5. # after rupture (hopefully)
+    fg.tend_max = end_time # same as final time for whole run
+    fg.dt_check = 0 # monitor every time step
+    fg.min_level_check = amr_max
+    fgmax_grids=[fg]
+
+# Narrow the flagregion and fgmax time windows to the refinement plan of this
+# test, if one has been made (e.g. python -m tools.arrival_times ishikari)
+from tools.refinement_plan import apply_plan, plan_path
+apply_plan(plan_path(test_dir), flagregions, fgmax_grids)
+
+## Adjoint flagging ##
+# Flag by the adjoint-weighted error instead of wave_tolerance, so only waves
+# that will reach the gauges and fgmax grids are refined.  Needs the adjoint
+# run first:  python -m tools.adjoint ishikari run
+use_adjoint = False
+adjoint_tolerance = 0.004
+
+## Regridding settings ##
+# regrid_interval, regrid_buffer_width, clustering_cutoff, max1d and
+# wave_tolerance measured by tools/autotune.py replace those in setrun.py
+# if this file exists (None to use setrun.py as it is)
+amr_profile = os.path.join(scratch_dir, project, 'amr_profile.json')
 
 # ---------------
 # Gauges:
 # ---------------
+# gauge output: 'binary' (each gauge in a .bin file next to its .txt
+# header) or 'ascii'; tools/gauges.py reads either into one array
+gauge_format = 'binary'
 gauges = []
 # # for gauges append lines of the form  [gaugeno, x, y, t1, t2]
 gauges.append([129, 142.765722, 42.166085, 0., 1.e10]) # urakawa tide gauge
@@ -149,6 +214,18 @@ gauges.append([112, 143.135422, 42.010444, 0., 1e10]) # erimo port location
 gauges.append([113, 141.613420, 42.614828, 0., 1e10]) # tomakomai (outside of breakwater thing, so not quite accurate)
 gauges.append([114, 142.416, 42.254, 0., 1e10]) # fake gauge near urakawa
 
+# virtual gauges along the coast from tools/coastal_gauges.py (numbered
+# from 1000), added if the file exists and written every coastal_gauge_dt
+# seconds
+coastal_gauges_file = os.path.join(scratch_dir, project, 'coastal_gauges.txt')
+coastal_gauge_dt = 10.
+
+# gauges moved to wet finest-level cells by tools/gauge_placement.py, each
+# with a small flagregion at amr_max around it, if the file exists
+gauge_placement_file = os.path.join(scratch_dir, project, 'gauge_placement.json')
+from tools.gauge_placement import apply_placement
+apply_placement(gauge_placement_file, gauges, flagregions, amr_max)
+
 
 # topography
 topofiles = []
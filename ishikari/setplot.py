@@ -7,11 +7,19 @@ function setplot is called to set the plot parameters.
     
 """ 
 
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
 from clawpack.geoclaw import topotools
 
+# shared helpers in the tools directory at the top of the repo
+sys.path.insert(0, os.environ.get('PROJ', os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+from tools.output_format import output_format
+from tools.coastal_gauges import tide_gauge_numbers
+
 
 #--------------------------
 def setplot(plotdata=None):
@@ -34,7 +42,9 @@ def setplot(plotdata=None):
 
 
     plotdata.clearfigures()  # clear any old figures,axes,items data
-    plotdata.format = 'ascii'    # 'ascii' or 'binary' to match setrun.py
+    plotdata.format = output_format(plotdata.outdir)  # as written by setrun.py
+    # only the tide gauges, not the hundreds of virtual coastal gauges
+    tide_gaugenos = tide_gauge_numbers(plotdata.outdir)
 
 
     # To plot gauge locations on pcolor or contour plot, use this as
@@ -43,7 +53,7 @@ def setplot(plotdata=None):
     def addgauges(current_data):
         from clawpack.visclaw import gaugetools
         gaugetools.plot_gauge_locations(current_data.plotdata, \
-             gaugenos='all', format_string='ko', add_labels=True)
+             gaugenos=tide_gaugenos, format_string='ko', add_labels=True)
     
     def addgauges1(current_data): # urakawa
         from clawpack.visclaw import gaugetools
@@ -206,7 +216,7 @@ def setplot(plotdata=None):
     plotdata.printfigs = True                # print figures
     plotdata.print_format = 'png'            # file format
     plotdata.print_framenos = 'all'          # list of frames to print
-    plotdata.print_gaugenos = 'all'          # list of gauges to print
+    plotdata.print_gaugenos = tide_gaugenos  # list of gauges to print
     plotdata.print_fignos = 'all'            # list of figures to print
     plotdata.html = True                     # create html files of plots?
     plotdata.html_homelink = '../README.html'   # pointer for top of index
@@ -112,6 +112,8 @@ def setrun(claw_pkg='geoclaw'):
     # If restarting, t0 above should be from original run, and the
     # restart_file 'fort.chkNNNNN' specified below should be in 
     # the OUTDIR indicated in Makefile.
+    # (tools/run_scenarios.py sets these itself to continue an interrupted
+    # run from its newest checkpoint, see params.checkpt_minutes.)
 
     clawdata.restart = False              # True to restart from prior results
     clawdata.restart_file = 'fort.chk00096'  # File to use for restart data
@@ -143,7 +145,7 @@ def setrun(claw_pkg='geoclaw'):
         clawdata.output_t0 = True
         
 
-    clawdata.output_format = 'ascii'      # 'ascii' or 'binary' 
+    clawdata.output_format = params.output_format   # 'ascii', 'binary64' or 'binary32'
 
     clawdata.output_q_components = 'all'   # need all
     clawdata.output_aux_components = 'none'  # eta=h+B is in q
@@ -277,6 +279,13 @@ def setrun(claw_pkg='geoclaw'):
         # option means checkpt at same time as valout
         pass
 
+    if params.checkpt_minutes:
+        # alternating checkpoint files, every checkpt_interval level 1 steps
+        # chosen from the wall time per step of the last run of this test
+        from tools.checkpoint import configure_checkpoints, step_cost_path
+        configure_checkpoints(rundata, params.checkpt_minutes,
+                              step_cost_path(params.project, params.which_test))
+
 
     # ---------------
     # AMR parameters:
@@ -290,10 +299,10 @@ def setrun(claw_pkg='geoclaw'):
     amrdata.amr_levels_max = amr_max
 
     # List of refinement ratios at each level (length at least mxnest-1)
-    # 2 degree, 24', 4', 1', 10", 1"
-    amrdata.refinement_ratios_x = [5, 6, 4, 6, 10]
-    amrdata.refinement_ratios_y = [5, 6, 4, 6, 10]
-    amrdata.refinement_ratios_t = [5, 6, 4, 6, 10]
+    # set in params.py
+    amrdata.refinement_ratios_x = params.refinement_ratios
+    amrdata.refinement_ratios_y = params.refinement_ratios
+    amrdata.refinement_ratios_t = params.refinement_ratios
 
 
     # Specify type of each aux variable in amrdata.auxtype.
@@ -351,9 +360,26 @@ def setrun(claw_pkg='geoclaw'):
     # ---------------
     # Gauges:
     # ---------------
-    rundata.gaugedata.gauges = params.gauges
+    rundata.gaugedata.gauges = list(params.gauges)  # coastal gauges are added below
     rundata.gaugedata.gtype = 'stationary'
     rundata.gaugedata.min_time_increment = 1. # seconds between gauge output
+    rundata.gaugedata.file_format = params.gauge_format  # 'binary' or 'ascii'
+    from tools.coastal_gauges import add_coastal_gauges
+    add_coastal_gauges(rundata, params.coastal_gauges_file, params.coastal_gauge_dt)
+
+    # ---------------
+    # Adjoint flagging:
+    # ---------------
+    if params.use_adjoint:
+        from tools.adjoint import configure_forward, adjoint_outdir
+        configure_forward(rundata, adjoint_outdir(params.project),
+                          params.adjoint_tolerance)
+
+    # ---------------
+    # Regridding settings measured by tools/autotune.py, if any:
+    # ---------------
+    from tools.autotune import apply_profile
+    apply_profile(rundata, params.amr_profile)
     
     
 
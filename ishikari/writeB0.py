@@ -1,4 +1,5 @@
 import os
+import sys
 from pylab import *
 from clawpack.geoclaw import fgmax_tools
 
@@ -12,13 +13,23 @@ dir = '/Users/anitamiddleton/Documents/python/tsunami_proj'
 
 outdir = os.path.join(dir, 'outputs/ishikari/_output')
 print('Using output from outdir = ', outdir)
-# Read fgmax data:
-fg = fgmax_tools.FGmaxGrid()
+# Read fgmax data, merging the per-site grids if params.use_fgmax_sites
+# (the B0 file then matches tools.fgmax_sites.read_merged):
+sys.path.insert(0, os.environ.get('PROJ', dir))
+from tools.fgmax_cache import num_fgmax_grids
+from tools.fgmax_sites import merge_fgmax_grids, write_b0_layout
+
 fgmax_input_file_name = outdir + '/fgmax_grids.data'
 print('fgmax input file: \n  %s' % fgmax_input_file_name)
-fg.read_fgmax_grids_data(fgno=1, data_file=fgmax_input_file_name)
-fg.read_output(outdir=outdir)
+fgs = []
+for fgno in range(1, num_fgmax_grids(fgmax_input_file_name) + 1):
+    fg = fgmax_tools.FGmaxGrid()
+    fg.read_fgmax_grids_data(fgno=fgno, data_file=fgmax_input_file_name)
+    fg.read_output(outdir=outdir)
+    fgs.append(fg)
+fg = merge_fgmax_grids(fgs)
 B0 = where(fg.B > -1e9, fg.B, -9999.)
 fname = os.path.join(dir, 'scratch/ishikari/ishikari_B0.txt')
 savetxt(fname, B0, fmt='%.3f')
+write_b0_layout(fname, [os.path.basename(fg.xy_fname) for fg in fgs])
 print('saved %s' % fname)
\ No newline at end of file
@@ -0,0 +1,39 @@
+"""
+Helpers shared by the project directories (ishikari, tokachi, tokachi2003, urakawa1982).
+
+Run modules from the repo root (or with PYTHONPATH pointing to it), e.g.
+
+    python -m tools.fgmax_cache $OUTPUT/_output tokachi
+"""
+
+import os
+import sys
+
+# top of the repo, same directory the PROJ environment variable should point to
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+scratch_dir = os.path.join(root_dir, 'scratch')
+
+projects = ['ishikari', 'tokachi', 'tokachi2003', 'urakawa1982']
+
+
+def outputs_dir():
+    """
+    Directory holding the outputs of all projects, $OUTPUTS if it is set
+    ($OUTPUT is the output directory of one project, as in the Makefiles).
+    """
+    return os.environ.get('OUTPUTS', os.path.join(root_dir, 'outputs'))
+
+
+def which_test(project):
+    """
+    Name of the test in scratch/<project> to use: $TSUNAMI_TEST if it is
+    set, otherwise asked for at the terminal.  Batch jobs (no terminal)
+    must set TSUNAMI_TEST.
+    """
+    test = os.environ.get('TSUNAMI_TEST')
+    if test:
+        return test
+    if not sys.stdin.isatty():
+        raise Exception("*** Set TSUNAMI_TEST to the test in scratch/%s to run" \
+                        % project)
+    return input("Which test in the scratch directory from this project would you like to run? ")
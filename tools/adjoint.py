@@ -0,0 +1,225 @@
+"""
+Adjoint-guided refinement targeted at the gauges and fgmax sites.
+
+With wave_tolerance flagging every wave gets refined, including the ones
+heading away from Hokkaido.  The adjoint run starts a Gaussian hump of
+surface elevation at each gauge in params.gauges and each fgmax grid, and
+is run forward over the same time span on the same topo (the linearized
+shallow water equations are self-adjoint up to time reversal).  Its binary
+snapshots tell the forward run which waves will reach the targets before
+the end of the run, and only those are flagged (see
+clawpack/geoclaw/examples/tsunami/chile2010_adjoint).
+
+The adjoint solution depends only on the targets and the topo, not on the
+earthquake, so one adjoint run per project serves every test.  To use it
+set params.use_adjoint = True after
+
+    python -m tools.adjoint tokachi run
+
+and to compare with the current wave_tolerance flagging on a shorter run
+
+    python -m tools.adjoint tokachi compare --end-time 3600
+"""
+
+import os
+import copy
+import numpy as np
+
+from tools import outputs_dir, runs
+from tools.timing import read_timing
+
+
+def adjoint_outdir(project):
+    return os.path.join(outputs_dir(), project, '_adjoint', '_output')
+
+
+def targets(rundata, gauge_radius=0.05):
+    """
+    [(x, y, radius)] of the humps: one per gauge and one per fgmax grid,
+    the latter sized to the grid.
+    """
+    from tools.fgmax_sites import mask_extent
+
+    hump = []
+    for gauge in rundata.gaugedata.gauges:
+        hump.append((gauge[1], gauge[2], gauge_radius))
+    for fg in rundata.fgmax_data.fgmax_grids:
+        if fg.point_style != 4:
+            continue
+        x1, x2, y1, y2 = mask_extent(fg.xy_fname)
+        radius = max(gauge_radius, 0.5*min(x2 - x1, y2 - y1))
+        hump.append((0.5*(x1 + x2), 0.5*(y1 + y2), radius))
+    return hump
+
+
+def write_hump(fname, hump, dx=1./60.):
+    """
+    Write the sum of Gaussian humps of height 1 m as an xyz (topo_type 1)
+    file covering all of them.
+    """
+    x1 = min(x - 3*r for x, y, r in hump)
+    x2 = max(x + 3*r for x, y, r in hump)
+    y1 = min(y - 3*r for x, y, r in hump)
+    y2 = max(y + 3*r for x, y, r in hump)
+    x = np.arange(x1, x2 + dx/2, dx)
+    y = np.arange(y1, y2 + dx/2, dx)
+    X, Y = np.meshgrid(x, y)
+    eta = np.zeros(X.shape)
+    for xc, yc, r in hump:
+        eta += np.exp(-((X - xc)**2 + (Y - yc)**2) / r**2)
+    # topo_type 1 lists rows from the north edge down
+    xyz = np.vstack([X[::-1].ravel(), Y[::-1].ravel(), eta[::-1].ravel()]).T
+    np.savetxt(fname, xyz, fmt='%.6f')
+    print('Created %s' % fname)
+
+
+def adjoint_rundata(rundata, hump_fname, amr_max=3, dt_output=600.):
+    """
+    Rundata for the adjoint run: no earthquake, the hump as initial surface
+    perturbation, no forced refinement, binary snapshots every dt_output.
+    """
+    rundata = copy.deepcopy(rundata)
+    runs.reduce_rundata(rundata, amr_max=amr_max,
+                        num_output_times=int(np.ceil(rundata.clawdata.tfinal / dt_output)))
+    rundata.clawdata.output_format = 'binary'
+    rundata.clawdata.output_t0 = True
+
+    rundata.dtopo_data.dtopofiles = []
+    rundata.qinit_data.qinit_type = 4   # perturbation to the surface eta
+    rundata.qinit_data.qinitfiles = [[hump_fname]]
+
+    rundata.fgmax_data.fgmax_grids = []
+    rundata.gaugedata.gauges = []
+    rundata.flagregiondata.flagregions = [
+        flagregion for flagregion in rundata.flagregiondata.flagregions
+        if flagregion.minlevel <= 1]
+    return rundata
+
+
+def configure_forward(rundata, outdir, tolerance, t1=0., t2=None):
+    """
+    Flag the forward run by the adjoint-weighted error instead of
+    wave_tolerance, using the adjoint snapshots in outdir for the
+    time window [t1, t2] of interest (default: the whole run).
+    """
+    if not os.path.isdir(outdir):
+        print("*** Warning: adjoint output %s does not exist yet, run" % outdir)
+        print("    python -m tools.adjoint <project> run")
+
+    adjointdata = rundata.adjointdata
+    adjointdata.use_adjoint = True
+    adjointdata.adjoint_outdir = outdir
+    adjointdata.t1 = t1
+    adjointdata.t2 = rundata.clawdata.tfinal if t2 is None else t2
+
+    # an additional aux variable holds the inner product with the adjoint
+    rundata.amrdata.aux_type.append('center')
+    rundata.clawdata.num_aux = len(rundata.amrdata.aux_type)
+    adjointdata.innerprod_index = len(rundata.amrdata.aux_type)
+
+    rundata.amrdata.flag_richardson = False
+    rundata.amrdata.flag2refine = True
+    rundata.amrdata.flag2refine_tol = tolerance
+    return rundata
+
+
+def run_adjoint(project, amr_max=3, dt_output=600., xgeoclaw=None):
+    rundata = runs.load_rundata(project)
+    outdir = adjoint_outdir(project)
+    rundir = os.path.dirname(outdir)
+    os.makedirs(rundir, exist_ok=True)
+
+    hump_fname = os.path.join(rundir, 'hump.xyz')
+    write_hump(hump_fname, targets(rundata))
+    adjoint = adjoint_rundata(rundata, hump_fname, amr_max, dt_output)
+    runs.write_rundata(adjoint, rundir)
+
+    print('Adjoint run in %s' % outdir)
+    result = runs.run_xgeoclaw(rundir, outdir, xgeoclaw)
+    if result['returncode'] != 0:
+        raise Exception("*** adjoint run failed, see %s" % result['log'])
+    print('Adjoint run took %.1f s' % result['wall'])
+
+
+def compare(project, end_time=None, tolerance=0.004, ref_factor=0.1,
+            xgeoclaw=None):
+    """
+    Run the forward problem with wave_tolerance flagging, with adjoint
+    flagging, and a reference with wave_tolerance * ref_factor, and report
+    cell updates, wall time and gauge error against the reference.
+    """
+    from tools.gauge_compare import gauge_difference
+
+    rundata = runs.load_rundata(project)
+    import params
+    if rundata.adjointdata.use_adjoint:
+        raise Exception("*** Set use_adjoint = False in params.py to compare")
+    if end_time is not None:
+        runs.reduce_rundata(rundata, end_time=end_time)
+    wave_tolerance = rundata.refinement_data.wave_tolerance
+
+    compare_dir = os.path.join(outputs_dir(), project, params.which_test,
+                               '_adjoint_compare')
+    cases = {}
+    reference = copy.deepcopy(rundata)
+    reference.refinement_data.wave_tolerance = wave_tolerance * ref_factor
+    cases['reference'] = reference
+    cases['wave_tolerance'] = copy.deepcopy(rundata)
+    cases['adjoint'] = configure_forward(copy.deepcopy(rundata),
+                                         adjoint_outdir(project), tolerance)
+
+    results = {}
+    for name, case in cases.items():
+        rundir = os.path.join(compare_dir, name)
+        outdir = os.path.join(rundir, '_output')
+        print('Running %s' % name)
+        runs.write_rundata(case, rundir)
+        result = runs.run_xgeoclaw(rundir, outdir, xgeoclaw)
+        if result['returncode'] != 0:
+            raise Exception("*** %s run failed, see %s" % (name, result['log']))
+        timing = read_timing(outdir) or {}
+        results[name] = (outdir, result['wall'],
+                         (timing.get('integration') or {}).get('cells', np.nan))
+
+    gaugenos = [gauge[0] for gauge in rundata.gaugedata.gauges]
+    ref_outdir = results['reference'][0]
+    lines = ['%-16s %10s %14s' % ('flagging', 'wall (s)', 'cell updates') +
+             ''.join(' %16s' % ('gauge %i rms/max' % g) for g in gaugenos)]
+    for name, (outdir, wall, cells) in results.items():
+        diffs = gauge_difference(outdir, ref_outdir, gaugenos)
+        lines.append('%-16s %10.1f %14.3e' % (name, wall, cells) +
+                     ''.join(' %7.3f/%7.3f ' % diffs[g] for g in gaugenos))
+    report = '\n'.join(lines)
+    print(report)
+
+    fname = os.path.join(compare_dir, 'adjoint_report.txt')
+    with open(fname, 'w') as f:
+        f.write('wave_tolerance = %g, adjoint tolerance = %g, reference '
+                'wave_tolerance = %g\n\n' % (wave_tolerance, tolerance,
+                                            wave_tolerance * ref_factor))
+        f.write(report + '\n')
+    print('Created %s' % fname)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Adjoint run and adjoint-flagging comparison for a project.')
+    parser.add_argument('project')
+    parser.add_argument('action', choices=['run', 'compare'])
+    parser.add_argument('--amr-max', type=int, default=3,
+                        help='levels for the adjoint run (default 3)')
+    parser.add_argument('--dt-output', type=float, default=600.,
+                        help='seconds between adjoint snapshots (default 600)')
+    parser.add_argument('--end-time', type=float, default=None,
+                        help='shorter forward runs for compare')
+    parser.add_argument('--tolerance', type=float, default=0.004,
+                        help='adjoint flagging tolerance (default 0.004)')
+    parser.add_argument('--xgeoclaw', default=None)
+    args = parser.parse_args()
+
+    if args.action == 'run':
+        run_adjoint(args.project, args.amr_max, args.dt_output, args.xgeoclaw)
+    else:
+        compare(args.project, args.end_time, args.tolerance,
+                xgeoclaw=args.xgeoclaw)
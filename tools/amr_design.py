@@ -0,0 +1,306 @@
+"""
+Design the AMR hierarchy of a project from the resolutions it needs.
+
+params.refinement_ratios = [5, 6, 4, 6, 10] over the 2 degree coarse grid
+gives 24', 4', 1', 10" and 1" on levels 2 to 6, whatever the topo (15") and
+the fgmax grids (also 15") can use.  Given the resolution wanted on each
+level, or only the finest one (by default the finer of the topo and fgmax
+resolutions, so the finest level matches the fgmax lattice), this picks
+integer ratios that reach it, amr_max, and num_cells for the domain, and
+estimates from the flagregions how many cells each level can have:
+
+  - forced: the area of the flagregions with minlevel >= level, which is
+    refined to the level whatever the flagging does,
+  - allowed: the area of those with maxlevel >= level, the most it can be.
+
+Areas come from rasterizing the flagregions (rectangles and ruled
+rectangles) on a grid of about `resolution` over the domain, with each
+flagregion counted if it is active at any time (or at a given time).
+The flagregions of params.py set their levels from amr_max, so the
+designed table is made from setrun.py run again on a copy of params.py with
+the designed amr_max and refinement_ratios.  tools/cost_estimate.py uses
+the same helpers.
+
+Usage, from the top of the repo:
+
+    python -m tools.amr_design tokachi
+    python -m tools.amr_design tokachi --resolutions 30m 5m 1m 15s
+"""
+
+import os
+import sys
+import ast
+import types
+import importlib
+import itertools
+import numpy as np
+
+from tools import runs
+from tools.arrival_times import region_mask
+
+_units = {'d': 1., 'm': 1./60., 's': 1./3600.}
+
+
+def parse_resolution(value):
+    """
+    Resolution in degrees from e.g. '2d', '24m', '15s' or '0.5' (degrees).
+    """
+    value = str(value).strip()
+    if value[-1] in _units:
+        return float(value[:-1]) * _units[value[-1]]
+    return float(value)
+
+
+def format_resolution(dx):
+    """
+    dx in degrees as the repo writes it: 2 degree, 24', 10".
+    """
+    seconds = dx * 3600.
+    if seconds >= 3600. - 1e-6:
+        return '%g degree' % round(dx, 6)
+    if seconds >= 60. - 1e-6:
+        return "%g'" % round(seconds / 60., 4)
+    return '%g"' % round(seconds, 4)
+
+
+def level_resolutions(dx1, ratios, amr_max):
+    """
+    Cell size on levels 1 to amr_max.
+    """
+    dxs = [dx1]
+    for ratio in ratios[:amr_max - 1]:
+        dxs.append(dxs[-1] / ratio)
+    return dxs
+
+
+def ratios_for(dx1, targets):
+    """
+    Smallest integer ratios from dx1 that get each level at least as fine
+    as targets (levels 2, 3, ...).
+    """
+    ratios, dx = [], dx1
+    for target in targets:
+        ratio = max(1, int(np.ceil(dx / target * (1. - 1e-4))))
+        ratios.append(ratio)
+        dx /= ratio
+    return ratios
+
+
+def even_ratios(total, num_ratios, max_ratio=10):
+    """
+    num_ratios integers up to max_ratio with product total, as close to
+    each other as possible and largest first, or None if there are none.
+    """
+    best = None
+    for ratios in itertools.combinations_with_replacement(
+            range(max_ratio, 1, -1), num_ratios):
+        if np.prod(ratios) != total:
+            continue
+        spread = np.std(np.log(ratios))
+        if best is None or spread < best[0]:
+            best = (spread, list(ratios))
+    return best and best[1]
+
+
+def design_ratios(dx1, finest, amr_max, max_ratio=10):
+    """
+    Ratios for amr_max levels from dx1 down to finest: exact and even if
+    dx1 / finest factors into amr_max - 1 ratios up to max_ratio, else
+    geometric targets rounded so each level is at least as fine.
+    """
+    total = dx1 / finest
+    if abs(total - round(total)) < 1e-4 * total:   # header cell sizes are rounded
+        ratios = even_ratios(int(round(total)), amr_max - 1, max_ratio)
+        if ratios:
+            return ratios
+    targets = [dx1 * (finest / dx1) ** (k / (amr_max - 1.))
+               for k in range(1, amr_max)]
+    return ratios_for(dx1, targets)
+
+
+def domain_num_cells(lower, upper, dx1):
+    """
+    num_cells and upper of the domain with coarse cell size dx1 that
+    covers lower to upper.
+    """
+    num_cells = [max(1, int(np.ceil((upper[k] - lower[k]) / dx1 - 1e-6)))
+                 for k in range(2)]
+    return num_cells, [lower[k] + num_cells[k] * dx1 for k in range(2)]
+
+
+def domain_grid(rundata, resolution=1./60.):
+    """
+    Points X, Y about resolution apart over the domain of rundata, and the
+    area in square degrees each one stands for.
+    """
+    clawdata = rundata.clawdata
+    nx = max(1, int(round((clawdata.upper[0] - clawdata.lower[0]) / resolution)))
+    ny = max(1, int(round((clawdata.upper[1] - clawdata.lower[1]) / resolution)))
+    hx = (clawdata.upper[0] - clawdata.lower[0]) / nx
+    hy = (clawdata.upper[1] - clawdata.lower[1]) / ny
+    x = clawdata.lower[0] + hx * (np.arange(nx) + 0.5)
+    y = clawdata.lower[1] + hy * (np.arange(ny) + 0.5)
+    X, Y = np.meshgrid(x, y)
+    return X, Y, hx * hy
+
+
+def flagregion_masks(rundata, X, Y):
+    """
+    {name: mask of X, Y inside the flagregion}.
+    """
+    return {flagregion.name: region_mask(X, Y, flagregion)
+            for flagregion in rundata.flagregiondata.flagregions}
+
+
+def level_areas(rundata, amr_max, X, Y, cell_area, masks=None, t=None):
+    """
+    Forced and allowed area (square degrees) of levels 1 to amr_max, see
+    the module docstring.  Level 1 is the whole domain.  If t is given only
+    the flagregions active at time t count.
+    """
+    if masks is None:
+        masks = flagregion_masks(rundata, X, Y)
+    domain_area = X.size * cell_area
+    areas = [(domain_area, domain_area)]
+    for level in range(2, amr_max + 1):
+        forced = np.zeros(X.shape, dtype=bool)
+        allowed = np.zeros(X.shape, dtype=bool)
+        for flagregion in rundata.flagregiondata.flagregions:
+            if t is not None and not flagregion.t1 <= t <= flagregion.t2:
+                continue
+            if flagregion.minlevel >= level:
+                forced |= masks[flagregion.name]
+            if flagregion.maxlevel >= level:
+                allowed |= masks[flagregion.name]
+        areas.append((forced.sum() * cell_area, allowed.sum() * cell_area))
+    return areas
+
+
+def designed_rundata(params, amr_max, ratios):
+    """
+    Rundata of setrun.py with params.py run again (for the same test) with
+    amr_max and refinement_ratios set to the design.
+    """
+    with open(params.__file__) as f:
+        tree = ast.parse(f.read(), params.__file__)
+    values = {'amr_max': amr_max, 'refinement_ratios': list(ratios)}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and \
+                isinstance(node.targets[0], ast.Name) and \
+                node.targets[0].id in values:
+            node.value = ast.parse(repr(values[node.targets[0].id]),
+                                   mode='eval').body
+    designed = types.ModuleType('params')
+    designed.__file__ = params.__file__
+    os.environ['TSUNAMI_TEST'] = params.which_test  # no second prompt
+    exec(compile(tree, params.__file__, 'exec'), designed.__dict__)
+
+    import setrun
+    sys.modules['params'] = designed
+    try:
+        return importlib.reload(setrun).setrun()
+    finally:
+        sys.modules['params'] = params
+        importlib.reload(setrun)
+
+
+def level_table(dxs, areas, ratios_t):
+    """
+    Rows (level, dx, forced cells, allowed cells, forced cell updates per
+    coarse step) for the levels, with cells = area / dx**2.
+    """
+    rows = []
+    substeps = 1
+    for level, (dx, (forced, allowed)) in enumerate(zip(dxs, areas), start=1):
+        if level > 1:
+            substeps *= ratios_t[level - 2]
+        forced_cells = forced / dx**2
+        rows.append({'level': level, 'dx': dx, 'forced_cells': forced_cells,
+                     'allowed_cells': allowed / dx**2,
+                     'forced_updates': forced_cells * substeps})
+    return rows
+
+
+def print_table(rows, title):
+    print(title)
+    print('%5s %12s %14s %14s %16s' % ('level', 'dx', 'forced cells',
+          'allowed cells', 'forced updates'))
+    for row in rows:
+        print('%5i %12s %14.3g %14.3g %16.3g' % (row['level'],
+              format_resolution(row['dx']), row['forced_cells'],
+              row['allowed_cells'], row['forced_updates']))
+    print('%5s %12s %14.3g %14s %16.3g' % ('total', '',
+          sum(row['forced_cells'] for row in rows), '',
+          sum(row['forced_updates'] for row in rows)))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Refinement ratios, amr_max and num_cells from target resolutions.')
+    parser.add_argument('project')
+    parser.add_argument('--base', default=None,
+                        help='coarse cell size, e.g. 2d or 30m (default: as in params.py)')
+    parser.add_argument('--resolutions', nargs='+', default=None,
+                        help='cell size wanted on levels 2, 3, ..., e.g. 24m 4m 1m 15s '
+                             '(default: from the base down to --finest in amr_max levels)')
+    parser.add_argument('--finest', default=None,
+                        help='finest cell size (default: the finer of the topo '
+                             'and fgmax resolutions)')
+    parser.add_argument('--amr-max', type=int, default=None,
+                        help='levels when --resolutions is not given (default: as in params.py)')
+    parser.add_argument('--resolution', type=float, default=1.,
+                        help='grid for the flagregion areas, in minutes (default 1)')
+    args = parser.parse_args()
+
+    from tools.fgmax_sites import mask_header
+    rundata = runs.load_rundata(args.project)
+    import params
+
+    clawdata = rundata.clawdata
+    dx1_now = (clawdata.upper[0] - clawdata.lower[0]) / clawdata.num_cells[0]
+    dx1 = parse_resolution(args.base) if args.base else dx1_now
+
+    topo_dx = mask_header(rundata.topo_data.topofiles[0][-1])['cellsize']
+    fgmax_dx = min([mask_header(fg.xy_fname)['cellsize'] for fg
+                    in rundata.fgmax_data.fgmax_grids if fg.point_style == 4]
+                   or [topo_dx])
+    print('topo %s, fgmax %s' % (format_resolution(topo_dx),
+                                 format_resolution(fgmax_dx)))
+
+    if args.resolutions:
+        ratios = ratios_for(dx1, [parse_resolution(r) for r in args.resolutions])
+    else:
+        finest = parse_resolution(args.finest) if args.finest \
+            else min(topo_dx, fgmax_dx)
+        ratios = design_ratios(dx1, finest, args.amr_max or params.amr_max)
+    amr_max = len(ratios) + 1
+    num_cells, upper = domain_num_cells(clawdata.lower, clawdata.upper, dx1)
+
+    X, Y, cell_area = domain_grid(rundata, args.resolution / 60.)
+    masks = flagregion_masks(rundata, X, Y)
+
+    now = level_resolutions(dx1_now, params.refinement_ratios, params.amr_max)
+    print_table(level_table(now, level_areas(rundata, params.amr_max, X, Y,
+                                             cell_area, masks),
+                            params.refinement_ratios),
+                'Now (amr_max = %i):' % params.amr_max)
+    print()
+    dxs = level_resolutions(dx1, ratios, amr_max)
+    designed = designed_rundata(params, amr_max, ratios)
+    print_table(level_table(dxs, level_areas(designed, amr_max, X, Y, cell_area,
+                                             flagregion_masks(designed, X, Y)),
+                            ratios),
+                'Designed (amr_max = %i):' % amr_max)
+    if abs(fgmax_dx / dxs[-1] - round(fgmax_dx / dxs[-1])) > 1e-3:
+        print('*** finest cell size %s does not divide the fgmax cell size %s' \
+              % (format_resolution(dxs[-1]), format_resolution(fgmax_dx)))
+
+    print()
+    print('# in %s/params.py:' % args.project)
+    print('amr_max = %i' % amr_max)
+    print('# refinement ratio from each level to the next: %s' \
+          % ', '.join(format_resolution(dx) for dx in dxs))
+    print('refinement_ratios = %s' % ratios)
+    print('upper = %s' % upper)
+    print('num_cells = %s' % num_cells)
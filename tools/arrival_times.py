@@ -0,0 +1,253 @@
+"""
+Estimate tsunami arrival times from the travel time of long waves over the
+topography, and gate the flagregions and fgmax grids of a test on them.
+
+Every flagregion in params.py is active from t1 = 0, so the coast is kept at
+amr_max long before the wave gets there.  This solves for the first arrival
+time T(x,y) of waves travelling at sqrt(g*h) from the cells the dtopo file
+deforms (a Dijkstra solve of the eikonal equation over a 16-neighbour stencil
+on a coarsened copy of the topo), takes the earliest arrival in each flagregion and fgmax grid, and
+writes t1 = arrival - margin to the refinement plan of the test, which
+params.py applies (see tools/refinement_plan.py).
+
+Regions containing part of the source (e.g. Region_domain) get arrival 0 and
+are left as they are.
+
+Usage, from the top of the repo:
+
+    python -m tools.arrival_times tokachi --margin 600
+"""
+
+import heapq
+import numpy as np
+
+from tools import runs
+from tools.refinement_plan import plan_path, write_plan
+
+earth_radius = 6367.5e3  # same as setrun.py
+
+neighbors = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+# with the knight moves, paths over the grid are at most a few % longer than
+# the straight line (8-neighbour ones up to 8% on square cells, 12% on the
+# cells of a lat-lon grid at 43N)
+stencil = neighbors + [(-2, -1), (-2, 1), (-1, -2), (-1, 2),
+                       (1, -2), (1, 2), (2, -1), (2, 1)]
+
+
+def path_factor(dx, dy, steps=stencil):
+    """
+    Largest ratio, over all directions, of the shortest path made of steps
+    (dj, di) on cells dx by dy (metres) to the straight line.  Between two
+    neighbouring steps u and v it is |w| for w with w.u = |u|, w.v = |v|.
+    """
+    vectors = sorted([np.array([di*dx, dj*dy]) for dj, di in steps],
+                     key=lambda v: np.arctan2(v[1], v[0]))
+    worst = 1.
+    for k in range(len(vectors)):
+        u, v = vectors[k], vectors[(k + 1) % len(vectors)]
+        w = np.linalg.solve([u, v], [np.hypot(*u), np.hypot(*v)])
+        worst = max(worst, np.hypot(*w))
+    return float(worst)
+
+
+def coarsen_topo(topo, resolution):
+    """
+    x, y, Z of topo subsampled to about resolution degrees.
+    """
+    stride = max(1, int(round(resolution / abs(topo.x[1] - topo.x[0]))))
+    return topo.x[::stride], topo.y[::stride], topo.Z[::stride, ::stride]
+
+
+def source_cells(dtopo, x, y, dz_tol=0.01):
+    """
+    Indices (j, i) on the x, y grid of cells deformed by more than dz_tol,
+    and the time each one is first deformed.
+    """
+    dZ = np.abs(dtopo.dZ)
+    if dZ.ndim == 2:
+        dZ = dZ[np.newaxis, :, :]
+    times = np.atleast_1d(dtopo.times)
+    moved = dZ > dz_tol
+    if not moved.any():
+        raise Exception("*** dtopo has no deformation larger than %g m" % dz_tol)
+
+    first = np.argmax(moved, axis=0)
+    jd, idx = np.nonzero(moved.any(axis=0))
+    t0 = times[first[jd, idx]]
+
+    i = np.clip(np.searchsorted(x, dtopo.x[idx]), 0, len(x) - 1)
+    j = np.clip(np.searchsorted(y, dtopo.y[jd]), 0, len(y) - 1)
+    return j, i, t0
+
+
+def travel_times(x, y, Z, src_j, src_i, src_t, gravity=9.81, min_depth=10.):
+    """
+    First arrival time (seconds) in each cell of the topo grid x, y, Z, for
+    waves starting in cells (src_j, src_i) at times src_t.  Land cells get
+    the time of their earliest wet neighbour, so coastal regions have a value.
+    """
+    ny, nx = Z.shape
+    wet = (Z < 0.).tolist()
+    c = np.sqrt(gravity * np.maximum(-Z, min_depth)).tolist()
+    dy = earth_radius * np.radians(abs(y[1] - y[0]))
+    dx = (earth_radius * np.cos(np.radians(y)) * np.radians(abs(x[1] - x[0]))).tolist()
+
+    T = [[np.inf]*nx for j in range(ny)]
+    heap = []
+    for j, i, t in zip(src_j.tolist(), src_i.tolist(), src_t.tolist()):
+        if t < T[j][i]:
+            T[j][i] = t
+            heap.append((t, j, i))
+    heapq.heapify(heap)
+
+    # cells a knight move crosses besides its end, both must be wet
+    crossed = {(dj, di): [(dj//2, 0), (dj//2, di)] if abs(dj) == 2 else
+               [(0, di//2), (dj, di//2)] for dj, di in stencil
+               if abs(dj) == 2 or abs(di) == 2}
+    while heap:
+        t, j, i = heapq.heappop(heap)
+        if t > T[j][i]:
+            continue
+        for dj, di in stencil:
+            jj, ii = j + dj, i + di
+            if jj < 0 or jj >= ny or ii < 0 or ii >= nx or not wet[jj][ii]:
+                continue
+            if (dj, di) in crossed and not all(wet[j + cj][i + ci] for cj, ci
+                                               in crossed[(dj, di)]):
+                continue
+            dist = ((di*dx[j])**2 + (dj*dy)**2) ** 0.5
+            tt = t + 2.*dist / (c[j][i] + c[jj][ii])
+            if tt < T[jj][ii]:
+                T[jj][ii] = tt
+                heapq.heappush(heap, (tt, jj, ii))
+
+    # scale down by the worst path error on the cells of the grid (largest
+    # where they are the least square), so estimates stay on the early side
+    factor = max(path_factor(dxj, dy) for dxj in dx)
+    T = np.array(T)
+    T[np.isfinite(T)] /= factor
+
+    # land next to the sea arrives with its wet neighbours
+    land = ~np.array(wet)
+    Tpad = np.pad(T, 1, constant_values=np.inf)
+    Tnbr = np.min([Tpad[1+dj:ny+1+dj, 1+di:nx+1+di] for dj, di in neighbors], axis=0)
+    T = np.where(land & ~np.isfinite(T), Tnbr, T)
+    return T
+
+
+def region_mask(X, Y, flagregion):
+    """
+    True for grid points inside a flagregion (rectangle or ruled rectangle).
+    """
+    if flagregion.spatial_region_type == 1:
+        x1, x2, y1, y2 = flagregion.spatial_region
+        return (X >= x1) & (X <= x2) & (Y >= y1) & (Y <= y2)
+    else:
+        from clawpack.amrclaw import region_tools
+        rr = region_tools.RuledRectangle(flagregion.spatial_region_file)
+        return ~rr.mask_outside(X, Y)
+
+
+def extent_mask(X, Y, extent):
+    x1, x2, y1, y2 = extent
+    return (X >= x1) & (X <= x2) & (Y >= y1) & (Y <= y2)
+
+
+def earliest(T, mask):
+    """
+    Earliest arrival in T over mask, None if the mask holds no grid points
+    or the waves never get there.
+    """
+    if not mask.any():
+        return None
+    t = T[mask].min()
+    return float(t) if np.isfinite(t) else None
+
+
+def source_travel_times(rundata, resolution=2./60., dz_tol=0.01):
+    """
+    x, y, Z of the coarsened topo of rundata and the travel times T from
+    its dtopo source on that grid.
+    """
+    from clawpack.geoclaw import topotools, dtopotools
+
+    topo_type, topo_fname = rundata.topo_data.topofiles[0][:2]
+    topo = topotools.Topography(topo_fname, topo_type=topo_type)
+    x, y, Z = coarsen_topo(topo, resolution)
+
+    if len(rundata.dtopo_data.dtopofiles) == 0:
+        raise Exception("*** No dtopo file in rundata (is makeB0 True?)")
+    dtopo_type, dtopo_fname = rundata.dtopo_data.dtopofiles[0][:2]
+    dtopo = dtopotools.DTopography(dtopo_fname, dtopo_type=dtopo_type)
+
+    src_j, src_i, src_t = source_cells(dtopo, x, y, dz_tol)
+    print('Solving for travel times on a %i by %i grid from %i source cells' \
+          % (len(x), len(y), len(src_j)))
+    T = travel_times(x, y, Z, src_j, src_i, src_t,
+                     gravity=rundata.geo_data.gravity)
+    return x, y, Z, T
+
+
+def arrival_plan(rundata, margin=600., resolution=2./60., dz_tol=0.01):
+    """
+    Plan (see tools/refinement_plan.py) with t1 / tstart_max set to
+    margin seconds before the estimated arrival in each region.
+    """
+    from tools.fgmax_sites import mask_extent
+
+    x, y, Z, T = source_travel_times(rundata, resolution, dz_tol)
+    X, Y = np.meshgrid(x, y)
+
+    plan = {'method': 'travel_time', 'margin': margin,
+            'flagregions': {}, 'fgmax_grids': {}}
+    for flagregion in rundata.flagregiondata.flagregions:
+        arrival = earliest(T, region_mask(X, Y, flagregion))
+        if arrival is None:
+            continue
+        plan['flagregions'][flagregion.name] = \
+            {'arrival': arrival, 't1': max(0., arrival - margin)}
+
+    for fg in rundata.fgmax_data.fgmax_grids:
+        if fg.point_style != 4:
+            continue
+        arrival = earliest(T, extent_mask(X, Y, mask_extent(fg.xy_fname)))
+        if arrival is None:
+            continue
+        plan['fgmax_grids'][str(fg.fgno)] = \
+            {'arrival': arrival, 'tstart_max': max(0., arrival - margin)}
+
+    return plan
+
+
+def print_plan(plan, end_time):
+    print('%-24s %12s %10s' % ('region', 'arrival (min)', 't1 (min)'))
+    for name, entry in plan['flagregions'].items():
+        print('%-24s %12.1f %10.1f' % (name, entry['arrival']/60., entry['t1']/60.))
+    for fgno, entry in plan['fgmax_grids'].items():
+        print('%-24s %12.1f %10.1f' % ('fgmax grid %s' % fgno,
+              entry['arrival']/60., entry['tstart_max']/60.))
+    gated = [e['t1'] for e in plan['flagregions'].values()]
+    if gated:
+        print('Flagregions are inactive for %.0f%% of the run time on average' \
+              % (100. * np.mean(gated) / end_time))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Gate flagregions and fgmax grids on estimated arrival times.')
+    parser.add_argument('project')
+    parser.add_argument('--margin', type=float, default=600.,
+                        help='seconds before the estimated arrival (default 600)')
+    parser.add_argument('--resolution', type=float, default=2.,
+                        help='topo resolution for the solve, in minutes (default 2)')
+    parser.add_argument('--dz-tol', type=float, default=0.01,
+                        help='deformation (m) that counts as source (default 0.01)')
+    args = parser.parse_args()
+
+    rundata = runs.load_rundata(args.project)
+    import params
+
+    plan = arrival_plan(rundata, args.margin, args.resolution/60., args.dz_tol)
+    print_plan(plan, rundata.clawdata.tfinal)
+    write_plan(plan_path(params.test_dir), plan)
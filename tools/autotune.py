@@ -0,0 +1,262 @@
+"""
+Measure the regridding and flagging settings of a project instead of
+copying them between setrun.py files.
+
+regrid_interval, regrid_buffer_width, clustering_cutoff, max1d and
+wave_tolerance trade wall time against accuracy, and the best values depend
+on the project and the machine.  This runs a short segment of a test
+(end_time seconds, default one hour) with the settings of setrun.py as the
+reference, then with other settings, searching either
+
+  - coordinate: one setting at a time, keeping the best value of each
+    before going on to the next, for a few passes (default), or
+  - grid: every combination of the values.
+
+A run is acceptable if eta at every gauge stays within max_diff of the
+reference run (tools/gauge_compare.py), and the fastest acceptable run
+wins.  Wall times vary from run to run by about as much as the settings
+change them, so the reference is run repeats times (default 3) and the
+range of its wall times is the noise: the coordinate search only takes a
+value that is faster by more than that, and the winner is run repeats times
+too.  Its settings are written to params.amr_profile (a json file in
+scratch/<project>), which setrun.py applies on top of its own values, only
+if all its runs are faster than all those of the reference.
+
+Usage, from the top of the repo:
+
+    python -m tools.autotune tokachi --end-time 3600 --max-diff 0.02 --repeats 3
+    python -m tools.autotune tokachi --search grid --max1d 30 60 --clustering-cutoff 0.6 0.7 0.8
+"""
+
+import os
+import copy
+import csv
+import json
+import itertools
+import functools
+import numpy as np
+
+from tools import outputs_dir, runs
+from tools.timing import read_timing
+
+# values tried for each setting, and where it lives in rundata
+space = {
+    'regrid_interval': [2, 3, 4, 6],
+    'regrid_buffer_width': [1, 2, 3],
+    'clustering_cutoff': [0.6, 0.7, 0.8],
+    'max1d': [30, 60, 120],
+    'wave_tolerance': [0.005, 0.01, 0.02],
+}
+_data = {'regrid_interval': 'amrdata', 'regrid_buffer_width': 'amrdata',
+         'clustering_cutoff': 'amrdata', 'max1d': 'amrdata',
+         'wave_tolerance': 'refinement_data'}
+
+columns = ['case'] + list(space) + ['wall', 'spread', 'runs', 'max_diff',
+                                    'rms_diff', 'ok']
+
+
+def get_settings(rundata):
+    return {name: getattr(getattr(rundata, data), name)
+            for name, data in _data.items()}
+
+
+def set_settings(rundata, settings):
+    for name, value in settings.items():
+        if name not in _data:
+            raise Exception("*** Unknown setting %s" % name)
+        setattr(getattr(rundata, _data[name]), name, value)
+    return rundata
+
+
+def read_profile(fname):
+    if fname is None or not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        return json.load(f)
+
+
+def apply_profile(rundata, fname):
+    """
+    Set the settings in the profile fname on rundata, if there is one.
+    """
+    profile = read_profile(fname)
+    if profile is not None:
+        set_settings(rundata, profile['settings'])
+    return rundata
+
+
+def case_name(settings):
+    return 'ri%i_bw%i_cc%g_m%i_wt%g' % tuple(settings[name] for name in space)
+
+
+def run_case(settings, base, tune_dir, reference, max_diff, rows,
+             xgeoclaw=None, env=None, repeats=1):
+    """
+    Run base with settings until it has repeats wall times (rows holds the
+    results by case name) and score it against the run with the reference
+    settings, which has to be run first.  The row's wall is the median of
+    the runs and spread their range.
+    """
+    from tools.gauge_compare import gauge_difference
+
+    case = case_name(settings)
+    row = rows.get(case)
+    if row is not None and row['runs'] >= repeats:
+        return row
+    rundata = set_settings(copy.deepcopy(base), settings)
+    rundir = os.path.join(tune_dir, case)
+    outdir = os.path.join(rundir, '_output')
+    runs.write_rundata(rundata, rundir)
+    walls = row['walls'] if row is not None else []
+    while len(walls) < repeats:
+        print('Running %s (%i of %i)' % (case, len(walls) + 1, repeats))
+        result = runs.run_xgeoclaw(rundir, outdir, xgeoclaw, env=env)
+        if result['returncode'] != 0:
+            raise Exception("*** xgeoclaw failed for %s, see %s" \
+                            % (case, result['log']))
+        walls.append((read_timing(outdir) or {}).get('wall') or result['wall'])
+
+    if row is None:
+        ref_outdir = os.path.join(tune_dir, case_name(reference), '_output')
+        gaugenos = [gauge[0] for gauge in base.gaugedata.gauges]
+        diffs = gauge_difference(outdir, ref_outdir, gaugenos)
+        row = dict(settings, case=case, walls=walls,
+                   max_diff=max([d[1] for d in diffs.values()] or [0.]),
+                   rms_diff=max([d[0] for d in diffs.values()] or [0.]))
+        row['ok'] = bool(row['max_diff'] <= max_diff)
+    row.update(wall=float(np.median(walls)), spread=max(walls) - min(walls),
+               runs=len(walls))
+    print('  %.1f s (range %.1f s over %i runs), max gauge difference %.4f m%s' \
+          % (row['wall'], row['spread'], row['runs'], row['max_diff'],
+             '' if row['ok'] else ' (too large)'))
+    rows[case] = row
+    return row
+
+
+def fastest(rows):
+    return min([row for row in rows.values() if row['ok']],
+               key=lambda row: row['wall'])
+
+
+def faster(row, ref_row):
+    """
+    True if every run of row was faster than every run of ref_row, i.e. the
+    speedup is larger than the run-to-run variation of either.
+    """
+    return max(row['walls']) < min(ref_row['walls'])
+
+
+def grid_search(run, reference, values, rows, repeats=1):
+    """
+    Run every combination of values, return the fastest acceptable row.
+    """
+    run(reference, repeats=repeats)
+    for combo in itertools.product(*[values[name] for name in space]):
+        run(dict(zip(space, combo)))
+    return fastest(rows)
+
+
+def coordinate_search(run, reference, values, rows, passes=2, repeats=1):
+    """
+    Starting from reference, try the values of one setting at a time with
+    the others at their best so far, taking a value only if it is faster by
+    more than the range of the reference's wall times.
+    """
+    best = run(reference, repeats=repeats)
+    noise = best['spread']
+    for k in range(passes):
+        changed = False
+        for name in space:
+            for value in values[name]:
+                settings = {n: best[n] for n in space}
+                settings[name] = value
+                row = run(settings)
+                if row['ok'] and row['wall'] < best['wall'] - noise:
+                    best, changed = row, True
+        if not changed:
+            break
+    return best
+
+
+def write_rows(rows, fname):
+    with open(fname, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    print('Created %s' % fname)
+
+
+def write_profile(fname, best, ref_row, reference, test, end_time, max_diff):
+    profile = {'settings': {name: best[name] for name in space},
+               'reference': reference, 'test': test, 'end_time': end_time,
+               'max_diff': max_diff, 'wall': best['wall'],
+               'walls': best['walls'], 'reference_walls': ref_row['walls']}
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname, 'w') as f:
+        json.dump(profile, f, indent=2)
+    print('Created %s' % fname)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Tune the regridding settings of a project on a short run.')
+    parser.add_argument('project')
+    parser.add_argument('--test', default=None,
+                        help='test to run (default: the first one)')
+    parser.add_argument('--end-time', type=float, default=3600.)
+    parser.add_argument('--max-diff', type=float, default=0.02,
+                        help='largest gauge eta difference (m) from the reference (default 0.02)')
+    parser.add_argument('--search', choices=['coordinate', 'grid'], default='coordinate')
+    for name, default in space.items():
+        parser.add_argument('--' + name.replace('_', '-'), nargs='+',
+                            type=type(default[0]), default=default)
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='runs of the reference and of the winner (default 3)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='OMP_NUM_THREADS for the runs')
+    parser.add_argument('--tune-dir', default=None,
+                        help='default: $OUTPUTS/_bench/autotune/<project>')
+    parser.add_argument('--xgeoclaw', default=None)
+    args = parser.parse_args()
+
+    from tools.run_scenarios import find_tests
+    test = args.test or find_tests(args.project)[0]
+    params = runs.load_params(args.project, test)
+    profile_fname = params.amr_profile
+    params.amr_profile = None   # the reference is setrun.py as it is
+    base = runs.load_rundata(args.project, test)
+    runs.reduce_rundata(base, end_time=args.end_time, num_output_times=1)
+    reference = get_settings(base)
+
+    tune_dir = args.tune_dir or os.path.join(outputs_dir(), '_bench', 'autotune',
+                                             args.project)
+    env = {'OMP_NUM_THREADS': str(args.threads)} if args.threads else None
+    rows = {}
+    run = functools.partial(run_case, base=base, tune_dir=tune_dir,
+                            reference=reference, max_diff=args.max_diff,
+                            rows=rows, xgeoclaw=args.xgeoclaw, env=env)
+    values = {name: getattr(args, name) for name in space}
+    if args.search == 'grid':
+        best = grid_search(run, reference, values, rows, args.repeats)
+    else:
+        best = coordinate_search(run, reference, values, rows,
+                                 repeats=args.repeats)
+    # the winner was picked from single runs, time it as often as the reference
+    best = run({name: best[name] for name in space}, repeats=args.repeats)
+
+    write_rows(list(rows.values()), os.path.join(tune_dir, 'autotune.csv'))
+    ref_row = rows[case_name(reference)]
+    print('Best: %s, %.1f s instead of %.1f s (%.2fx), max gauge difference %.4f m' \
+          % (best['case'], best['wall'], ref_row['wall'],
+             ref_row['wall'] / best['wall'], best['max_diff']))
+    if best['case'] == ref_row['case'] or not faster(best, ref_row):
+        print('*** %s is not faster than the reference beyond the run-to-run '
+              'variation (%.1f-%.1f s against %.1f-%.1f s), not writing the profile' \
+              % (best['case'], min(best['walls']), max(best['walls']),
+                 min(ref_row['walls']), max(ref_row['walls'])))
+    elif profile_fname is None:
+        print('*** params.amr_profile is None, not writing the profile')
+    else:
+        write_profile(profile_fname, best, ref_row, reference, test,
+                      args.end_time, args.max_diff)
@@ -0,0 +1,198 @@
+"""
+Benchmark the cost of fgmax monitoring on a reduced version of a project run.
+
+Runs the project's setrun.py with a shorter end_time and lower amr_max over
+a matrix of fg.dt_check, num_fgmax_val and fgmax point sets:
+
+    none    no fgmax grids (baseline cost of the run itself)
+    sites   the per-site grids from params.fgmax_sites
+    coast   the whole coastline mask as a single grid
+
+and writes a table of wall time, solver (integration) time, and the error in
+the maximum depth h relative to the dt_check = 0 run with the same points.
+
+Usage, from the top of the repo:
+
+    python -m tools.bench_fgmax tokachi --end-time 1800 --amr-max 4
+"""
+
+import os
+import copy
+import csv
+import json
+import numpy as np
+
+from tools import outputs_dir, scratch_dir
+from tools import runs
+from tools.timing import read_timing
+
+columns = ['case', 'point_set', 'npts', 'dt_check', 'num_fgmax_val',
+           'wall', 'cpu', 'solver_wall', 'cell_updates', 'h_err_max', 'h_err_rms']
+
+
+def point_set_grids(params, project, point_set, min_level_check):
+    """
+    fgmax grids and number of monitored points for one point set.
+    """
+    from clawpack.geoclaw import fgmax_tools
+    from tools.fgmax_sites import make_site_fgmax_grids, count_mask_points
+
+    mask_dir = os.path.join(scratch_dir, project)
+    if point_set == 'none':
+        fgmax_grids = []
+    elif point_set == 'sites':
+        fgmax_grids = make_site_fgmax_grids(params.fgmax_sites, mask_dir,
+                                            min_level_check)
+    elif point_set == 'coast':
+        fg = fgmax_tools.FGmaxGrid()
+        fg.fgno = 1
+        fg.point_style = 4
+        fg.xy_fname = os.path.join(mask_dir, 'fgmax_pts_topostyle.txt')
+        fg.tstart_max = 5.
+        fg.tend_max = params.end_time
+        fg.min_level_check = min_level_check
+        fgmax_grids = [fg]
+    else:
+        raise Exception("*** Unknown point set %s, expected none, sites or coast" \
+                        % point_set)
+    npts = sum(count_mask_points(fg.xy_fname) for fg in fgmax_grids)
+    return fgmax_grids, npts
+
+
+def read_max_depth(outdir):
+    """
+    Merged maximum depth h over all fgmax grids of a run.
+    """
+    from clawpack.geoclaw import fgmax_tools
+    from tools.fgmax_cache import num_fgmax_grids
+    from tools.fgmax_sites import merge_fgmax_grids
+
+    data_file = os.path.join(outdir, 'fgmax_grids.data')
+    fgs = []
+    for fgno in range(1, num_fgmax_grids(data_file) + 1):
+        fg = fgmax_tools.FGmaxGrid()
+        fg.read_fgmax_grids_data(fgno=fgno, data_file=data_file)
+        fg.read_output(outdir=outdir, verbose=False)
+        fgs.append(fg)
+    return merge_fgmax_grids(fgs).h
+
+
+def depth_error(h, h_ref):
+    """
+    Max and RMS difference of h from h_ref over points set in both.
+    """
+    diff = np.ma.abs(np.ma.masked_array(h) - np.ma.masked_array(h_ref)).compressed()
+    if len(diff) == 0:
+        return np.nan, np.nan
+    return diff.max(), np.sqrt((diff**2).mean())
+
+
+def benchmark(project, dt_checks, num_fgmax_vals, point_sets, end_time,
+              amr_max, bench_dir=None, xgeoclaw=None):
+    """
+    Run every case of the matrix and return a list of rows (dicts).
+    The dt_check = 0 case of each point set is run first as the reference.
+    """
+    base = runs.load_rundata(project)
+    import params
+
+    if bench_dir is None:
+        bench_dir = os.path.join(outputs_dir(), '_bench', 'fgmax', project)
+    os.makedirs(bench_dir, exist_ok=True)
+
+    amr_max = min(amr_max, base.amrdata.amr_levels_max)
+    runs.reduce_rundata(base, end_time=end_time, amr_max=amr_max,
+                        num_output_times=1)
+
+    dt_checks = sorted(set([0] + list(dt_checks)))
+    rows = []
+    for point_set in point_sets:
+        h_ref = None
+        for num_fgmax_val in num_fgmax_vals:
+            for dt_check in dt_checks:
+                if point_set == 'none' and (dt_check, num_fgmax_val) != \
+                        (0, num_fgmax_vals[0]):
+                    continue    # nothing to vary without fgmax points
+
+                case = '%s_dt%g_val%i' % (point_set, dt_check, num_fgmax_val)
+                rundir = os.path.join(bench_dir, case)
+                outdir = os.path.join(rundir, '_output')
+
+                rundata = copy.deepcopy(base)
+                fgmax_grids, npts = point_set_grids(params, project, point_set,
+                                                    amr_max)
+                for fg in fgmax_grids:
+                    fg.dt_check = dt_check
+                    fg.tend_max = min(fg.tend_max, end_time)
+                rundata.fgmax_data.fgmax_grids = fgmax_grids
+                rundata.fgmax_data.num_fgmax_val = num_fgmax_val
+
+                print('Running %s (%i fgmax points)' % (case, npts))
+                runs.write_rundata(rundata, rundir)
+                result = runs.run_xgeoclaw(rundir, outdir, xgeoclaw)
+                if result['returncode'] != 0:
+                    raise Exception("*** xgeoclaw failed for %s, see %s" \
+                                    % (case, result['log']))
+
+                timing = read_timing(outdir) or {}
+                integration = timing.get('integration') or {}
+                row = {'case': case, 'point_set': point_set, 'npts': npts,
+                       'dt_check': dt_check, 'num_fgmax_val': num_fgmax_val,
+                       'wall': result['wall'],
+                       'cpu': result['user'] + result['sys'],
+                       'solver_wall': integration.get('wall', np.nan),
+                       'cell_updates': integration.get('cells', np.nan),
+                       'h_err_max': np.nan, 'h_err_rms': np.nan}
+
+                if npts > 0:
+                    h = read_max_depth(outdir)
+                    if h_ref is None:
+                        h_ref = h
+                    row['h_err_max'], row['h_err_rms'] = depth_error(h, h_ref)
+                rows.append(row)
+
+    fname = os.path.join(bench_dir, 'fgmax_benchmark.csv')
+    with open(fname, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(bench_dir, 'fgmax_benchmark.json'), 'w') as f:
+        json.dump({'project': project, 'test': getattr(params, 'which_test', None),
+                   'end_time': end_time, 'amr_max': amr_max,
+                   'xgeoclaw': xgeoclaw or runs.default_xgeoclaw()}, f, indent=2)
+    print('Created %s' % fname)
+    return rows
+
+
+def print_table(rows):
+    print('%-22s %8s %8s %6s %10s %10s %12s %10s %10s' % ('case', 'npts',
+          'dt_check', 'nval', 'wall (s)', 'solver (s)', 'cell updates',
+          'h err max', 'h err rms'))
+    for row in rows:
+        print('%-22s %8i %8g %6i %10.1f %10.1f %12.3e %10.2e %10.2e' % (
+              row['case'], row['npts'], row['dt_check'], row['num_fgmax_val'],
+              row['wall'], row['solver_wall'], row['cell_updates'],
+              row['h_err_max'], row['h_err_rms']))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmark fgmax monitoring settings on a reduced run.')
+    parser.add_argument('project')
+    parser.add_argument('--end-time', type=float, default=1800.)
+    parser.add_argument('--amr-max', type=int, default=4)
+    parser.add_argument('--dt-check', type=float, nargs='+', default=[0, 5, 30])
+    parser.add_argument('--num-fgmax-val', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--point-sets', nargs='+',
+                        default=['none', 'sites', 'coast'])
+    parser.add_argument('--bench-dir', default=None,
+                        help='default: $OUTPUTS/_bench/fgmax/<project>')
+    parser.add_argument('--xgeoclaw', default=None,
+                        help='default: $PROJ/xgeoclaw')
+    args = parser.parse_args()
+
+    rows = benchmark(args.project, args.dt_check, args.num_fgmax_val,
+                     args.point_sets, args.end_time, args.amr_max,
+                     args.bench_dir, args.xgeoclaw)
+    print_table(rows)
@@ -0,0 +1,142 @@
+"""
+Compare the frame output formats (params.output_format) on a project run.
+
+Runs the same shortened test with ascii, binary64 and binary32 output and
+reports the disk space of the frames, the time GeoClaw spends writing them
+(from timing.txt), the time pyclaw takes to read them all back, and for
+the binary formats the largest difference in q from the ascii frames.
+
+Usage, from the top of the repo:
+
+    python -m tools.bench_output tokachi --end-time 3600 --num-output-times 12
+"""
+
+import os
+import copy
+import csv
+import glob
+import time
+import numpy as np
+
+from tools import outputs_dir, runs
+from tools.output_format import formats
+from tools.timing import read_timing
+
+columns = ['format', 'frames', 'mbytes', 'write_wall', 'read_wall', 'run_wall',
+           'max_q_diff']
+
+
+def frame_bytes(outdir):
+    """
+    Bytes in the frame files (fort.q, fort.t, fort.a, fort.b) of a run.
+    """
+    return sum(os.path.getsize(fname) for pattern in ['fort.q*', 'fort.t*',
+                                                      'fort.a*', 'fort.b*']
+               for fname in glob.glob(os.path.join(outdir, pattern)))
+
+
+def output_wall(timing):
+    for name, (wall, cpu) in timing.get('parts', {}).items():
+        if name.lower().startswith('output'):
+            return wall
+    return np.nan
+
+
+def read_frames(outdir, file_format):
+    """
+    All frames of a run as {frameno: [q of each patch]}.
+    """
+    from clawpack.pyclaw.solution import Solution
+
+    frames = {}
+    for fname in sorted(glob.glob(os.path.join(outdir, 'fort.t*'))):
+        frameno = int(os.path.basename(fname)[6:])
+        sol = Solution(frameno, path=outdir, file_format=file_format)
+        frames[frameno] = [state.q for state in sol.states]
+    return frames
+
+
+def max_difference(frames, ref_frames):
+    diff = 0.
+    for frameno, qs in frames.items():
+        for q, q_ref in zip(qs, ref_frames[frameno]):
+            diff = max(diff, np.abs(q - q_ref).max())
+    return diff
+
+
+def benchmark(project, test=None, end_time=3600., num_output_times=12,
+              amr_max=None, output_formats=formats, bench_dir=None,
+              xgeoclaw=None):
+    from tools.run_scenarios import find_tests
+
+    if test is None:
+        test = find_tests(project)[0]
+    base = runs.load_rundata(project, test)
+    runs.reduce_rundata(base, end_time=end_time, amr_max=amr_max,
+                        num_output_times=num_output_times)
+    if bench_dir is None:
+        bench_dir = os.path.join(outputs_dir(), '_bench', 'output', project)
+
+    rows = []
+    ref_frames = None
+    for file_format in output_formats:
+        rundata = copy.deepcopy(base)
+        rundata.clawdata.output_format = file_format
+        rundir = os.path.join(bench_dir, file_format)
+        outdir = os.path.join(rundir, '_output')
+        print('Running %s/%s with %s output' % (project, test, file_format))
+        runs.write_rundata(rundata, rundir)
+        result = runs.run_xgeoclaw(rundir, outdir, xgeoclaw)
+        if result['returncode'] != 0:
+            raise Exception("*** xgeoclaw failed for %s output, see %s" \
+                            % (file_format, result['log']))
+
+        t0 = time.time()
+        frames = read_frames(outdir, file_format)
+        read_wall = time.time() - t0
+
+        if ref_frames is None:
+            ref_frames = frames
+        rows.append({'format': file_format, 'frames': len(frames),
+                     'mbytes': frame_bytes(outdir) / 1e6,
+                     'write_wall': output_wall(read_timing(outdir) or {}),
+                     'read_wall': read_wall, 'run_wall': result['wall'],
+                     'max_q_diff': max_difference(frames, ref_frames)})
+
+    fname = os.path.join(bench_dir, 'output_benchmark.csv')
+    with open(fname, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    print('Created %s' % fname)
+    return rows
+
+
+def print_table(rows):
+    print('%-10s %7s %10s %10s %10s %10s %12s' % ('format', 'frames', 'MB',
+          'write (s)', 'read (s)', 'run (s)', 'max q diff'))
+    for row in rows:
+        print('%-10s %7i %10.1f %10.2f %10.2f %10.1f %12.3e' % (
+              row['format'], row['frames'], row['mbytes'], row['write_wall'],
+              row['read_wall'], row['run_wall'], row['max_q_diff']))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Compare disk use and write/read time of the output formats.')
+    parser.add_argument('project', nargs='?', default='tokachi')
+    parser.add_argument('--test', default=None,
+                        help='test to run (default: the first one)')
+    parser.add_argument('--end-time', type=float, default=3600.)
+    parser.add_argument('--num-output-times', type=int, default=12)
+    parser.add_argument('--amr-max', type=int, default=None)
+    parser.add_argument('--bench-dir', default=None,
+                        help='default: $OUTPUTS/_bench/output/<project>')
+    parser.add_argument('--xgeoclaw', default=None)
+    args = parser.parse_args()
+
+    rows = benchmark(args.project, args.test, args.end_time,
+                     args.num_output_times, args.amr_max,
+                     bench_dir=args.bench_dir, xgeoclaw=args.xgeoclaw)
+    print_table(rows)
@@ -0,0 +1,209 @@
+"""
+OpenMP thread scaling of the project runs.
+
+Runs a test of each project with a shorter end_time for 1, 2, 4, ... OpenMP
+threads (optionally for several max1d and clustering_cutoff values) and
+reads timing.txt of each run.  Reports the speedup and parallel efficiency
+of the whole run and of the integration, the share of regridding (which
+runs mostly serially, so it caps the speedup), and the wall time per
+million cell updates on each AMR level.  Grids are split into patches of
+at most max1d cells on a side and the patches are what the threads share
+out, so few large patches on the finest levels show up as poor scaling
+there.
+
+Uses the omp build of tools/build_cache.py unless --xgeoclaw is given.
+Each project runs in its own process (setrun.py imports params.py by name).
+
+Usage, from the top of the repo:
+
+    python -m tools.bench_threads tokachi ishikari urakawa1982 tokachi2003 --end-time 1800
+    python -m tools.bench_threads tokachi --threads 1 4 16 --max1d 30 60 120
+"""
+
+import os
+import sys
+import copy
+import csv
+import json
+import subprocess
+import numpy as np
+
+from tools import outputs_dir, runs
+from tools.timing import read_timing
+
+columns = ['project', 'test', 'max1d', 'clustering_cutoff', 'threads', 'wall',
+           'cpu', 'solver_wall', 'regrid_wall', 'cell_updates', 'speedup',
+           'efficiency', 'solver_speedup', 'regrid_fraction', 'levels']
+
+
+def bench_dir_for(project, bench_dir=None):
+    if bench_dir is None:
+        bench_dir = os.path.join(outputs_dir(), '_bench', 'threads')
+    return os.path.join(bench_dir, project)
+
+
+def benchmark(project, thread_counts, test=None, end_time=1800., max1ds=None,
+              cutoffs=None, bench_dir=None, xgeoclaw=None):
+    """
+    Run every case and return a list of rows (dicts).  Speedups are
+    relative to the smallest thread count with the same max1d and cutoff.
+    """
+    from tools.run_scenarios import find_tests
+
+    if test is None:
+        test = find_tests(project)[0]
+    if xgeoclaw is None:
+        from tools.build_cache import executable
+        xgeoclaw = executable(project, 'omp')
+
+    base = runs.load_rundata(project, test)
+    runs.reduce_rundata(base, end_time=end_time, num_output_times=1)
+    max1ds = max1ds or [base.amrdata.max1d]
+    cutoffs = cutoffs or [base.amrdata.clustering_cutoff]
+
+    pdir = bench_dir_for(project, bench_dir)
+    rows = []
+    for max1d in max1ds:
+        for cutoff in cutoffs:
+            rundata = copy.deepcopy(base)
+            rundata.amrdata.max1d = max1d
+            rundata.amrdata.clustering_cutoff = cutoff
+            case = 'max1d%i_cut%g' % (max1d, cutoff)
+            rundir = os.path.join(pdir, case)
+            runs.write_rundata(rundata, rundir)
+
+            first = None
+            for nthreads in sorted(thread_counts):
+                outdir = os.path.join(rundir, '_output_%02i' % nthreads)
+                print('Running %s/%s %s with %i threads' % (project, test, case,
+                                                           nthreads))
+                result = runs.run_xgeoclaw(rundir, outdir, xgeoclaw,
+                                           env={'OMP_NUM_THREADS': str(nthreads)})
+                if result['returncode'] != 0:
+                    raise Exception("*** xgeoclaw failed for %s with %i threads, "
+                                    "see %s" % (case, nthreads, result['log']))
+
+                timing = read_timing(outdir) or {}
+                integration = timing.get('integration') or {}
+                wall = timing.get('wall') or result['wall']
+                solver_wall = integration.get('wall', np.nan)
+                regrid_wall = timing.get('parts', {}).get('Regridding',
+                                                          (np.nan, np.nan))[0]
+                row = {'project': project, 'test': test, 'max1d': max1d,
+                       'clustering_cutoff': cutoff, 'threads': nthreads,
+                       'wall': wall, 'cpu': result['user'] + result['sys'],
+                       'solver_wall': solver_wall, 'regrid_wall': regrid_wall,
+                       'cell_updates': integration.get('cells', np.nan),
+                       'regrid_fraction': regrid_wall / wall,
+                       'levels': {level: (v['wall'], v['cells']) for level, v
+                                  in timing.get('levels', {}).items()}}
+                if first is None:
+                    first = row
+                row['speedup'] = first['wall'] * first['threads'] / wall
+                row['efficiency'] = row['speedup'] / nthreads
+                row['solver_speedup'] = first['solver_wall'] * first['threads'] \
+                    / solver_wall
+                rows.append(row)
+
+    fname = os.path.join(pdir, 'threads_benchmark.csv')
+    with open(fname, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(pdir, 'threads_benchmark.json'), 'w') as f:
+        json.dump(rows, f, indent=1)
+    print('Created %s' % fname)
+    return rows
+
+
+def read_rows(project, bench_dir=None):
+    with open(os.path.join(bench_dir_for(project, bench_dir),
+                           'threads_benchmark.json')) as f:
+        rows = json.load(f)
+    for row in rows:
+        row['levels'] = {int(level): v for level, v in row['levels'].items()}
+    return rows
+
+
+def print_table(rows):
+    print('%-12s %6s %6s %7s %10s %8s %6s %8s %8s' % ('project', 'max1d',
+          'cutoff', 'threads', 'wall (s)', 'speedup', 'eff', 'solver x',
+          'regrid %'))
+    for row in rows:
+        print('%-12s %6i %6g %7i %10.1f %8.2f %6.2f %8.2f %8.1f' % (
+              row['project'], row['max1d'], row['clustering_cutoff'],
+              row['threads'], row['wall'], row['speedup'], row['efficiency'],
+              row['solver_speedup'], 100. * row['regrid_fraction']))
+
+
+def print_levels(rows):
+    """
+    Wall time per million cell updates on each level, and its speedup.
+    """
+    levels = sorted(set(level for row in rows for level in row['levels']))
+    print('%-12s %6s %7s' % ('project', 'max1d', 'threads') +
+          ''.join(' %14s' % ('level %i us/cell' % level) for level in levels))
+    first = {}
+    for row in rows:
+        key = (row['project'], row['max1d'], row['clustering_cutoff'])
+        line = '%-12s %6i %7i' % (row['project'], row['max1d'], row['threads'])
+        for level in levels:
+            wall, cells = row['levels'].get(level, (np.nan, 0.))
+            cost = 1e6 * wall / cells if cells > 0 else np.nan
+            first.setdefault(key + (level,), (cost, row['threads']))
+            cost1, threads1 = first[key + (level,)]
+            line += ' %7.3f (%4.1fx)' % (cost, cost1 * threads1 / cost)
+        print(line)
+
+
+if __name__ == '__main__':
+    import argparse
+    from tools.scheduler import available_cores
+    parser = argparse.ArgumentParser(
+        description='OpenMP thread scaling benchmark of the project runs.')
+    parser.add_argument('projects', nargs='+')
+    parser.add_argument('--test', default=None,
+                        help='test to run (default: the first of each project)')
+    parser.add_argument('--end-time', type=float, default=1800.)
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--max1d', type=int, nargs='+', default=None,
+                        help='max1d values to try (default: as in setrun.py)')
+    parser.add_argument('--clustering-cutoff', type=float, nargs='+', default=None,
+                        help='clustering_cutoff values to try (default: as in setrun.py)')
+    parser.add_argument('--bench-dir', default=None,
+                        help='default: $OUTPUTS/_bench/threads')
+    parser.add_argument('--xgeoclaw', default=None,
+                        help='default: the omp build of tools/build_cache.py')
+    args = parser.parse_args()
+
+    cores = available_cores()
+    thread_counts = [n for n in args.threads if n <= cores]
+    if len(thread_counts) < len(args.threads):
+        print('*** Only %i cores, leaving out %s threads' \
+              % (cores, [n for n in args.threads if n > cores]))
+
+    if len(args.projects) == 1:
+        rows = benchmark(args.projects[0], thread_counts, args.test,
+                         args.end_time, args.max1d, args.clustering_cutoff,
+                         args.bench_dir, args.xgeoclaw)
+    else:
+        rows = []
+        for project in args.projects:
+            # one process per project, then read back the results
+            cmd = [sys.executable, '-m', 'tools.bench_threads', project,
+                   '--end-time', str(args.end_time),
+                   '--threads'] + [str(n) for n in thread_counts]
+            for name in ['test', 'max1d', 'clustering_cutoff', 'bench_dir',
+                         'xgeoclaw']:
+                value = getattr(args, name)
+                if value is not None:
+                    cmd += ['--' + name.replace('_', '-')] + \
+                        [str(v) for v in np.atleast_1d(value)]
+            if subprocess.call(cmd) != 0:
+                raise Exception("*** benchmark of %s failed" % project)
+            rows += read_rows(project, args.bench_dir)
+
+    print_table(rows)
+    print()
+    print_levels(rows)
@@ -0,0 +1,278 @@
+"""
+Cache of xgeoclaw builds, one per source set and compiler flags profile.
+
+The Makefiles all build the one $(PROJ)/xgeoclaw with empty FFLAGS, so any
+rebuild replaces the executable the other projects are running.  Here each
+build goes to $PROJ/_builds/<key>/xgeoclaw, where the key is a hash of the
+profile's FFLAGS, the compiler and the contents of every source file in
+the project's source lists (SOURCES, i.e. the Riemann solvers, plus the
+GeoClaw and AMRClaw library sources).  Projects with the same sources share
+builds.  Each build compiles in its own tree, _builds/<key>/claw, which
+links to the sources in $CLAW but gets its own object and module files, so
+it never touches the objects in $CLAW that a plain make .exe links.
+Profiles:
+
+    debug   -O0 -g with run time checks
+    opt     -O3
+    omp     -O3 -fopenmp
+
+In a project directory, make picks the cached executable (building it the
+first time) with
+
+    make .output BUILD_PROFILE=omp
+
+and the run tools take --profile.  To compare the solver throughput of the
+profiles on a shortened run of a test:
+
+    python -m tools.build_cache tokachi --bench --end-time 1800 --threads 8
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import subprocess
+import numpy as np
+
+from tools import root_dir, outputs_dir, runs
+from tools.run_cache import file_hash
+
+profiles = {
+    'debug': '-O0 -g -fcheck=all -ffpe-trap=invalid,overflow,zero',
+    'opt': '-O3',
+    'omp': '-O3 -fopenmp',
+}
+
+columns = ['profile', 'fflags', 'threads', 'wall', 'solver_wall',
+           'cell_updates', 'cells_per_s', 'speedup']
+
+
+def default_build_dir():
+    return os.path.join(os.environ.get('PROJ', root_dir), '_builds')
+
+
+def make_env():
+    """
+    Environment for make run from here: without the MAKEFLAGS of a make
+    we may have been called from, so BUILD_PROFILE is not passed on.
+    """
+    env = dict(os.environ)
+    for name in ['MAKEFLAGS', 'MFLAGS', 'MAKELEVEL']:
+        env.pop(name, None)
+    env.setdefault('PROJ', root_dir)
+    return env
+
+
+def source_files(project):
+    """
+    Every Fortran source the project's Makefile builds xgeoclaw from.
+    """
+    out = subprocess.run(['make', '-s', 'print_sources', 'BUILD_PROFILE='],
+                         cwd=runs.project_dir(project), env=make_env(),
+                         capture_output=True, text=True)
+    if out.returncode != 0:
+        raise Exception("*** make print_sources failed in %s:\n%s" \
+                        % (project, out.stderr))
+    return sorted(set(out.stdout.split()))
+
+
+def compiler():
+    fc = os.environ.get('FC', 'gfortran')
+    out = subprocess.run([fc, '--version'], capture_output=True, text=True)
+    version = out.stdout.splitlines()[0] if out.stdout else ''
+    return fc, version
+
+
+def build_key(project, profile):
+    if profile not in profiles:
+        raise Exception("*** Unknown build profile %s, use one of %s" \
+                        % (profile, ', '.join(profiles)))
+    h = hashlib.sha256()
+    h.update(('%s\n%s\n' % (profile, profiles[profile])).encode())
+    h.update(('%s\n%s\n' % compiler()).encode())
+    for fname in source_files(project):
+        h.update(os.path.basename(fname).encode())
+        h.update(file_hash(fname).encode())
+    return '%s-%s' % (profile, h.hexdigest()[:16])
+
+
+def mirror_sources(project, claw_dir):
+    """
+    Tree claw_dir with links to the files (but not the object and module
+    files) of $CLAW/clawutil/src and every directory the project's sources
+    are in, so make with CLAW=claw_dir compiles into claw_dir.
+    """
+    claw = os.path.realpath(os.environ['CLAW'])
+    dirs = set([os.path.join(claw, 'clawutil', 'src')])
+    for fname in source_files(project):
+        fname = os.path.realpath(fname)
+        if os.path.commonpath([fname, claw]) != claw:
+            raise Exception("*** %s is not in $CLAW, cannot build it apart" % fname)
+        dirs.add(os.path.dirname(fname))
+    for src_dir in dirs:
+        dest_dir = os.path.join(claw_dir, os.path.relpath(src_dir, claw))
+        os.makedirs(dest_dir, exist_ok=True)
+        for name in os.listdir(src_dir):
+            src = os.path.join(src_dir, name)
+            dest = os.path.join(dest_dir, name)
+            if os.path.isfile(src) and not name.endswith(('.o', '.mod', '.pyc')) \
+                    and not os.path.lexists(dest):
+                os.symlink(src, dest)
+
+
+def build(project, profile, build_dir=None, verbose=True):
+    """
+    Path of the cached xgeoclaw for this project and profile, compiled
+    first if it is not in the cache yet.
+    """
+    if build_dir is None:
+        build_dir = default_build_dir()
+    key = build_key(project, profile)
+    exe = os.path.join(build_dir, key, 'xgeoclaw')
+    if os.path.exists(exe):
+        return exe
+
+    key_dir = os.path.dirname(exe)
+    os.makedirs(key_dir, exist_ok=True)
+    # one build of a key at a time, builds of other keys have their own tree
+    with open(os.path.join(key_dir, 'build.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(exe):
+            return exe
+        log_fname = os.path.join(key_dir, 'build.log')
+        if verbose:
+            print('Building %s with FFLAGS = %s, log in %s' \
+                  % (key, profiles[profile], log_fname), file=sys.stderr)
+        t0 = time.time()
+        claw_dir = os.path.join(key_dir, 'claw')
+        mirror_sources(project, claw_dir)
+        # make runs in key_dir on a copy of the Makefile, so module files
+        # written to the current directory stay there too
+        shutil.copy(os.path.join(runs.project_dir(project), 'Makefile'), key_dir)
+        with open(log_fname, 'w') as log:
+            returncode = subprocess.call(['make', 'new', 'EXE=%s' % exe,
+                                          'CLAW=%s' % claw_dir,
+                                          'FFLAGS=%s' % profiles[profile],
+                                          'BUILD_PROFILE='],
+                                         cwd=key_dir, env=make_env(),
+                                         stdout=log, stderr=subprocess.STDOUT)
+        if returncode != 0 or not os.path.exists(exe):
+            raise Exception("*** Build of %s failed, see %s" % (key, log_fname))
+        with open(os.path.join(os.path.dirname(exe), 'build.json'), 'w') as f:
+            json.dump({'profile': profile, 'fflags': profiles[profile],
+                       'compiler': ' '.join(compiler()), 'project': project,
+                       'built': time.ctime(), 'seconds': time.time() - t0},
+                      f, indent=2)
+    return exe
+
+
+def executable(project, profile, build_dir=None):
+    """
+    Cached xgeoclaw for use by make or the run tools.  It is touched so
+    that make .output, whose rule for EXE depends on the objects in $CLAW,
+    does not relink it from those after a later plain make .exe.
+    """
+    exe = build(project, profile, build_dir)
+    os.utime(exe)
+    return exe
+
+
+def benchmark(project, profile_names, test=None, end_time=1800., amr_max=4,
+              threads=4, bench_dir=None, build_dir=None):
+    """
+    Run the same shortened test with each profile and return rows (dicts)
+    with the solver throughput in cell updates per second.
+    """
+    from tools.run_scenarios import find_tests
+    from tools.timing import read_timing
+
+    if test is None:
+        test = find_tests(project)[0]
+    rundata = runs.load_rundata(project, test)
+    amr_max = min(amr_max, rundata.amrdata.amr_levels_max)
+    runs.reduce_rundata(rundata, end_time=end_time, amr_max=amr_max,
+                        num_output_times=1)
+
+    if bench_dir is None:
+        bench_dir = os.path.join(outputs_dir(), '_bench', 'build', project)
+    rundir = os.path.join(bench_dir, '_rundata')
+    runs.write_rundata(rundata, rundir)
+
+    rows = []
+    for profile in profile_names:
+        exe = executable(project, profile, build_dir)
+        nthreads = threads if 'openmp' in profiles[profile] else 1
+        outdir = os.path.join(bench_dir, profile)
+        print('Running %s/%s with profile %s, %i threads' \
+              % (project, test, profile, nthreads))
+        result = runs.run_xgeoclaw(rundir, outdir, exe,
+                                   env={'OMP_NUM_THREADS': str(nthreads)})
+        if result['returncode'] != 0:
+            raise Exception("*** xgeoclaw failed for profile %s, see %s" \
+                            % (profile, result['log']))
+        integration = (read_timing(outdir) or {}).get('integration') or {}
+        solver_wall = integration.get('wall', np.nan)
+        cells = integration.get('cells', np.nan)
+        rows.append({'profile': profile, 'fflags': profiles[profile],
+                     'threads': nthreads, 'wall': result['wall'],
+                     'solver_wall': solver_wall, 'cell_updates': cells,
+                     'cells_per_s': cells / solver_wall, 'speedup': np.nan})
+
+    base = [row for row in rows if row['profile'] == 'opt'] or rows[:1]
+    for row in rows:
+        row['speedup'] = row['cells_per_s'] / base[0]['cells_per_s']
+
+    fname = os.path.join(bench_dir, 'build_benchmark.csv')
+    with open(fname, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    print('Created %s' % fname)
+    return rows
+
+
+def print_table(rows):
+    print('%-8s %-24s %8s %10s %10s %12s %12s %8s' % ('profile', 'FFLAGS',
+          'threads', 'wall (s)', 'solver (s)', 'cell updates', 'cells/s',
+          'speedup'))
+    for row in rows:
+        print('%-8s %-24s %8i %10.1f %10.1f %12.3e %12.3e %8.2f' % (
+              row['profile'], row['fflags'][:24], row['threads'], row['wall'],
+              row['solver_wall'], row['cell_updates'], row['cells_per_s'],
+              row['speedup']))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Cached xgeoclaw builds per compiler flags profile.')
+    parser.add_argument('project')
+    parser.add_argument('--profile', choices=sorted(profiles), default='omp')
+    parser.add_argument('--path', action='store_true',
+                        help='print the path of the cached executable (used by make)')
+    parser.add_argument('--bench', action='store_true',
+                        help='compare the throughput of all profiles')
+    parser.add_argument('--test', default=None,
+                        help='test to benchmark (default: the first one)')
+    parser.add_argument('--end-time', type=float, default=1800.)
+    parser.add_argument('--amr-max', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4,
+                        help='OMP_NUM_THREADS for the omp profile (default 4)')
+    parser.add_argument('--build-dir', default=None,
+                        help='default: $PROJ/_builds')
+    args = parser.parse_args()
+
+    if args.bench:
+        rows = benchmark(args.project, ['debug', 'opt', 'omp'], args.test,
+                         args.end_time, args.amr_max, args.threads,
+                         build_dir=args.build_dir)
+        print_table(rows)
+    elif args.path:
+        # only the path on stdout, make reads it
+        print(executable(args.project, args.profile, args.build_dir))
+    else:
+        print(build(args.project, args.profile, args.build_dir))
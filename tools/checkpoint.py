@@ -0,0 +1,148 @@
+"""
+Checkpoints every so many minutes of wall time, and restarting from them.
+
+GeoClaw can only checkpoint every checkpt_interval steps on level 1, so the
+wall time policy (params.checkpt_minutes) is turned into a step interval
+from the wall time per level 1 step of the last run of the same test
+(step_cost.json in $OUTPUTS/<project>/<test>, written by the runner), or
+before the first run from a CFL estimate of the number of steps.  With
+checkpt_style = -3 GeoClaw alternates between two checkpoint files,
+fort.chkaaaaa and fort.chkbbbbb, so a crash while writing one still leaves
+the other.  Each is followed by a fort.tck file with its time, written
+once the checkpoint is complete.
+
+tools/run_scenarios.py checks the output directory before a run: if the
+run did not finish and there is a complete checkpoint, the newest one is
+patched into the rundata (clawdata.restart, restart_file) and the run
+continues from it in the same directory.
+"""
+
+import os
+import re
+import json
+import glob
+import numpy as np
+
+from tools import outputs_dir
+
+step_cost_fname = 'step_cost.json'
+_level1_step = re.compile(r'AMRCLAW:\s+level\s+1\s.*final t\s*=\s*([-+.\dEeDd]+)')
+
+
+def step_cost_path(project, test):
+    return os.path.join(outputs_dir(), project, test, step_cost_fname)
+
+
+def level1_steps(log_text):
+    """
+    Number of level 1 steps in xgeoclaw output, and the time reached.
+    """
+    times = _level1_step.findall(log_text)
+    if not times:
+        return 0, None
+    return len(times), float(times[-1].replace('D', 'E').replace('d', 'e'))
+
+
+def write_step_cost(fname, wall, log_text):
+    """
+    Record the wall time per level 1 step of a run (or part of one).
+    """
+    nsteps, t = level1_steps(log_text)
+    if nsteps == 0:
+        return
+    with open(fname, 'w') as f:
+        json.dump({'seconds_per_step': wall / nsteps, 'steps': nsteps,
+                   'wall': wall, 't': t}, f, indent=2)
+
+
+def estimated_steps(rundata, max_depth=8000., gravity=9.81):
+    """
+    Level 1 steps to tfinal at the CFL number asked for, with the fastest
+    waves in water max_depth deep.
+    """
+    clawdata = rundata.clawdata
+    dx = min((clawdata.upper[0] - clawdata.lower[0]) / clawdata.num_cells[0],
+             (clawdata.upper[1] - clawdata.lower[1]) / clawdata.num_cells[1])
+    lat = 0.5 * (clawdata.lower[1] + clawdata.upper[1])
+    dx_m = dx * 111e3 * np.cos(np.radians(lat))
+    dt = clawdata.cfl_desired * dx_m / np.sqrt(gravity * max_depth)
+    return int(np.ceil((clawdata.tfinal - clawdata.t0) / dt))
+
+
+def configure_checkpoints(rundata, minutes, cost_fname=None, num_fallback=12):
+    """
+    Alternating checkpoints about every minutes of wall time.  Without a
+    step cost from an earlier run, checkpoint num_fallback times per run.
+    """
+    clawdata = rundata.clawdata
+    cost = None
+    if cost_fname is not None and os.path.exists(cost_fname):
+        with open(cost_fname) as f:
+            cost = json.load(f)['seconds_per_step']
+
+    if cost:
+        interval = int(60. * minutes / cost)
+    else:
+        interval = estimated_steps(rundata) // num_fallback
+    clawdata.checkpt_style = -3
+    clawdata.checkpt_interval = max(1, interval)
+    return rundata
+
+
+def checkpoints(outdir):
+    """
+    [(t, fname)] of the complete checkpoints in outdir, newest first.
+    """
+    result = []
+    for chk in glob.glob(os.path.join(outdir, 'fort.chk*')):
+        tck = chk.replace('fort.chk', 'fort.tck')
+        if not os.path.exists(tck) or os.path.getsize(chk) == 0 or \
+                os.path.getmtime(tck) < os.path.getmtime(chk):
+            continue    # killed while writing it
+        t = checkpoint_time(tck)
+        if t is not None:
+            result.append((t, chk))
+    return sorted(result, reverse=True)
+
+
+def checkpoint_time(tck):
+    """
+    Time of a checkpoint from its fort.tck file, whose first line GeoClaw
+    writes as ' Checkpoint file at time t =   3600.0000000000000', or None
+    if it cannot be read.
+    """
+    with open(tck) as f:
+        line = f.readline()
+    if '=' not in line:
+        return None
+    words = line.split('=', 1)[1].split()
+    try:
+        return float(words[0].replace('D', 'E').replace('d', 'e'))
+    except (IndexError, ValueError):
+        return None
+
+
+def is_complete(outdir):
+    """
+    True if the run in outdir got to the end (GeoClaw writes timing.txt
+    last).
+    """
+    return os.path.exists(os.path.join(outdir, 'timing.txt'))
+
+
+def restart_rundata(rundata, outdir):
+    """
+    If the run in outdir did not finish, set rundata to restart from its
+    newest complete checkpoint and return its time, else return None.
+    """
+    if not os.path.isdir(outdir) or is_complete(outdir):
+        return None
+    chks = checkpoints(outdir)
+    if not chks:
+        return None
+    t, chk = chks[0]
+    clawdata = rundata.clawdata
+    clawdata.restart = True
+    clawdata.restart_file = os.path.basename(chk)
+    clawdata.output_t0 = False   # the frame at t was written before the crash
+    return t
@@ -0,0 +1,164 @@
+"""
+Virtual gauges along the whole coast, for waveforms from a single run.
+
+params.gauges has a few hand-placed tide gauges.  This places one gauge
+about every spacing km along the depth contour (default -10 m) inside the
+nearshore fgmax mask made by make_inputs.py, on topo points whose
+neighbours are all wet so the gauge stays in the water at the finest
+level, and numbers them from 1000 in order along the coast.  They are
+written to scratch/<project>/coastal_gauges.txt (params.coastal_gauges_file),
+which setrun.py adds to the gauges if it exists, written every
+params.coastal_gauge_dt seconds so hundreds of them stay cheap.  With
+params.gauge_format = 'binary', tools/gauges.py reads them all at once.
+setplot.py labels and plots only the other gauges (tide_gauge_numbers).
+
+Usage, from the top of the repo:
+
+    python -m tools.coastal_gauges tokachi --spacing 2 --depth -10
+"""
+
+import os
+import numpy as np
+
+from tools import runs
+from tools.fgmax_sites import read_mask
+
+first_gaugeno = 1000
+
+
+def neighbours(A, op):
+    """
+    op (np.logical_and or np.logical_or) of A over each point and its
+    8 neighbours, edges padded with False.
+    """
+    ny, nx = A.shape
+    P = np.pad(A, 1, constant_values=False)
+    result = A.copy()
+    for dj in (-1, 0, 1):
+        for di in (-1, 0, 1):
+            result = op(result, P[1+dj:ny+1+dj, 1+di:nx+1+di])
+    return result
+
+
+def contour_points(Z, depth=-10.):
+    """
+    Points at or below depth next to a shallower point, whose neighbours
+    are all wet.
+    """
+    deep = Z <= depth
+    wet_around = neighbours(Z < 0., np.logical_and)
+    return deep & neighbours(~deep, np.logical_or) & wet_around
+
+
+def km(x, y, x0, y0):
+    """
+    Distances in km from (x0, y0) to the points x, y (degrees).
+    """
+    dx = (x - x0) * 111.32 * np.cos(np.radians(y0))
+    dy = (y - y0) * 110.57
+    return np.sqrt(dx**2 + dy**2)
+
+
+def thin(x, y, spacing):
+    """
+    Indices of points at least spacing km apart, taken greedily west to
+    east, so every point is within spacing km of one of them.
+    """
+    keep = []
+    for k in np.argsort(x, kind='stable'):
+        if not keep or km(x[keep], y[keep], x[k], y[k]).min() >= spacing:
+            keep.append(k)
+    return np.array(keep, dtype=int)
+
+
+def coast_order(x, y):
+    """
+    Order of the points walking along the coast from the westernmost one
+    to the nearest point not yet visited.
+    """
+    left = list(range(len(x)))
+    order = [left.pop(int(np.argmin(x)))]
+    while left:
+        d = km(x[left], y[left], x[order[-1]], y[order[-1]])
+        order.append(left.pop(int(np.argmin(d))))
+    return np.array(order, dtype=int)
+
+
+def place_gauges(topo, mask_fname, spacing=2., depth=-10.):
+    """
+    Array of (gaugeno, x, y) of gauges every spacing km on the depth
+    contour inside the mask.
+    """
+    from tools.preflight import topo_at
+
+    x, y, mask = read_mask(mask_fname)
+    X, Y = np.meshgrid(x, y)
+    Z = topo_at(topo, X.ravel(), Y.ravel()).reshape(X.shape)
+    points = mask & contour_points(Z, depth)
+    if not points.any():
+        raise Exception("*** No wet points on the %g m contour in %s" \
+                        % (depth, mask_fname))
+    xp, yp = X[points], Y[points]
+    keep = thin(xp, yp, spacing)
+    xp, yp = xp[keep], yp[keep]
+    order = coast_order(xp, yp)
+    gaugenos = first_gaugeno + np.arange(len(order))
+    return np.vstack([gaugenos, xp[order], yp[order]]).T
+
+
+def write_gauges(fname, gauges, spacing, depth):
+    np.savetxt(fname, gauges, fmt=['%i', '%.6f', '%.6f'],
+               header='virtual coastal gauges every %g km on the %g m contour\n'
+                      'gaugeno x y' % (spacing, depth))
+    print('Created %s with %i gauges' % (fname, len(gauges)))
+
+
+def tide_gauge_numbers(outdir):
+    """
+    Numbers of the gauges in the output in outdir other than the virtual
+    coastal ones, for labels and gauge plots.
+    """
+    from tools.gauges import gauge_files
+    return sorted(gaugeno for gaugeno in gauge_files(outdir)
+                  if gaugeno < first_gaugeno)
+
+
+def add_coastal_gauges(rundata, fname, dt=10.):
+    """
+    Add the gauges in fname (if it exists) to rundata, written every dt
+    seconds while the other gauges keep their min_time_increment.
+    """
+    if fname is None or not os.path.exists(fname):
+        return rundata
+    gaugedata = rundata.gaugedata
+    min_dt = gaugedata.min_time_increment
+    if not isinstance(min_dt, dict):
+        min_dt = {gauge[0]: min_dt for gauge in gaugedata.gauges}
+    for gaugeno, x, y in np.loadtxt(fname, ndmin=2):
+        gaugedata.gauges.append([int(gaugeno), x, y, 0., 1e10])
+        min_dt[int(gaugeno)] = dt
+    gaugedata.min_time_increment = min_dt
+    return rundata
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Place virtual gauges along the coast of a project.')
+    parser.add_argument('project')
+    parser.add_argument('--spacing', type=float, default=2.,
+                        help='km between gauges (default 2)')
+    parser.add_argument('--depth', type=float, default=-10.,
+                        help='contour to place them on, in m (default -10)')
+    parser.add_argument('--mask', default=None,
+                        help='nearshore mask (default: scratch/<project>/fgmax_pts_topostyle.txt)')
+    args = parser.parse_args()
+
+    from clawpack.geoclaw import topotools
+    params = runs.load_params(args.project)
+    mask_fname = args.mask or os.path.join(params.scratch_dir, args.project,
+                                           'fgmax_pts_topostyle.txt')
+    topo_type, topo_fname = params.topofiles[0][:2]
+    topo = topotools.Topography(topo_fname, topo_type=topo_type)
+    gauges = place_gauges(topo, mask_fname, args.spacing, args.depth)
+    write_gauges(params.coastal_gauges_file, gauges, args.spacing, args.depth)
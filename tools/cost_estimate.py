@@ -0,0 +1,153 @@
+"""
+Forecast the cell updates, memory and wall time of a run before making it.
+
+Reads the rundata of a test from setrun.py and, for each AMR level, takes
+the area the flagregions (rectangles and the ruled rectangle) force to the
+level and allow it to have, with the helpers of tools/amr_design.py.  From
+these:
+
+  - cells on the level: area / dx**2 (forced is a lower bound, allowed an
+    upper bound, the flagging decides where in between the run ends up),
+  - memory: cells times the bytes GeoClaw keeps per cell, q at two times
+    and aux (8 * (2*num_eqn + num_aux) bytes) plus the ghost cells around
+    patches of max1d cells, at the time the most flagregions are active,
+  - steps: the CFL estimate of level 1 steps over end_time
+    (tools/checkpoint.py) times the time refinement ratios, or with
+    variable_dt_refinement_ratios (GeoClaw then picks them from the CFL
+    condition on each level) the space ratios, an upper bound since the
+    finer levels are in shallower, slower water,
+  - cell updates: cells times steps, averaged over the run as flagregions
+    switch on and off.
+
+With a finished run of the test in $OUTPUTS, its wall time per cell update
+(timing.txt) turns the cell updates into a wall time.  Nothing is run and
+only the flagregions are rasterized, so this takes well under a second.
+
+Usage, from the top of the repo:
+
+    python -m tools.cost_estimate tokachi
+"""
+
+import os
+import time
+import numpy as np
+
+from tools import outputs_dir, runs
+from tools.amr_design import (domain_grid, flagregion_masks, level_areas,
+                              level_resolutions, format_resolution)
+from tools.checkpoint import estimated_steps
+from tools.timing import read_timing
+
+
+def bytes_per_cell(rundata):
+    """
+    Bytes GeoClaw stores per cell: q at the old and new time and aux, in
+    double precision, with the ghost cells of patches max1d cells wide.
+    """
+    clawdata = rundata.clawdata
+    max1d = rundata.amrdata.max1d
+    ghost = ((max1d + 2. * clawdata.num_ghost) / max1d) ** 2
+    return 8 * (2 * clawdata.num_eqn + clawdata.num_aux) * ghost
+
+
+def time_ratios(rundata):
+    """
+    Time refinement ratios of the levels, as far as they can be known
+    before the run.
+    """
+    amrdata = rundata.amrdata
+    if rundata.refinement_data.variable_dt_refinement_ratios:
+        return amrdata.refinement_ratios_x
+    return amrdata.refinement_ratios_t
+
+
+def estimate(rundata, resolution=1./60., num_times=24):
+    """
+    Rows per level with dx, the forced and allowed cells (the most at any
+    time), memory in bytes for those, steps over the run, and the forced
+    and allowed cell updates.
+    """
+    clawdata = rundata.clawdata
+    amrdata = rundata.amrdata
+    amr_max = amrdata.amr_levels_max
+    dx1 = (clawdata.upper[0] - clawdata.lower[0]) / clawdata.num_cells[0]
+    dxs = level_resolutions(dx1, amrdata.refinement_ratios_x, amr_max)
+
+    X, Y, cell_area = domain_grid(rundata, resolution)
+    masks = flagregion_masks(rundata, X, Y)
+    times = np.linspace(clawdata.t0, clawdata.tfinal, num_times)
+    areas = np.array([level_areas(rundata, amr_max, X, Y, cell_area, masks, t)
+                      for t in times])    # times x levels x (forced, allowed)
+    cells = areas / np.array(dxs)[np.newaxis, :, np.newaxis] ** 2
+
+    steps = [estimated_steps(rundata)]
+    for ratio in time_ratios(rundata)[:amr_max - 1]:
+        steps.append(steps[-1] * ratio)
+
+    nbytes = bytes_per_cell(rundata)
+    rows = []
+    for k, dx in enumerate(dxs):
+        forced, allowed = cells[:, k, :].max(axis=0)
+        mean_forced, mean_allowed = cells[:, k, :].mean(axis=0)
+        rows.append({'level': k + 1, 'dx': dx, 'forced_cells': forced,
+                     'allowed_cells': allowed, 'forced_bytes': forced * nbytes,
+                     'allowed_bytes': allowed * nbytes, 'steps': steps[k],
+                     'forced_updates': mean_forced * steps[k],
+                     'allowed_updates': mean_allowed * steps[k]})
+    return rows
+
+
+def seconds_per_update(outdir):
+    """
+    Wall time per cell update of the finished run in outdir, or None.
+    """
+    timing = read_timing(outdir)
+    if timing is None or not timing.get('integration') or not timing.get('wall'):
+        return None
+    integration = timing['integration']
+    if not integration.get('cells'):
+        return None
+    return timing['wall'] / integration['cells']
+
+
+def print_estimate(rows, cost=None):
+    print('%5s %10s %21s %19s %8s %21s' % ('level', 'dx', 'cells (forced-allowed)',
+          'memory MB', 'steps', 'cell updates'))
+    for row in rows:
+        print('%5i %10s %10.3g %10.3g %9.1f %9.1f %8i %10.3g %10.3g' % (
+              row['level'], format_resolution(row['dx']), row['forced_cells'],
+              row['allowed_cells'], row['forced_bytes'] / 1e6,
+              row['allowed_bytes'] / 1e6, row['steps'], row['forced_updates'],
+              row['allowed_updates']))
+    total = {key: sum(row[key] for row in rows) for key in
+             ['forced_bytes', 'allowed_bytes', 'forced_updates', 'allowed_updates']}
+    print('Peak memory %.0f to %.0f MB, %.3g to %.3g cell updates' % (
+          total['forced_bytes'] / 1e6, total['allowed_bytes'] / 1e6,
+          total['forced_updates'], total['allowed_updates']))
+    if cost is not None:
+        print('At %.3g us per cell update (last run): %.1f to %.1f hours' % (
+              1e6 * cost, total['forced_updates'] * cost / 3600.,
+              total['allowed_updates'] * cost / 3600.))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Forecast cell updates and memory of a run from its flagregions.')
+    parser.add_argument('project')
+    parser.add_argument('--test', default=None)
+    parser.add_argument('--resolution', type=float, default=1.,
+                        help='grid for the flagregion areas, in minutes (default 1)')
+    parser.add_argument('--num-times', type=int, default=24,
+                        help='times sampled over the run (default 24)')
+    args = parser.parse_args()
+
+    rundata = runs.load_rundata(args.project, args.test)
+    import params
+
+    t0 = time.time()
+    rows = estimate(rundata, args.resolution / 60., args.num_times)
+    cost = seconds_per_update(os.path.join(outputs_dir(), args.project,
+                                           params.which_test, '_output'))
+    print_estimate(rows, cost)
+    print('(estimated in %.2f s)' % (time.time() - t0))
@@ -0,0 +1,131 @@
+"""
+Size the computational domain of a test from its source and end_time.
+
+Every project uses the same hand-picked domain, lower = [138, 38] and
+upper = [148, 46].  A boundary only matters to the gauges and fgmax grids
+if a wave can go from the source to the boundary and then back to one of
+them before end_time.  With T_src the travel time from the dtopo source
+(as in tools/arrival_times.py) and T_roi the travel time from the gauges
+and fgmax grids, those are the points with
+
+    T_src + T_roi <= end_time + margin
+
+and the domain only has to cover them and the dtopo files (so none of the
+deformation is cut off).  This takes their bounding box, snaps it outwards
+to the coarse grid of params.py (so num_cells changes but the cell size,
+and every finer level, stays the same) and writes it to the
+refinement plan of the test as the domain, which params.py applies (see
+tools/refinement_plan.py).  The domain is never made larger than the one in
+params.py.
+
+Usage, from the top of the repo:
+
+    python -m tools.domain_size tokachi --margin 1800
+"""
+
+import numpy as np
+
+from tools import runs
+from tools.arrival_times import source_travel_times, travel_times, extent_mask
+from tools.refinement_plan import plan_path, write_plan
+from tools.preflight import dtopo_extent
+
+
+def roi_cells(rundata, x, y):
+    """
+    Indices (j, i) on the x, y grid of the gauges and the fgmax grids.
+    """
+    from tools.fgmax_sites import mask_extent
+
+    X, Y = np.meshgrid(x, y)
+    mask = np.zeros(X.shape, dtype=bool)
+    for gauge in rundata.gaugedata.gauges:
+        i = np.clip(np.searchsorted(x, gauge[1]), 0, len(x) - 1)
+        j = np.clip(np.searchsorted(y, gauge[2]), 0, len(y) - 1)
+        mask[j, i] = True
+    for fg in rundata.fgmax_data.fgmax_grids:
+        if fg.point_style == 4:
+            mask |= extent_mask(X, Y, mask_extent(fg.xy_fname))
+    if not mask.any():
+        raise Exception("*** No gauges or fgmax grids to size the domain for")
+    return np.nonzero(mask)
+
+
+def snap_domain(extent, lower, dx):
+    """
+    lower, upper and num_cells of the smallest domain on the coarse grid
+    with origin lower and cell size dx that covers extent [x1, x2, y1, y2].
+    """
+    new_lower, new_upper, num_cells = [], [], []
+    for k in range(2):
+        i1 = int(np.floor((extent[2*k] - lower[k]) / dx[k] + 1e-9))
+        i2 = max(i1 + 1, int(np.ceil((extent[2*k+1] - lower[k]) / dx[k] - 1e-9)))
+        new_lower.append(lower[k] + i1*dx[k])
+        new_upper.append(lower[k] + i2*dx[k])
+        num_cells.append(i2 - i1)
+    return new_lower, new_upper, num_cells
+
+
+def domain_plan(rundata, margin=1800., resolution=2./60., dz_tol=0.01):
+    """
+    Plan (see tools/refinement_plan.py) with the domain covering every
+    point a wave can reach and get back from to the gauges and fgmax grids
+    within end_time + margin.
+    """
+    x, y, Z, T_src = source_travel_times(rundata, resolution, dz_tol)
+    roi_j, roi_i = roi_cells(rundata, x, y)
+    print('Solving for travel times back from %i gauge and fgmax cells' \
+          % len(roi_j))
+    T_roi = travel_times(x, y, Z, roi_j, roi_i, np.zeros(len(roi_j)),
+                         gravity=rundata.geo_data.gravity)
+
+    clawdata = rundata.clawdata
+    reach = T_src + T_roi <= clawdata.tfinal + margin
+    reach[roi_j, roi_i] = True
+    jj, ii = np.nonzero(reach)
+    # half a cell of the solve around the outermost points
+    hx, hy = 0.5*abs(x[1] - x[0]), 0.5*abs(y[1] - y[0])
+    extent = [max(x[ii.min()] - hx, x[0]), min(x[ii.max()] + hx, x[-1]),
+              max(y[jj.min()] - hy, y[0]), min(y[jj.max()] + hy, y[-1])]
+    # all of the deformation, even where it is too far to matter
+    for dtopo_type, dtopo_fname in [d[:2] for d in rundata.dtopo_data.dtopofiles]:
+        if dtopo_type == 3:
+            d = dtopo_extent(dtopo_fname)
+        else:
+            from clawpack.geoclaw import dtopotools
+            d = dtopotools.DTopography(dtopo_fname, dtopo_type=dtopo_type).extent
+        extent = [min(extent[0], d[0]), max(extent[1], d[1]),
+                  min(extent[2], d[2]), max(extent[3], d[3])]
+
+    dx = [(clawdata.upper[k] - clawdata.lower[k]) / clawdata.num_cells[k]
+          for k in range(2)]
+    lower, upper, num_cells = snap_domain(extent, clawdata.lower, dx)
+    return {'domain': {'lower': lower, 'upper': upper, 'num_cells': num_cells,
+                       'extent': extent, 'margin': margin}}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Shrink the domain of a test to what can affect its gauges and fgmax grids.')
+    parser.add_argument('project')
+    parser.add_argument('--margin', type=float, default=1800.,
+                        help='seconds added to end_time (default 1800)')
+    parser.add_argument('--resolution', type=float, default=2.,
+                        help='topo resolution for the solve, in minutes (default 2)')
+    parser.add_argument('--dz-tol', type=float, default=0.01,
+                        help='deformation (m) that counts as source (default 0.01)')
+    args = parser.parse_args()
+
+    rundata = runs.load_rundata(args.project)
+    import params
+
+    plan = domain_plan(rundata, args.margin, args.resolution/60., args.dz_tol)
+    domain = plan['domain']
+    print('Points that matter: x %.2f to %.2f, y %.2f to %.2f' \
+          % tuple(domain['extent']))
+    print('lower = %s\nupper = %s\nnum_cells = %s' \
+          % (domain['lower'], domain['upper'], domain['num_cells']))
+    print('%i coarse cells instead of %i' % (np.prod(domain['num_cells']),
+                                             np.prod(params.num_cells)))
+    write_plan(plan_path(params.test_dir), plan)
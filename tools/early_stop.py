@@ -0,0 +1,191 @@
+"""
+Pick a shorter end_time once the gauge peaks and fgmax maxima have settled.
+
+Every test runs to the end_time in params.py, often long after the largest
+waves have passed the gauges and fgmax sites.  From a finished run of the
+test (the fine run, or the coarse run of tools/two_stage.py, which keeps
+gauges and fgmax grids), this finds
+
+  - for each gauge, the first time the running maximum of |eta| comes
+    within eta_tol of the maximum over the whole run, and
+  - for each fgmax point that got wet by more than h_min, the first time
+    its running maximum depth came within h_tol of its fgmax maximum: the
+    first output frame whose depth there is that close, or h_time if that
+    is earlier,
+
+and takes the latest of these plus a margin, rounded up to whole output
+intervals.  After that time nothing in the run changed a gauge peak by
+more than eta_tol or the maximum depth at an fgmax point by more than
+h_tol (up to the frames sampling the depth on the patches they have,
+where the fgmax grids see the finest level).  The result goes into the refinement plan of the test as
+end_time, which params.py applies (see tools/refinement_plan.py); it only
+ever shortens the run.
+
+Usage, from the top of the repo, after a run of the test:
+
+    python -m tools.early_stop tokachi --eta-tol 0.05 --margin 900
+"""
+
+import os
+import glob
+import numpy as np
+
+from tools import outputs_dir
+from tools.output_format import output_format
+from tools.refinement_plan import plan_path, write_plan
+
+
+def gauge_numbers(outdir):
+    return sorted(int(os.path.basename(fname)[5:10])
+                  for fname in glob.glob(os.path.join(outdir, 'gauge*.txt')))
+
+
+def gauge_settle_times(outdir, eta_tol, sea_level=0.):
+    """
+    {gaugeno: (t_settle, peak)} with peak the largest |eta - sea_level| at
+    the gauge and t_settle the first time it got within eta_tol of it.
+    """
+    from tools.gauge_compare import read_eta
+
+    result = {}
+    for gaugeno in gauge_numbers(outdir):
+        t, eta = read_eta(outdir, gaugeno)
+        if len(t) == 0:
+            continue
+        running = np.maximum.accumulate(np.abs(eta - sea_level))
+        peak = running[-1]
+        result[gaugeno] = (float(t[np.argmax(running >= peak - eta_tol)]),
+                           float(peak))
+    return result
+
+
+def frame_depths(outdir, x, y):
+    """
+    (t, h) for each output frame in outdir, with h the depth at the points
+    x, y on the finest patch covering each of them (nan outside all).
+    """
+    from clawpack.pyclaw.solution import Solution
+    from tools.frame_plots import frame_numbers
+
+    file_format = output_format(outdir)
+    for frameno in frame_numbers(outdir):
+        frame = Solution(frameno, path=outdir, file_format=file_format)
+        h = np.full(len(x), np.nan)
+        for state in sorted(frame.states, key=lambda state: state.patch.level):
+            dims = state.patch.dimensions
+            i = np.floor((x - dims[0].lower) / dims[0].delta).astype(int)
+            j = np.floor((y - dims[1].lower) / dims[1].delta).astype(int)
+            inside = (i >= 0) & (i < dims[0].num_cells) & \
+                (j >= 0) & (j < dims[1].num_cells)
+            h[inside] = state.q[0, i[inside], j[inside]]
+        yield frame.t, h
+
+
+def fgmax_settle_time(outdir, run_id, h_min=0.1, h_tol=0.05):
+    """
+    Time after which the maximum depth of no fgmax point wet by more than
+    h_min grew by more than h_tol, and the number of such points.
+    """
+    from tools.fgmax_cache import num_fgmax_grids, read_fgmax
+
+    x, y, h_max, h_time = [], [], [], []
+    data_file = os.path.join(outdir, 'fgmax_grids.data')
+    if not os.path.exists(data_file):
+        return None, 0
+    for fgno in range(1, num_fgmax_grids(data_file) + 1):
+        fg = read_fgmax(outdir, run_id, fgno)
+        h = np.ma.filled(np.ma.masked_invalid(fg.h), 0.)
+        t = np.ma.filled(np.ma.masked_invalid(fg.h_time), np.nan)
+        wet = (h > h_min) & np.isfinite(t)
+        x.append(np.ma.getdata(fg.X)[wet])
+        y.append(np.ma.getdata(fg.Y)[wet])
+        h_max.append(h[wet])
+        h_time.append(t[wet])
+    if not x or sum(len(v) for v in x) == 0:
+        return None, 0
+    x, y, h_max, h_time = [np.concatenate(v) for v in (x, y, h_max, h_time)]
+
+    # first frame in which each point was within h_tol of its maximum
+    first = np.full(len(x), np.inf)
+    for t, h in frame_depths(outdir, x, y):
+        close = np.isinf(first) & (h >= h_max - h_tol)
+        first[close] = t
+    return float(np.minimum(first, h_time).max()), len(x)
+
+
+def settle_end_time(t_settle, margin, tfinal, dt_output):
+    """
+    t_settle + margin rounded up to a whole output interval, at most tfinal.
+    """
+    end_time = dt_output * np.ceil((t_settle + margin) / dt_output)
+    return float(min(end_time, tfinal))
+
+
+def early_stop_plan(outdir, run_id, tfinal, dt_output, eta_tol=0.05,
+                    h_min=0.1, h_tol=0.05, margin=900.):
+    gauges = gauge_settle_times(outdir, eta_tol)
+    t_fgmax, npts = fgmax_settle_time(outdir, run_id, h_min, h_tol)
+
+    times = [t for t, peak in gauges.values()]
+    if t_fgmax is not None:
+        times.append(t_fgmax)
+    if not times:
+        raise Exception("*** No gauge or fgmax output in %s" % outdir)
+    t_settle = max(times)
+
+    for gaugeno, (t, peak) in sorted(gauges.items()):
+        print('  gauge %5i  peak %6.2f m  settled at %6.1f min' \
+              % (gaugeno, peak, t / 60.))
+    if t_fgmax is not None:
+        print('  fgmax      %i points, all within %g m of max by %6.1f min' \
+              % (npts, h_tol, t_fgmax / 60.))
+
+    end_time = settle_end_time(t_settle, margin, tfinal, dt_output)
+    return {'end_time': end_time,
+            'end_time_method': {'outdir': outdir, 'eta_tol': eta_tol,
+                                'h_min': h_min, 'h_tol': h_tol,
+                                'margin': margin, 't_settle': t_settle}}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Shorten end_time of a test to when the maxima have settled.')
+    parser.add_argument('project')
+    parser.add_argument('--outdir', default=None,
+                        help='finished run of the test (default: '
+                             '$OUTPUTS/<project>/<test>/_output, or the _coarse run)')
+    parser.add_argument('--eta-tol', type=float, default=0.05,
+                        help='change in a gauge peak (m) that matters (default 0.05)')
+    parser.add_argument('--h-min', type=float, default=0.1,
+                        help='fgmax points deeper than this (m) count (default 0.1)')
+    parser.add_argument('--h-tol', type=float, default=0.05,
+                        help='change in an fgmax maximum depth (m) that matters (default 0.05)')
+    parser.add_argument('--margin', type=float, default=900.,
+                        help='seconds added after settling (default 900)')
+    args = parser.parse_args()
+
+    from tools import runs
+    rundata = runs.load_rundata(args.project)
+    import params
+
+    outdir = args.outdir
+    if outdir is None:
+        run_dir = os.path.join(outputs_dir(), args.project, params.which_test)
+        outdir = os.path.join(run_dir, '_output')
+        if not os.path.exists(os.path.join(outdir, 'timing.txt')):
+            outdir = os.path.join(run_dir, '_coarse', '_output')
+    if not os.path.exists(os.path.join(outdir, 'timing.txt')):
+        raise Exception("*** No finished run in %s" % outdir)
+
+    # the full end_time, not one shortened by an earlier plan
+    tfinal = params._full_end_time
+    dt_output = rundata.clawdata.tfinal / max(1, rundata.clawdata.num_output_times)
+    # fgmax cache key as used by the runner, e.g. tokachi/test1_TWC/_coarse
+    run_id = os.path.relpath(os.path.dirname(os.path.abspath(outdir)),
+                             outputs_dir())
+    plan = early_stop_plan(outdir, run_id, tfinal, dt_output, args.eta_tol,
+                           args.h_min, args.h_tol, args.margin)
+    print('end_time %.0f s (%.2f hours) instead of %.0f s' \
+          % (plan['end_time'], plan['end_time'] / 3600., tfinal))
+    write_plan(plan_path(params.test_dir), plan)
@@ -0,0 +1,167 @@
+"""
+Columnar cache of fgmax output.
+
+FGmaxGrid.read_output() parses the ascii fgmax output (lon, lat, level, B, h,
+time of max h, arrival time) every time a notebook runs.  write_cache converts
+the output of a run once into one .npz file per fgmax grid, each column stored
+as its own array, keyed by a run ID (e.g. 'tokachi/test1_TWC').  load_fgmax
+reads it back into an FGmaxGrid with the same masked-array attributes
+(fg.B, fg.h, fg.X, fg.Y, ...) that read_output() would have set.
+
+Usage after a run:
+
+    python -m tools.fgmax_cache $OUTPUT/_output tokachi/test1_TWC
+"""
+
+import os
+import numpy as np
+
+from tools import outputs_dir
+
+# attributes set by FGmaxGrid.read_output(), all with the shape of the grid
+output_attrs = ['X', 'Y', 'level', 'B', 'h', 'h_time', 's', 's_time',
+                'hs', 'hs_time', 'hss', 'hss_time', 'hmin', 'hmin_time',
+                'arrival_time']
+
+# scalar input attributes from fgmax_grids.data, kept so the loader does not need it
+input_attrs = ['point_style', 'tstart_max', 'tend_max', 'dt_check',
+               'min_level_check', 'arrival_tol', 'interp_method', 'npts',
+               'nx', 'ny']
+
+
+def default_cache_dir():
+    return os.path.join(outputs_dir(), '_fgmax_cache')
+
+
+def cache_path(run_id, fgno=1, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    return os.path.join(cache_dir, run_id, 'fgmax%s.npz' % str(fgno).zfill(4))
+
+
+def output_path(outdir, fgno=1):
+    """
+    ascii fgmax output file written by GeoClaw for grid fgno.
+    """
+    return os.path.join(outdir, 'fgmax%s.txt' % str(fgno).zfill(4))
+
+
+def num_fgmax_grids(data_file):
+    """
+    Number of fgmax grids listed in a fgmax_grids.data file.
+    """
+    with open(data_file) as f:
+        for line in f:
+            if 'num_fgmax_grids' in line:
+                return int(line.split()[0])
+    raise Exception("*** num_fgmax_grids not found in %s" % data_file)
+
+
+def write_cache(outdir, run_id, fgno=1, cache_dir=None, data_file=None):
+    """
+    Read the fgmax output for grid fgno in outdir and save it as a .npz
+    file in the cache.  Returns the path of the cache file.
+    """
+    from clawpack.geoclaw import fgmax_tools
+
+    if data_file is None:
+        data_file = os.path.join(outdir, 'fgmax_grids.data')
+
+    fg = fgmax_tools.FGmaxGrid()
+    fg.read_fgmax_grids_data(fgno=fgno, data_file=data_file)
+    fg.read_output(fgno=fgno, outdir=outdir, verbose=False)
+
+    columns = {}
+    for name in output_attrs:
+        v = getattr(fg, name, None)
+        if v is None:
+            continue
+        columns[name] = np.ma.getdata(v)
+        if isinstance(v, np.ma.MaskedArray):
+            columns[name + '__mask'] = np.ma.getmaskarray(v)
+    for name in input_attrs:
+        v = getattr(fg, name, None)
+        if v is not None:
+            columns['_' + name] = np.asarray(v)
+    columns['_fgno'] = np.asarray(fgno)
+
+    fname = cache_path(run_id, fgno, cache_dir)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    # uncompressed, so loading is a straight read of each column
+    np.savez(fname, **columns)
+    print('Created %s' % fname)
+    return fname
+
+
+def load_fgmax(run_id, fgno=1, cache_dir=None):
+    """
+    Return an FGmaxGrid with the attributes read_output() would set,
+    read from the cache written by write_cache.
+    """
+    from clawpack.geoclaw import fgmax_tools
+
+    fname = cache_path(run_id, fgno, cache_dir)
+    if not os.path.exists(fname):
+        raise Exception("*** No fgmax cache for run %s, fgno %i: %s" \
+                        % (run_id, fgno, fname))
+
+    fg = fgmax_tools.FGmaxGrid()
+    with np.load(fname) as d:
+        for name in d.files:
+            if name.startswith('_'):
+                setattr(fg, name[1:], d[name].item())
+            elif not name.endswith('__mask'):
+                if name + '__mask' in d.files:
+                    setattr(fg, name, np.ma.masked_array(d[name],
+                                                         d[name + '__mask']))
+                else:
+                    setattr(fg, name, d[name])
+    return fg
+
+
+def is_stale(outdir, run_id, fgno=1, cache_dir=None):
+    """
+    True if there is no cache for this run or the fgmax output is newer.
+    """
+    fname = cache_path(run_id, fgno, cache_dir)
+    if not os.path.exists(fname):
+        return True
+    source = output_path(outdir, fgno)
+    return os.path.exists(source) and \
+        os.path.getmtime(source) > os.path.getmtime(fname)
+
+
+def read_fgmax(outdir, run_id, fgno=1, cache_dir=None):
+    """
+    Drop-in replacement for read_fgmax_grids_data + read_output:
+    converts the output on first use and loads from the cache afterwards.
+    """
+    if is_stale(outdir, run_id, fgno, cache_dir):
+        write_cache(outdir, run_id, fgno, cache_dir)
+    fg = load_fgmax(run_id, fgno, cache_dir)
+    fg.outdir = outdir
+    return fg
+
+
+def cache_run(outdir, run_id, cache_dir=None):
+    """
+    Convert every fgmax grid of a run.
+    """
+    data_file = os.path.join(outdir, 'fgmax_grids.data')
+    fnames = []
+    for fgno in range(1, num_fgmax_grids(data_file) + 1):
+        fnames.append(write_cache(outdir, run_id, fgno, cache_dir, data_file))
+    return fnames
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Convert fgmax output of a run to the binary cache.')
+    parser.add_argument('outdir', help='GeoClaw output directory')
+    parser.add_argument('run_id', help='key for the run, e.g. tokachi/test1_TWC')
+    parser.add_argument('--cache-dir', default=None,
+                        help='default: $OUTPUTS/_fgmax_cache')
+    args = parser.parse_args()
+
+    cache_run(args.outdir, args.run_id, args.cache_dir)
@@ -0,0 +1,307 @@
+"""
+Named fgmax grids, one per port / tide gauge site.
+
+The coastline mask made by make_inputs.py covers every nearshore point of the
+cropped topo, so a single point_style 4 grid over it updates stretches of coast
+we never report on.  Each project instead lists the sites it cares about in
+params.fgmax_sites, and gets one fgmax grid per site, cropped from the same
+mask, with its own tstart_max / tend_max / dt_check.
+
+All site masks are cropped from the same 15" mask, so the grids share one
+lattice and merge_fgmax_grids can put them back together for analysis.
+The B0 file of a project (writeB0.py) is on that merged lattice, so it is
+written with the list of mask files it was made from, and make_inputs.py
+sets it aside once the fgmax grids in params.py are different (reading
+use_fgmax_sites and fgmax_sites from params.py without importing it, which
+would ask for the test again).
+"""
+
+import os
+import ast
+import json
+import numpy as np
+
+# [x1, x2, y1, y2] of the area monitored around each site
+sites = {
+    'urakawa':    [142.6, 142.85, 41.9, 42.3],
+    'tokachi_ko': [143.15, 143.5, 42.2, 42.45],
+    'kushiro':    [144.0, 144.5, 42.8, 43.1],
+    'tomakomai':  [141.45, 141.8, 42.5, 42.7],
+    'erimo':      [143.0, 143.3, 41.9, 42.15],
+}
+
+# fgmax output that is merged, see FGmaxGrid.read_output()
+merge_attrs = ['level', 'B', 'h', 'h_time', 's', 's_time', 'hs', 'hs_time',
+               'hss', 'hss_time', 'hmin', 'hmin_time', 'arrival_time']
+
+
+def site_mask_path(mask_dir, name):
+    return os.path.join(mask_dir, 'fgmax_pts_%s.txt' % name)
+
+
+def count_mask_points(mask_fname):
+    """
+    Number of selected points in a topo_type 3 mask file of 0/1 values.
+    """
+    return int(np.loadtxt(mask_fname, skiprows=6).sum())
+
+
+def mask_header(mask_fname):
+    """
+    Header of a topo_type 3 file (mask or topo) as a dict, e.g.
+    {'ncols': 961., 'nrows': 721., 'xlower': 140., 'ylower': 40.,
+    'cellsize': 0.0041667, 'nodata_value': -9999.}.
+    """
+    header = {}
+    with open(mask_fname) as f:
+        for k in range(6):
+            value, key = f.readline().split()[:2]
+            header[key.lower()] = float(value)
+    return header
+
+
+def mask_extent(mask_fname):
+    """
+    [x1, x2, y1, y2] of a topo_type 3 mask file, from its header.
+    """
+    header = mask_header(mask_fname)
+    dx = header['cellsize']
+    x1, y1 = header['xlower'], header['ylower']
+    return [x1, x1 + (header['ncols'] - 1)*dx, y1, y1 + (header['nrows'] - 1)*dx]
+
+
+def read_mask(mask_fname):
+    """
+    x, y and the boolean mask (rows south to north) of a topo_type 3 mask.
+    """
+    header = mask_header(mask_fname)
+    x1, x2, y1, y2 = mask_extent(mask_fname)
+    mask = np.loadtxt(mask_fname, skiprows=6)[::-1, :] > 0
+    return np.linspace(x1, x2, int(header['ncols'])), \
+        np.linspace(y1, y2, int(header['nrows'])), mask
+
+
+def write_site_masks(mask_fname, mask_dir, site_names=None):
+    """
+    Crop the coastline mask (topo_type 3 file of 0/1 values) to each site
+    and write one mask file per site into mask_dir.  Sites with no selected
+    points in the mask are skipped.  Returns the names of the sites that
+    have a mask file.
+    """
+    from clawpack.geoclaw import topotools
+
+    if site_names is None:
+        site_names = list(sites.keys())
+
+    mask = topotools.Topography(mask_fname, topo_type=3)
+    x1, x2, y1, y2 = mask.extent
+
+    written = []
+    for name in site_names:
+        fname = site_mask_path(mask_dir, name)
+        if os.path.exists(fname):
+            print("*** Not regenerating fgmax mask for %s (already exists)" % name)
+            written.append(name)
+            continue
+
+        sx1, sx2, sy1, sy2 = sites[name]
+        if sx2 <= x1 or sx1 >= x2 or sy2 <= y1 or sy1 >= y2:
+            print("fgmax site %s is outside of %s, skipping" % (name, mask_fname))
+            continue
+
+        site_mask = mask.crop(filter_region=sites[name])
+        if site_mask.Z.sum() == 0:
+            print("No fgmax points selected near %s, skipping" % name)
+            continue
+
+        site_mask.write(fname, topo_type=3, Z_format='%1i')
+        print('Created %s with %i points' % (fname, site_mask.Z.sum()))
+        written.append(name)
+    return written
+
+
+def site_masks(site_names, mask_dir):
+    """
+    The sites of site_names that have a mask file in mask_dir.
+    """
+    return [name for name in site_names
+            if os.path.exists(site_mask_path(mask_dir, name))]
+
+
+def make_site_fgmax_grids(site_params, mask_dir, min_level_check):
+    """
+    One point_style 4 FGmaxGrid per site, numbered in the order of site_params.
+    Sites without a mask file (no points in the coastline mask, see
+    write_site_masks) get no grid.
+
+    site_params is a dict {name: [tstart_max, tend_max, dt_check]}.
+    """
+    from clawpack.geoclaw import fgmax_tools
+
+    if not os.path.exists(os.path.join(mask_dir, 'fgmax_pts_topostyle.txt')):
+        raise Exception("*** No coastline mask in %s, run make_inputs.py first" \
+                        % mask_dir)
+    fgmax_grids = []
+    for name, (tstart_max, tend_max, dt_check) in site_params.items():
+        if name not in sites:
+            raise Exception("*** Unknown fgmax site %s, expected one of %s" \
+                            % (name, list(sites.keys())))
+        if name not in site_masks([name], mask_dir):
+            print("*** No fgmax points near %s, no fgmax grid for it" % name)
+            continue
+        fg = fgmax_tools.FGmaxGrid()
+        fg.fgno = len(fgmax_grids) + 1
+        fg.point_style = 4
+        fg.xy_fname = site_mask_path(mask_dir, name)
+        fg.tstart_max = tstart_max
+        fg.tend_max = tend_max
+        fg.dt_check = dt_check
+        fg.min_level_check = min_level_check
+        fgmax_grids.append(fg)
+    if not fgmax_grids:
+        raise Exception("*** None of the fgmax sites %s has points in %s" \
+                        % (list(site_params.keys()), mask_dir))
+    return fgmax_grids
+
+
+def fgmax_layout(fgmax_grids):
+    """
+    Mask files of the fgmax grids, which fix the lattice of a B0 file.
+    """
+    return [os.path.basename(fg.xy_fname) for fg in fgmax_grids]
+
+
+def params_sites(params_fname):
+    """
+    use_fgmax_sites and the site names of fgmax_sites as assigned in a
+    params.py, read from its source without running it.
+    """
+    with open(params_fname) as f:
+        tree = ast.parse(f.read(), params_fname)
+    use_sites, site_names = False, []
+    for node in tree.body:
+        if not (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)):
+            continue
+        if node.targets[0].id == 'use_fgmax_sites':
+            use_sites = ast.literal_eval(node.value)
+        elif node.targets[0].id == 'fgmax_sites':
+            site_names = [ast.literal_eval(key) for key in node.value.keys]
+    return use_sites, site_names
+
+
+def expected_layout(params_fname, mask_dir):
+    """
+    fgmax_layout of the grids params.py makes, from its fgmax settings and
+    the masks in mask_dir (as make_site_fgmax_grids picks them).
+    """
+    use_sites, site_names = params_sites(params_fname)
+    if not use_sites:
+        return ['fgmax_pts_topostyle.txt']
+    return [os.path.basename(site_mask_path(mask_dir, name))
+            for name in site_masks(site_names, mask_dir)]
+
+
+def b0_layout_path(B0_fname):
+    return os.path.splitext(B0_fname)[0] + '_layout.json'
+
+
+def write_b0_layout(B0_fname, layout):
+    with open(b0_layout_path(B0_fname), 'w') as f:
+        json.dump(layout, f)
+
+
+def read_b0_layout(B0_fname):
+    fname = b0_layout_path(B0_fname)
+    if not os.path.exists(fname):
+        # B0 files from before the site grids were made on the whole mask
+        return ['fgmax_pts_topostyle.txt']
+    with open(fname) as f:
+        return json.load(f)
+
+
+def check_b0_layout(B0_fname, layout):
+    """
+    If the B0 file was made from other fgmax grids than layout, move it to
+    <B0_fname>.stale so it is not used with the new lattice.  Returns True
+    if it can be used.
+    """
+    if not os.path.exists(B0_fname):
+        return False
+    if read_b0_layout(B0_fname) == layout:
+        return True
+    os.replace(B0_fname, B0_fname + '.stale')
+    if os.path.exists(b0_layout_path(B0_fname)):
+        os.remove(b0_layout_path(B0_fname))
+    print("*** %s was made from other fgmax grids, moved to %s.stale" \
+          % (B0_fname, B0_fname))
+    return False
+
+
+def merge_fgmax_grids(fgs):
+    """
+    Combine fgmax grids on a common lattice into one FGmaxGrid covering all
+    of them, with masked arrays X, Y, B, h, ... like read_output() sets.
+    Where grids overlap the values from the grid with the larger h are kept,
+    and the earliest arrival time.  A single grid is returned unchanged.
+    """
+    from clawpack.geoclaw import fgmax_tools
+
+    if len(fgs) == 1:
+        return fgs[0]
+
+    dx = min(np.abs(np.diff(np.unique(np.ma.getdata(fg.X)))).min() for fg in fgs)
+    dy = min(np.abs(np.diff(np.unique(np.ma.getdata(fg.Y)))).min() for fg in fgs)
+    x1 = min(fg.X.min() for fg in fgs)
+    x2 = max(fg.X.max() for fg in fgs)
+    y1 = min(fg.Y.min() for fg in fgs)
+    y2 = max(fg.Y.max() for fg in fgs)
+    nx = int(round((x2 - x1) / dx)) + 1
+    ny = int(round((y2 - y1) / dy)) + 1
+
+    merged = fgmax_tools.FGmaxGrid()
+    merged.point_style = 4
+    merged.X, merged.Y = np.meshgrid(x1 + dx*np.arange(nx),
+                                     y1 + dy*np.arange(ny))
+    for name in merge_attrs:
+        if all(getattr(fg, name, None) is None for fg in fgs):
+            continue
+        setattr(merged, name, np.ma.masked_all((ny, nx)))
+
+    for fg in fgs:
+        i = np.round((np.ma.getdata(fg.X) - x1) / dx).astype(int)
+        j = np.round((np.ma.getdata(fg.Y) - y1) / dy).astype(int)
+        h = np.ma.masked_array(fg.h)
+        valid = ~np.ma.getmaskarray(h)
+        i, j = i[valid], j[valid]
+
+        # points not set yet, or where this grid saw a larger max depth
+        take = np.ma.getmaskarray(merged.h)[j, i] | \
+            (h[valid] > merged.h[j, i]).filled(False)
+
+        for name in merge_attrs:
+            v = getattr(fg, name, None)
+            if v is None:
+                continue
+            v = np.ma.masked_array(v)[valid]
+            target = getattr(merged, name)
+            if name == 'arrival_time':
+                old = target[j, i]
+                target[j, i] = np.ma.where(np.ma.getmaskarray(old), v,
+                                           np.ma.minimum(old, v))
+            else:
+                target[j[take], i[take]] = v[take]
+
+    return merged
+
+
+def read_merged(outdir, run_id, cache_dir=None):
+    """
+    Read every fgmax grid of a run (through the fgmax cache) and merge them.
+    """
+    from tools import fgmax_cache
+
+    data_file = os.path.join(outdir, 'fgmax_grids.data')
+    fgs = [fgmax_cache.read_fgmax(outdir, run_id, fgno, cache_dir)
+           for fgno in range(1, fgmax_cache.num_fgmax_grids(data_file) + 1)]
+    return merge_fgmax_grids(fgs)
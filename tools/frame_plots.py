@@ -0,0 +1,619 @@
+"""
+Frame plots of all figures of setplot.py from one read of each frame.
+
+plotclaw draws the figures one after the other, so each fort.q is read
+again for every figure ('Full Domain' and the gauge zooms) and
+geoplot.surface_or_depth and geoplot.land are evaluated on every patch for
+each of them.  This reads a frame once, evaluates each plot_var once per
+patch (the figures share the same functions from geoplot) and draws every
+'each_frame' figure from those arrays, into the same
+frame0000fig0.png files plotclaw makes.  The gauge and other figures are
+left to plotclaw.
+
+Only the items setplot.py uses are drawn: 2d_pcolor and 2d_contour, with
+the cmap, limits, colorbar, patch edges and afteraxes settings of the
+axes and items.
+
+The land items (plot_var geoplot.land) are not drawn patch by patch.  On
+axes with fixed limits, the topo of the patches is sampled once onto an
+image of the resolution of the figure and kept for that (figure, axes,
+AMR layout), then shown under the water, so a frame only draws its water
+patches.  Water is masked (like geoplot.surface_or_depth masks dry cells)
+where a finer patch covers the cell, so a dry cell of a finer patch shows
+the land under it rather than the wet cell of a coarser one.  The layout is the levels, corners
+and topo of the patches in view, so the image is made again after a
+regrid there (or the deformation), and the last max_layers of each axes
+are kept.
+
+Frames are spread over --workers processes ($PLOT_WORKERS, or one per
+CPU), each loading setplot.py once and plotting a run of consecutive
+frames, so the land images carry over from one frame to the next.
+A plot is only made again if the fort.t/fort.q/fort.b files of its frame
+or the settings of its figure (every attribute of the figure, its axes and
+items, with the source of afteraxes and plot_var functions) have changed
+since it was last made, as recorded by content hashes in
+frame_plots.json in the plot directory.  Changing the color limits of one
+figure remakes only that figure; --force remakes everything.
+
+The gauge plots and other figures are then made by plotclaw's driver with
+no frames, and frame_plots.html in the plot directory lists the frame
+plots.  The project Makefiles use this as PLOTCMD, so make .plots goes
+through it, as does the plots step of tools/run_scenarios.py.
+
+Usage, from the project directory:
+
+    python -m tools.frame_plots $OUTPUT/_output $OUTPUT/_plots setplot.py --workers 8
+"""
+
+import os
+import glob
+import json
+import hashlib
+import inspect
+import importlib.util
+import multiprocessing
+import types
+from collections import OrderedDict
+import numpy as np
+
+item_types = ['2d_pcolor', '2d_contour']
+
+# land images kept per (figno, axes name), newest last
+max_layers = 8
+land_layers = {}
+
+manifest_fname = 'frame_plots.json'
+
+
+def load_setplot(outdir, setplot_fname='setplot.py'):
+    """
+    plotdata for outdir as set up by the setplot function in setplot_fname.
+    """
+    from clawpack.visclaw.data import ClawPlotData
+
+    spec = importlib.util.spec_from_file_location('setplot', setplot_fname)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    plotdata = ClawPlotData()
+    plotdata.outdir = outdir
+    return module.setplot(plotdata)
+
+
+def frame_numbers(outdir):
+    return sorted(int(os.path.basename(fname)[6:]) for fname in
+                  glob.glob(os.path.join(outdir, 'fort.t[0-9]*')))
+
+
+def frame_figures(plotdata, fignos='all'):
+    """
+    The 'each_frame' figures of plotdata that are shown, by figno.
+    """
+    figures = []
+    for name in plotdata._fignames:
+        plotfigure = plotdata.plotfigure_dict[name]
+        if plotfigure.type != 'each_frame' or not plotfigure.show:
+            continue
+        if fignos != 'all' and plotfigure.figno not in fignos:
+            continue
+        figures.append(plotfigure)
+    return sorted(figures, key=lambda plotfigure: plotfigure.figno)
+
+
+def plot_items(plotfigure):
+    """
+    [(plotaxes, [plotitems])] of a figure, the items that are shown.
+    """
+    axes = []
+    for axesname in plotfigure._axesnames:
+        plotaxes = plotfigure.plotaxes_dict[axesname]
+        if not plotaxes.show:
+            continue
+        items = []
+        for itemname in plotaxes._itemnames:
+            plotitem = plotaxes.plotitem_dict[itemname]
+            if not plotitem.show:
+                continue
+            if plotitem.plot_type not in item_types:
+                raise Exception("*** %s item in %s not supported, use plotclaw" \
+                                % (plotitem.plot_type, plotfigure.name))
+            items.append(plotitem)
+        axes.append((plotaxes, items))
+    return axes
+
+
+def plot_vars(figures):
+    """
+    The distinct plot_vars of the items of figures, each evaluated once
+    per patch.
+    """
+    result = []
+    for plotfigure in figures:
+        for plotaxes, items in plot_items(plotfigure):
+            for plotitem in items:
+                if plotitem.plot_var not in result:
+                    result.append(plotitem.plot_var)
+    return result
+
+
+def read_frame(plotdata, frameno, variables):
+    """
+    Time and patches of a frame, coarsest level first, each with its
+    geometry and the values of every plot_var in variables.
+    """
+    from clawpack.pyclaw.solution import Solution
+
+    frame = Solution(frameno, path=plotdata.outdir, file_format=plotdata.format)
+    patches = []
+    for state in frame.states:
+        patch = state.patch
+        current_data = types.SimpleNamespace(
+            plotdata=plotdata, user=getattr(plotdata, 'user', None),
+            frameno=frameno, t=frame.t, q=state.q, aux=state.aux,
+            level=patch.level, patch=patch)
+        current_data.x, current_data.y = patch.grid.p_centers
+        values = {}
+        for k, plot_var in enumerate(variables):
+            if callable(plot_var):
+                values[k] = plot_var(current_data)
+            else:
+                values[k] = state.q[plot_var, ...]
+        x_edge, y_edge = patch.grid.p_nodes
+        patches.append({'level': patch.level, 'x': current_data.x,
+                        'y': current_data.y, 'x_edge': x_edge,
+                        'y_edge': y_edge, 'values': values,
+                        'topo': state.q[3, ...] - state.q[0, ...]})
+    patches.sort(key=lambda p: p['level'])
+    return frame.t, patches
+
+
+def level_setting(setting, level, default):
+    """
+    The value of an amr_* list setting for a level, default past its end.
+    """
+    if setting is None or level > len(setting):
+        return default
+    return setting[level - 1]
+
+
+def hms(t):
+    t = int(round(t))
+    return '%i:%02i:%02i' % (t // 3600, (t // 60) % 60, t % 60)
+
+
+def draw_patch(ax, plotitem, patch, values):
+    """
+    One item on one patch; returns the mappable of a pcolor.
+    """
+    level = patch['level']
+    if plotitem.plot_type == '2d_pcolor':
+        mappable = ax.pcolormesh(patch['x_edge'], patch['y_edge'], values,
+                                 cmap=plotitem.pcolor_cmap,
+                                 vmin=plotitem.pcolor_cmin,
+                                 vmax=plotitem.pcolor_cmax, shading='flat')
+        if level_setting(plotitem.amr_celledges_show, level, 0):
+            mappable.set_edgecolor('k')
+            mappable.set_linewidth(0.1)
+        return mappable
+    if level_setting(plotitem.amr_contour_show, level, 1):
+        color = level_setting(plotitem.amr_contour_colors, level, 'k')
+        ax.contour(patch['x'], patch['y'], values, plotitem.contour_levels,
+                   colors=color, **(plotitem.kwargs or {}))
+
+
+def draw_patch_edges(ax, patch):
+    x, y = patch['x_edge'], patch['y_edge']
+    x1, x2, y1, y2 = x[0, 0], x[-1, -1], y[0, 0], y[-1, -1]
+    ax.plot([x1, x2, x2, x1, x1], [y1, y1, y2, y2, y1], 'k', linewidth=0.5)
+
+
+def is_land(plotitem):
+    from clawpack.visclaw import geoplot
+    return plotitem.plot_type == '2d_pcolor' and plotitem.plot_var is geoplot.land
+
+
+def axes_extent(plotaxes):
+    if plotaxes.xlimits in (None, 'auto') or plotaxes.ylimits in (None, 'auto'):
+        return None
+    return list(plotaxes.xlimits) + list(plotaxes.ylimits)
+
+
+def in_view(patches, extent):
+    x1, x2, y1, y2 = extent
+    return [patch for patch in patches
+            if patch['x_edge'][-1, 0] > x1 and patch['x_edge'][0, 0] < x2
+            and patch['y_edge'][0, -1] > y1 and patch['y_edge'][0, 0] < y2]
+
+
+def covered(patch, patches):
+    """
+    Cells of patch under a patch of a finer level (kept with the patch, the
+    figures of a frame share its patches).
+    """
+    if 'covered' not in patch:
+        mask = np.zeros(patch['x'].shape, dtype=bool)
+        for other in patches:
+            if other['level'] > patch['level']:
+                mask |= (patch['x'] > other['x_edge'][0, 0]) \
+                        & (patch['x'] < other['x_edge'][-1, 0]) \
+                        & (patch['y'] > other['y_edge'][0, 0]) \
+                        & (patch['y'] < other['y_edge'][0, -1])
+        patch['covered'] = mask
+    return patch['covered']
+
+
+def layout_key(patches):
+    """
+    Hash of the levels, corners and topo of patches.
+    """
+    h = hashlib.sha1()
+    for patch in patches:
+        h.update(np.array([patch['level'], patch['x_edge'][0, 0],
+                           patch['y_edge'][0, 0]]).tobytes())
+        h.update(np.ascontiguousarray(patch['topo']).tobytes())
+    return h.hexdigest()
+
+
+def rasterize(patches, extent, pixels):
+    """
+    Topo of patches (coarsest first, finer ones on top) at the centres of
+    an image of extent, pixels wide along its longer side; rows south to
+    north, masked outside all patches.
+    """
+    x1, x2, y1, y2 = extent
+    scale = pixels / max(x2 - x1, y2 - y1)
+    nx, ny = max(int((x2 - x1) * scale), 1), max(int((y2 - y1) * scale), 1)
+    xp = x1 + (np.arange(nx) + 0.5) * (x2 - x1) / nx
+    yp = y1 + (np.arange(ny) + 0.5) * (y2 - y1) / ny
+    image = np.ma.masked_all((ny, nx))
+    for patch in patches:
+        xe, ye = patch['x_edge'][:, 0], patch['y_edge'][0, :]
+        ix = np.nonzero((xp >= xe[0]) & (xp < xe[-1]))[0]
+        iy = np.nonzero((yp >= ye[0]) & (yp < ye[-1]))[0]
+        if len(ix) == 0 or len(iy) == 0:
+            continue
+        i = np.minimum(np.searchsorted(xe, xp[ix], 'right') - 1, len(xe) - 2)
+        j = np.minimum(np.searchsorted(ye, yp[iy], 'right') - 1, len(ye) - 2)
+        image[np.ix_(iy, ix)] = patch['topo'][np.ix_(i, j)].T
+    return image
+
+
+def land_layer(fig, figno, plotaxes, plotitem, patches, extent):
+    """
+    RGBA image (uint8) of the land item on extent, from the cache if the
+    patches in view have not changed.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import Normalize
+
+    patches = in_view(patches, extent)
+    layers = land_layers.setdefault((figno, plotaxes.name), OrderedDict())
+    key = layout_key(patches)
+    if key in layers:
+        layers.move_to_end(key)
+        return layers[key]
+    pixels = int(max(fig.get_size_inches()) * fig.dpi)
+    image = rasterize(patches, extent, pixels)
+    cmap = plt.get_cmap(plotitem.pcolor_cmap)
+    norm = Normalize(plotitem.pcolor_cmin, plotitem.pcolor_cmax)
+    layers[key] = cmap(norm(image), bytes=True)
+    if len(layers) > max_layers:
+        layers.popitem(last=False)
+    return layers[key]
+
+
+def draw_axes(fig, figno, plotaxes, items, variables, t, patches, current_data):
+    """
+    One axes of a frame figure from the shared patches.
+    """
+    if plotaxes.axescmd.startswith('subplot'):
+        ax = fig.add_subplot(*eval(plotaxes.axescmd[7:]))
+    else:
+        ax = fig.add_subplot(1, 1, 1)
+    extent = axes_extent(plotaxes)
+    layered = []
+    if extent is not None:
+        for plotitem in items:
+            if is_land(plotitem):
+                ax.imshow(land_layer(fig, figno, plotaxes, plotitem, patches,
+                                     extent),
+                          extent=extent, origin='lower', aspect='auto',
+                          interpolation='nearest', zorder=0)
+                layered.append(plotitem)
+    colorbars = set()
+    for patch in patches:
+        for k, plotitem in enumerate(items):
+            if plotitem in layered:
+                mappable = None
+            else:
+                values = patch['values'][variables.index(plotitem.plot_var)]
+                if layered and plotitem.plot_type == '2d_pcolor':
+                    # the land layer is under all patches, only the finest
+                    # patch of a cell may draw over it
+                    values = np.ma.masked_where(covered(patch, patches), values)
+                mappable = draw_patch(ax, plotitem, patch, values)
+            if mappable is not None and plotitem.add_colorbar and \
+                    k not in colorbars:
+                fig.colorbar(mappable, ax=ax,
+                             shrink=getattr(plotitem, 'colorbar_shrink', 1.),
+                             extend=getattr(plotitem, 'colorbar_extend', 'neither'))
+                colorbars.add(k)
+            if level_setting(getattr(plotitem, 'amr_patchedges_show', None),
+                             patch['level'], plotitem.patchedges_show):
+                draw_patch_edges(ax, patch)
+
+    if plotaxes.xlimits not in (None, 'auto'):
+        ax.set_xlim(plotaxes.xlimits)
+    if plotaxes.ylimits not in (None, 'auto'):
+        ax.set_ylim(plotaxes.ylimits)
+    if getattr(plotaxes, 'aspect_latitude', None) is not None:
+        ax.set_aspect(1. / np.cos(np.radians(plotaxes.aspect_latitude)))
+    elif plotaxes.scaled:
+        ax.set_aspect('equal')
+    title = plotaxes.title
+    if 'h:m:s' in title:
+        title = title.replace('h:m:s', hms(t))
+    elif getattr(plotaxes, 'title_with_t', True):
+        title = '%s at time %s' % (title, hms(t))
+    ax.set_title(title)
+    for name in ['xlabel', 'ylabel']:
+        if getattr(plotaxes, name, None):
+            getattr(ax, 'set_' + name)(getattr(plotaxes, name))
+    for axis, name in [('x', 'xticks_fontsize'), ('y', 'yticks_fontsize')]:
+        if getattr(plotaxes, name, None):
+            ax.tick_params(axis=axis, labelsize=getattr(plotaxes, name))
+    if callable(plotaxes.afteraxes):
+        # afteraxes functions draw with pylab on the current axes
+        import matplotlib.pyplot as plt
+        plt.sca(ax)
+        current_data.plotaxes = plotaxes
+        current_data.axes = ax
+        plotaxes.afteraxes(current_data)
+
+
+def frame_fname(plotdata, frameno, figno):
+    return os.path.join(plotdata.plotdir, 'frame%sfig%s.%s' \
+                        % (str(frameno).zfill(4), figno, plotdata.print_format))
+
+
+def plot_frame(plotdata, frameno, figures, variables=None):
+    """
+    Read frame frameno once and write frame<frameno>fig<figno>.png of
+    each of figures to plotdata.plotdir.  Returns the file names.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    if variables is None:
+        variables = plot_vars(figures)
+    t, patches = read_frame(plotdata, frameno, variables)
+    current_data = types.SimpleNamespace(plotdata=plotdata, frameno=frameno,
+                                         t=t, user=getattr(plotdata, 'user', None))
+    fnames = []
+    for plotfigure in figures:
+        fig = plt.figure(plotfigure.figno, **(plotfigure.kwargs or {}))
+        fig.clf()
+        for plotaxes, items in plot_items(plotfigure):
+            draw_axes(fig, plotfigure.figno, plotaxes, items, variables, t,
+                      patches, current_data)
+        fname = frame_fname(plotdata, frameno, plotfigure.figno)
+        fig.savefig(fname)
+        plt.close(fig)
+        fnames.append(fname)
+    return fnames
+
+
+def plot_frames(plotdata, framenos=None, fignos='all'):
+    """
+    All frame figures of plotdata for framenos (default all frames in
+    plotdata.outdir).
+    """
+    if framenos is None:
+        framenos = frame_numbers(plotdata.outdir)
+    figures = frame_figures(plotdata, fignos)
+    variables = plot_vars(figures)
+    os.makedirs(plotdata.plotdir, exist_ok=True)
+    fnames = []
+    for frameno in framenos:
+        fnames += plot_frame(plotdata, frameno, figures, variables)
+    return fnames
+
+
+def frame_hash(outdir, frameno):
+    """
+    Hash of the contents of the output files of a frame.
+    """
+    h = hashlib.sha1()
+    for fname in sorted(glob.glob(os.path.join(outdir, 'fort.[tqb]%s' \
+                                               % str(frameno).zfill(4)))):
+        h.update(os.path.basename(fname).encode())
+        with open(fname, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+def config_value(value):
+    """
+    JSON-able form of a setting: colormaps by their colors, functions by
+    their source.
+    """
+    from matplotlib.colors import Colormap
+
+    if isinstance(value, Colormap):
+        return [value.name, np.round(value(np.linspace(0, 1, 256)), 6).tolist()]
+    if callable(value):
+        try:
+            source = inspect.getsource(value)
+        except (OSError, TypeError):
+            source = ''
+        return [getattr(value, '__qualname__', type(value).__name__), source]
+    if isinstance(value, dict):
+        return {str(k): config_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [config_value(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return type(value).__name__
+
+
+def settings(obj, skip=()):
+    return {name: config_value(value) for name, value in vars(obj).items()
+            if not name.startswith('_') and name not in skip}
+
+
+def figure_hash(plotdata, plotfigure):
+    """
+    Hash of the settings of a figure, its axes and their items.
+    """
+    config = [plotdata.print_format, settings(plotfigure, ['plotaxes_dict'])]
+    for plotaxes, items in plot_items(plotfigure):
+        config.append(settings(plotaxes, ['plotitem_dict']))
+        config += [settings(plotitem) for plotitem in items]
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def read_manifest(plotdir):
+    fname = os.path.join(plotdir, manifest_fname)
+    if not os.path.exists(fname):
+        return {}
+    with open(fname) as f:
+        return json.load(f)
+
+
+def write_manifest(plotdir, manifest):
+    with open(os.path.join(plotdir, manifest_fname), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def stale_plots(plotdata, framenos, figures, manifest, force=False):
+    """
+    [(frameno, {figno: hash})] of the plots that are missing or whose
+    frame or figure changed since they were made.
+    """
+    fig_hashes = {plotfigure.figno: figure_hash(plotdata, plotfigure)
+                  for plotfigure in figures}
+    tasks = []
+    for frameno in framenos:
+        fhash = frame_hash(plotdata.outdir, frameno)
+        stale = {}
+        for figno, fig_hash in fig_hashes.items():
+            fname = frame_fname(plotdata, frameno, figno)
+            key = hashlib.sha1((fhash + fig_hash).encode()).hexdigest()
+            if force or manifest.get(os.path.basename(fname)) != key or \
+                    not os.path.exists(fname):
+                stale[figno] = key
+        if stale:
+            tasks.append((frameno, stale))
+    return tasks
+
+
+_worker = {}
+
+
+def init_worker(outdir, plotdir, setplot_fname):
+    plotdata = load_setplot(outdir, setplot_fname)
+    plotdata.plotdir = plotdir
+    _worker['plotdata'] = plotdata
+
+
+def plot_task(task):
+    """
+    Plots of one frame in a worker; returns [(file name, hash)].
+    """
+    frameno, stale = task
+    plotdata = _worker['plotdata']
+    figures = frame_figures(plotdata, list(stale))
+    fnames = plot_frame(plotdata, frameno, figures)
+    return [(os.path.basename(fname), stale[plotfigure.figno])
+            for fname, plotfigure in zip(fnames, figures)]
+
+
+def render(outdir, plotdir, setplot_fname='setplot.py', framenos=None,
+           fignos='all', workers=1, force=False):
+    """
+    Make the frame plots of outdir that are out of date, over workers
+    processes.  Returns the number of plots made.
+    """
+    init_worker(outdir, plotdir, setplot_fname)
+    plotdata = _worker['plotdata']
+    if framenos is None:
+        framenos = frame_numbers(outdir)
+    os.makedirs(plotdir, exist_ok=True)
+    manifest = read_manifest(plotdir)
+    tasks = stale_plots(plotdata, framenos, frame_figures(plotdata, fignos),
+                        manifest, force)
+    made = 0
+    try:
+        if workers > 1 and len(tasks) > 1:
+            # consecutive frames to the same worker, for its land images
+            chunksize = -(-len(tasks) // workers)
+            with multiprocessing.Pool(workers, init_worker,
+                                      (outdir, plotdir, setplot_fname)) as pool:
+                for result in pool.imap_unordered(plot_task, tasks, chunksize):
+                    manifest.update(result)
+                    made += len(result)
+        else:
+            for task in tasks:
+                result = plot_task(task)
+                manifest.update(result)
+                made += len(result)
+    finally:
+        write_manifest(plotdir, manifest)
+    return made
+
+
+def other_plots(outdir, plotdir, setplot_fname='setplot.py'):
+    """
+    Gauge and other figures of setplot.py, by plotclaw's driver with no
+    frames to plot.
+    """
+    from clawpack.visclaw import plotpages
+
+    plotdata = load_setplot(outdir, setplot_fname)
+    plotdata.plotdir = plotdir
+    plotdata.print_framenos = []
+    plotdata.parallel = False
+    plotpages.plotclaw_driver(plotdata, verbose=False, format=plotdata.format)
+
+
+def write_frame_index(plotdir, manifest):
+    """
+    frame_plots.html listing the frame plots in the manifest.
+    """
+    fname = os.path.join(plotdir, 'frame_plots.html')
+    with open(fname, 'w') as f:
+        f.write('<html><body>\n<h2>Frame plots</h2>\n')
+        for png in sorted(manifest):
+            f.write('<p>%s<br><img src="%s" width=600></p>\n' % (png, png))
+        f.write('</body></html>\n')
+    return fname
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Plot all frame figures of setplot.py, reading each frame once.')
+    parser.add_argument('outdir')
+    parser.add_argument('plotdir')
+    parser.add_argument('setplot', nargs='?', default='setplot.py')
+    parser.add_argument('--frames', type=int, nargs='*', default=None,
+                        help='frame numbers (default: all frames in outdir)')
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('PLOT_WORKERS', os.cpu_count())),
+                        help='processes plotting frames (default: $PLOT_WORKERS '
+                             'or number of CPUs)')
+    parser.add_argument('--force', action='store_true',
+                        help='remake plots that are up to date')
+    parser.add_argument('--frames-only', action='store_true',
+                        help='leave out the gauge plots and other figures')
+    args = parser.parse_args()
+
+    made = render(args.outdir, args.plotdir, args.setplot, args.frames,
+                  workers=args.workers, force=args.force)
+    print('Created %i frame plots in %s' % (made, args.plotdir))
+    write_frame_index(args.plotdir, read_manifest(args.plotdir))
+    if not args.frames_only:
+        other_plots(args.outdir, args.plotdir, args.setplot)
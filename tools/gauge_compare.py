@@ -0,0 +1,33 @@
+"""
+Compare gauge time series of a run against a reference run.
+"""
+
+import numpy as np
+
+
+def read_eta(outdir, gaugeno):
+    """
+    Times and surface elevation eta at gauge gaugeno of the run in outdir.
+    """
+    from tools.gauges import read_gauges, gauge_series
+    g = gauge_series(read_gauges(outdir), gaugeno)
+    return g['t'], g['q'][:, 3]   # eta = h + B
+
+
+def gauge_difference(outdir, ref_outdir, gaugenos):
+    """
+    {gaugeno: (rms, max)} difference in eta from the reference run, with
+    the run interpolated to the reference gauge times (over the times both
+    runs cover).
+    """
+    diffs = {}
+    for gaugeno in gaugenos:
+        t, eta = read_eta(outdir, gaugeno)
+        t_ref, eta_ref = read_eta(ref_outdir, gaugeno)
+        keep = (t_ref >= t.min()) & (t_ref <= t.max())
+        d = np.interp(t_ref[keep], t, eta) - eta_ref[keep]
+        if len(d) == 0:
+            diffs[gaugeno] = (np.nan, np.nan)
+        else:
+            diffs[gaugeno] = (np.sqrt((d**2).mean()), np.abs(d).max())
+    return diffs
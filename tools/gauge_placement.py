@@ -0,0 +1,170 @@
+"""
+Move the gauges of a project onto wet cells of the finest level.
+
+Tide gauges sit in harbours, often behind breakwaters, and at the coordinates
+of the station a finest-level cell can be dry or only a few cm deep, so the
+gauge reports dry land or noise (ishikari has a note on this for Tomakomai,
+urakawa1982 a second coordinate for coarse runs).  For each gauge in
+params.gauges this interpolates the topo to the centres of the finest-level
+cells within radius km of the station, and takes the nearest cell that is
+at least min_depth deep with all its neighbours wet.  It also gives each
+gauge a small flagregion at amr_max around that cell, so the gauge is
+resolved without a larger region forcing refinement for it.
+
+The result goes to scratch/<project>/gauge_placement.json
+(params.gauge_placement_file), which params.py applies with
+apply_placement.  The original coordinates are kept there, so the tool can
+be rerun, and a gauge edited in params.py since is left alone.
+
+Usage, from the top of the repo:
+
+    python -m tools.gauge_placement tokachi --min-depth 2 --radius 2
+"""
+
+import os
+import json
+import numpy as np
+
+from tools import runs
+
+
+def finest_dx(lower, upper, num_cells, ratios, amr_max):
+    """
+    Cell size [dx, dy] on level amr_max.
+    """
+    refine = np.prod(ratios[:amr_max - 1])
+    return [float((upper[k] - lower[k]) / num_cells[k] / refine) for k in range(2)]
+
+
+def snap_gauge(topo, x0, y0, lower, dx, min_depth=2., radius=2.):
+    """
+    Centre (x, y) of the nearest finest-level cell (origin lower, size dx)
+    within radius km of (x0, y0) that is at least min_depth deep with its
+    neighbours wet, and its topo, or None if there is none.
+    """
+    from tools.preflight import topo_at
+    from tools.coastal_gauges import neighbours, km
+
+    rx = radius / (111.32 * np.cos(np.radians(y0)))
+    ry = radius / 110.57
+    i = np.arange(np.floor((x0 - rx - lower[0]) / dx[0]),
+                  np.ceil((x0 + rx - lower[0]) / dx[0]) + 1)
+    j = np.arange(np.floor((y0 - ry - lower[1]) / dx[1]),
+                  np.ceil((y0 + ry - lower[1]) / dx[1]) + 1)
+    X, Y = np.meshgrid(lower[0] + (i + 0.5) * dx[0], lower[1] + (j + 0.5) * dx[1])
+    Z = topo_at(topo, X.ravel(), Y.ravel()).reshape(X.shape)
+    ok = (Z <= -min_depth) & neighbours(Z < 0., np.logical_and)
+    if not ok.any():
+        return None
+    d = np.where(ok, km(X, Y, x0, y0), np.inf)
+    k = np.unravel_index(np.argmin(d), d.shape)
+    if not np.isfinite(d[k]) or d[k] > radius:
+        return None
+    return float(X[k]), float(Y[k]), float(Z[k])
+
+
+def read_placement(fname):
+    if fname is None or not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        return json.load(f)
+
+
+def original_coordinates(gauges, placement):
+    """
+    [(gaugeno, x, y)] of gauges as given in params.py, before any placement.
+    """
+    result = []
+    for gauge in gauges:
+        entry = (placement or {}).get(str(gauge[0]))
+        if entry is not None and np.allclose([gauge[1], gauge[2]],
+                                             [entry['x'], entry['y']]):
+            result.append((gauge[0], entry['original'][0], entry['original'][1]))
+        else:
+            result.append((gauge[0], gauge[1], gauge[2]))
+    return result
+
+
+def apply_placement(fname, gauges, flagregions, amr_max):
+    """
+    Move gauges (in place) to the cells in the placement file, if there is
+    one, and add a flagregion at amr_max around each of them.
+    """
+    from clawpack.amrclaw.data import FlagRegion
+
+    placement = read_placement(fname)
+    if placement is None:
+        return
+    for gauge in gauges:
+        entry = placement.get(str(gauge[0]))
+        if entry is None:
+            continue
+        if not np.allclose([gauge[1], gauge[2]], entry['original']):
+            print('*** gauge %i was moved in params.py, not using %s' \
+                  % (gauge[0], fname))
+            continue
+        gauge[1], gauge[2] = entry['x'], entry['y']
+        flagregion = FlagRegion(num_dim=2)
+        flagregion.name = 'Region_gauge_%i' % gauge[0]
+        flagregion.minlevel = amr_max
+        flagregion.maxlevel = amr_max
+        flagregion.t1 = 0.
+        flagregion.t2 = 1e9
+        flagregion.spatial_region_type = 1  # Rectangle
+        flagregion.spatial_region = entry['region']
+        flagregions.append(flagregion)
+
+
+def place_gauges(topo, gauges, lower, dx, min_depth=2., radius=2.,
+                 region_cells=4):
+    """
+    Placement {gaugeno: {...}} of gauges [(gaugeno, x, y)], with a region
+    region_cells finest cells around each snapped gauge.
+    """
+    from tools.coastal_gauges import km
+
+    placement = {}
+    for gaugeno, x0, y0 in gauges:
+        snapped = snap_gauge(topo, x0, y0, lower, dx, min_depth, radius)
+        if snapped is None:
+            print('*** No cell %g m deep within %g km of gauge %i, leaving it' \
+                  % (min_depth, radius, gaugeno))
+            continue
+        x, y, B = snapped
+        hx, hy = region_cells * dx[0], region_cells * dx[1]
+        placement[str(gaugeno)] = {
+            'x': x, 'y': y, 'B': B, 'original': [x0, y0],
+            'moved_km': float(km(x, y, x0, y0)),
+            'region': [x - hx, x + hx, y - hy, y + hy]}
+        print('gauge %5i moved %.3f km to (%.6f, %.6f), %.1f m deep' \
+              % (gaugeno, placement[str(gaugeno)]['moved_km'], x, y, -B))
+    return placement
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Move the gauges of a project to wet finest-level cells.')
+    parser.add_argument('project')
+    parser.add_argument('--min-depth', type=float, default=2.,
+                        help='depth (m) the gauge cell needs (default 2)')
+    parser.add_argument('--radius', type=float, default=2.,
+                        help='km to look around each station (default 2)')
+    parser.add_argument('--region-cells', type=int, default=4,
+                        help='half width of the gauge flagregions, in finest cells (default 4)')
+    args = parser.parse_args()
+
+    from clawpack.geoclaw import topotools
+    params = runs.load_params(args.project)
+    topo_type, topo_fname = params.topofiles[0][:2]
+    topo = topotools.Topography(topo_fname, topo_type=topo_type)
+    # finest cells of the run, the refinement plan keeps the coarse grid aligned
+    dx = finest_dx(params.lower, params.upper, params.num_cells,
+                   params.refinement_ratios, params.amr_max)
+    gauges = original_coordinates(params.gauges,
+                                  read_placement(params.gauge_placement_file))
+    placement = place_gauges(topo, gauges, params.lower, dx, args.min_depth,
+                             args.radius, args.region_cells)
+    with open(params.gauge_placement_file, 'w') as f:
+        json.dump(placement, f, indent=2)
+    print('Created %s' % params.gauge_placement_file)
@@ -0,0 +1,110 @@
+"""
+All gauges of a run as one structured array.
+
+GeoClaw writes one file per gauge (gauge00112.txt, and with
+params.gauge_format = 'binary' the numbers in gauge00112.bin), and
+plotdata.getgauge parses one of them per call.  read_gauges reads every
+gauge of a run once and keeps the result in gauges.npy in the output
+directory, rows sorted by gauge number and time:
+
+    gaugeno   int    gauge number
+    level     int    AMR level the value came from
+    t         float  time (seconds)
+    q         float  (num_var,) h, hu, hv, eta
+
+so later reads, of three gauges or of a dense line of hundreds, cost one
+np.load.  The cache is rewritten when a gauge file is newer than it.
+tools/run_scenarios.py makes it in its post step.
+
+    gauges = read_gauges(outdir)
+    g = gauge_series(gauges, 129)
+    plot(g['t'] / 60., g['q'][:, 3])
+"""
+
+import os
+import glob
+import numpy as np
+
+cache_fname = 'gauges.npy'
+
+
+def gauge_files(outdir):
+    """
+    {gaugeno: [files]} of the gauges of the run in outdir.
+    """
+    files = {}
+    for fname in glob.glob(os.path.join(outdir, 'gauge*.txt')):
+        gaugeno = int(os.path.basename(fname)[5:10])
+        files[gaugeno] = [fname] + glob.glob(fname[:-4] + '.bin')
+    return files
+
+
+def gauge_dtype(num_var):
+    return np.dtype([('gaugeno', 'i4'), ('level', 'i4'), ('t', 'f8'),
+                     ('q', 'f8', (num_var,))])
+
+
+def convert_gauges(outdir, gaugenos):
+    """
+    Read the gauge files (ascii or binary) of gaugenos into one array.
+    """
+    from clawpack.pyclaw.gauges import GaugeSolution
+
+    parts = []
+    for gaugeno in sorted(gaugenos):
+        g = GaugeSolution(gaugeno, path=outdir)
+        rows = np.empty(len(g.t), dtype=gauge_dtype(g.q.shape[0]))
+        rows['gaugeno'] = gaugeno
+        rows['level'] = g.level
+        rows['t'] = g.t
+        rows['q'] = g.q.T
+        parts.append(rows)
+    if not parts:
+        return np.empty(0, dtype=gauge_dtype(4))
+    return np.concatenate(parts)
+
+
+def read_gauges(outdir, gaugenos=None):
+    """
+    Structured array of all gauges of the run in outdir (or only
+    gaugenos), from the cache if it is up to date.
+    """
+    files = gauge_files(outdir)
+    if not files:
+        raise Exception("*** No gauge output in %s" % outdir)
+    fname = os.path.join(outdir, cache_fname)
+    newest = max(os.path.getmtime(f) for fnames in files.values() for f in fnames)
+    if os.path.exists(fname) and os.path.getmtime(fname) >= newest:
+        gauges = np.load(fname)
+    else:
+        gauges = convert_gauges(outdir, files)
+        np.save(fname, gauges)
+    if gaugenos is not None:
+        gauges = gauges[np.isin(gauges['gaugeno'], gaugenos)]
+    return gauges
+
+
+def gauge_numbers(gauges):
+    return [int(gaugeno) for gaugeno in np.unique(gauges['gaugeno'])]
+
+
+def gauge_series(gauges, gaugeno):
+    """
+    Rows of one gauge (a view, sorted by time).
+    """
+    k1, k2 = np.searchsorted(gauges['gaugeno'], [gaugeno, gaugeno + 1])
+    if k1 == k2:
+        raise Exception("*** No gauge %i in the output" % gaugeno)
+    return gauges[k1:k2]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Read all gauges of a run into gauges.npy.')
+    parser.add_argument('outdir')
+    args = parser.parse_args()
+
+    gauges = read_gauges(args.outdir)
+    print('Created %s: %i gauges, %i rows' % (os.path.join(args.outdir, cache_fname),
+                                              len(gauge_numbers(gauges)), len(gauges)))
@@ -0,0 +1,42 @@
+"""
+Format of the frame output (fort.q / fort.b files) of a run.
+
+params.output_format sets it for the run: 'binary64' (the default, same
+numbers as ascii in a third of the space and far faster to write and read),
+'binary32' (half that again, single precision) or 'ascii'.  The readers
+(setplot.py, the notebooks, the tools) take it from claw.data in the output
+directory with output_format(outdir), so they always match the run.
+"""
+
+import os
+
+# codes written to claw.data for clawdata.output_format
+codes = {1: 'ascii', 3: 'binary64', 4: 'binary32'}
+formats = ['ascii', 'binary64', 'binary32']
+
+
+def check_format(name):
+    if name == 'binary':
+        return 'binary64'
+    if name not in formats:
+        raise Exception("*** output_format must be one of %s, not %s" \
+                        % (', '.join(formats), name))
+    return name
+
+
+def output_format(outdir, default='ascii'):
+    """
+    Frame output format of the run in outdir, read from its claw.data,
+    default if there is none.
+    """
+    fname = os.path.join(outdir, 'claw.data')
+    if not os.path.exists(fname):
+        return default
+    with open(fname) as f:
+        for line in f:
+            if '=: output_format' in line:
+                value = line.split()[0].strip("'")
+                if value.isdigit():
+                    return codes.get(int(value), default)
+                return check_format(value)
+    return default
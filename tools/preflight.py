@@ -0,0 +1,315 @@
+"""
+Check the inputs of a run before xgeoclaw starts.
+
+A run with the dtopo outside the topo, fgmax points outside the
+Region_FGMax_points ruled rectangle (they never get to amr_max, so their
+maxima are too coarse), a gauge on dry land, or makeB0 left True (no
+deformation at all) runs for hours before anyone notices.  This checks the
+rundata the .data files of a test are written from, reading only the
+headers of the topo and dtopo files, the fgmax masks and the rows of the
+topo around the gauges, and fails with one line per problem.  With
+--rundir it also checks that the gauges.data and fgmax_grids.data written
+there (what xgeoclaw reads) list the same gauges and fgmax grids.
+
+tools/run_scenarios.py runs it as the 'check' step, between writing the
+.data files and running xgeoclaw (--skip check to leave it out, e.g. for
+the makeB0 run).
+
+Usage, from the top of the repo:
+
+    python -m tools.preflight tokachi test1_TWC
+    python -m tools.preflight tokachi test1_TWC --rundir $OUTPUTS/tokachi/test1_TWC/_rundata
+"""
+
+import os
+import itertools
+import numpy as np
+
+from tools import runs
+from tools.fgmax_sites import mask_header, mask_extent, read_mask
+
+
+def dtopo_extent(fname):
+    """
+    [x1, x2, y1, y2] of a dtopo_type 3 file, from its header (mx, my, mt,
+    xlower, ylower, t0, dx, dy, dt).
+    """
+    header = {}
+    with open(fname) as f:
+        for k in range(9):
+            value, key = f.readline().split()[:2]
+            header[key.lower()] = float(value)
+    x1, y1 = header['xlower'], header['ylower']
+    return [x1, x1 + (header['mx'] - 1)*header['dx'],
+            y1, y1 + (header['my'] - 1)*header['dy']]
+
+
+def inside(extent, outer, tol=1e-6):
+    return extent[0] >= outer[0] - tol and extent[1] <= outer[1] + tol and \
+        extent[2] >= outer[2] - tol and extent[3] <= outer[3] + tol
+
+
+def format_extent(extent):
+    return 'x %.4f to %.4f, y %.4f to %.4f' % tuple(extent)
+
+
+def check_files(rundata):
+    """
+    Every input file the run reads exists.
+    """
+    fnames = [topo[-1] for topo in rundata.topo_data.topofiles] + \
+        [dtopo[-1] for dtopo in rundata.dtopo_data.dtopofiles] + \
+        [fg.xy_fname for fg in rundata.fgmax_data.fgmax_grids
+         if fg.point_style == 4] + \
+        [flagregion.spatial_region_file for flagregion
+         in rundata.flagregiondata.flagregions
+         if flagregion.spatial_region_type == 2]
+    return ['%s does not exist' % fname for fname in fnames
+            if not os.path.exists(fname)]
+
+
+def check_deformation(rundata, makeB0=False):
+    if makeB0:
+        return ['makeB0 is True in params.py, so the run has no deformation '
+                '(set it to False, or --skip check for the B0 run)']
+    if not rundata.dtopo_data.dtopofiles:
+        return ['no dtopo file, so the run has no deformation']
+    return []
+
+
+def check_extents(rundata):
+    """
+    The domain and the dtopo lie within the topo.
+    """
+    problems = []
+    topo_type, topo_fname = rundata.topo_data.topofiles[0][:2]
+    if topo_type != 3:
+        return problems
+    topo = mask_extent(topo_fname)  # same header as a mask
+    clawdata = rundata.clawdata
+    domain = [clawdata.lower[0], clawdata.upper[0],
+              clawdata.lower[1], clawdata.upper[1]]
+    if not inside(domain, topo):
+        problems.append('domain (%s) is not within the topo %s (%s)' \
+                        % (format_extent(domain), topo_fname, format_extent(topo)))
+    for dtopo_type, dtopo_fname in [d[:2] for d in rundata.dtopo_data.dtopofiles]:
+        if dtopo_type != 3:
+            continue
+        dtopo = dtopo_extent(dtopo_fname)
+        if not inside(dtopo, topo):
+            problems.append('dtopo %s (%s) is not within the topo (%s)' \
+                            % (dtopo_fname, format_extent(dtopo),
+                               format_extent(topo)))
+        if not inside(dtopo, domain):
+            problems.append('dtopo %s (%s) is not within the domain (%s)' \
+                            % (dtopo_fname, format_extent(dtopo),
+                               format_extent(domain)))
+    return problems
+
+
+def check_fgmax_region(rundata, region_name='Region_FGMax_points'):
+    """
+    Every point of the fgmax masks lies in the ruled rectangle that
+    refines them to amr_max, and is checked on a level that exists.
+    """
+    from clawpack.amrclaw import region_tools
+
+    problems = []
+    amr_max = rundata.amrdata.amr_levels_max
+    regions = [flagregion for flagregion in rundata.flagregiondata.flagregions
+               if flagregion.name == region_name]
+    rr = None
+    if regions and regions[0].spatial_region_type == 2:
+        rr = region_tools.RuledRectangle(regions[0].spatial_region_file)
+    for fg in rundata.fgmax_data.fgmax_grids:
+        if fg.min_level_check > amr_max:
+            problems.append('fgmax grid %i is checked on level %i but amr_max '
+                            'is %i' % (fg.fgno, fg.min_level_check, amr_max))
+        if fg.point_style != 4 or rr is None:
+            continue
+        x, y, mask = read_mask(fg.xy_fname)
+        X, Y = np.meshgrid(x, y)
+        outside = mask & rr.mask_outside(X, Y)
+        if outside.any():
+            problems.append('%i of %i points of fgmax grid %i (%s) are outside '
+                            '%s, within %s' % (outside.sum(), mask.sum(),
+                            fg.fgno, fg.xy_fname, region_name,
+                            format_extent([X[outside].min(), X[outside].max(),
+                                           Y[outside].min(), Y[outside].max()])))
+    if not regions:
+        problems.append('no flagregion named %s' % region_name)
+    return problems
+
+
+def topo_at(topo, x, y):
+    """
+    Bilinear interpolation of topo.Z at points x, y (arrays).
+    """
+    i = np.clip(np.searchsorted(topo.x, x) - 1, 0, len(topo.x) - 2)
+    j = np.clip(np.searchsorted(topo.y, y) - 1, 0, len(topo.y) - 2)
+    a = (x - topo.x[i]) / (topo.x[i+1] - topo.x[i])
+    b = (y - topo.y[j]) / (topo.y[j+1] - topo.y[j])
+    Z = topo.Z
+    return (1-a)*(1-b)*Z[j, i] + a*(1-b)*Z[j, i+1] + (1-a)*b*Z[j+1, i] \
+        + a*b*Z[j+1, i+1]
+
+
+def topo_values(fname, x, y):
+    """
+    Bilinear interpolation of a topo_type 3 file at points x, y (arrays),
+    parsing only the rows of the file around the points.
+    """
+    header = mask_header(fname)
+    nx, ny = int(header['ncols']), int(header['nrows'])
+    dx, x1, y1 = header['cellsize'], header['xlower'], header['ylower']
+    i = np.clip(np.floor((x - x1) / dx).astype(int), 0, nx - 2)
+    j = np.clip(np.floor((y - y1) / dx).astype(int), 0, ny - 2)
+    # rows are written north to south, row j is line ny-1-j after the header
+    lines = set(ny - 1 - np.concatenate([j, j + 1]))
+    rows = {}
+    with open(fname) as f:
+        for k, line in enumerate(itertools.islice(f, 6, 6 + max(lines) + 1)):
+            if k in lines:
+                rows[ny - 1 - k] = np.array(line.split(), dtype=float)
+                if len(rows[ny - 1 - k]) != nx:
+                    raise Exception("*** %s does not have one row of %i values "
+                                    "per line" % (fname, nx))
+    a = (x - (x1 + i*dx)) / dx
+    b = (y - (y1 + j*dx)) / dx
+
+    def Z(jj, ii):
+        return np.array([rows[jk][ik] for jk, ik in zip(jj, ii)])
+    return (1-a)*(1-b)*Z(j, i) + a*(1-b)*Z(j, i+1) + (1-a)*b*Z(j+1, i) \
+        + a*b*Z(j+1, i+1)
+
+
+def check_gauges(rundata):
+    """
+    Every gauge is in the domain and wet at the topo resolution.
+    """
+    gauges = np.array([gauge[:3] for gauge in rundata.gaugedata.gauges])
+    if len(gauges) == 0:
+        return []
+    problems = []
+    clawdata = rundata.clawdata
+    for gaugeno, x, y in gauges:
+        if not (clawdata.lower[0] <= x <= clawdata.upper[0] and
+                clawdata.lower[1] <= y <= clawdata.upper[1]):
+            problems.append('gauge %i at (%.5f, %.5f) is outside the domain' \
+                            % (gaugeno, x, y))
+
+    topo_type, topo_fname = rundata.topo_data.topofiles[0][:2]
+    if topo_type == 3:
+        B = topo_values(topo_fname, gauges[:, 1], gauges[:, 2])
+    else:
+        from clawpack.geoclaw import topotools
+        topo = topotools.Topography(topo_fname, topo_type=topo_type)
+        B = topo_at(topo, gauges[:, 1], gauges[:, 2])
+    sea_level = rundata.geo_data.sea_level
+    for (gaugeno, x, y), b in zip(gauges, B):
+        if b >= sea_level:
+            problems.append('gauge %i at (%.5f, %.5f) is on dry land, topo '
+                            '%.1f m (move it to a wet cell)' % (gaugeno, x, y, b))
+    return problems
+
+
+def read_gauges_data(fname):
+    """
+    {gaugeno: (x, y)} of the gauges listed in a gauges.data file.
+    """
+    with open(fname) as f:
+        lines = f.readlines()
+    for k, line in enumerate(lines):
+        if '=: ngauges' in line:
+            ngauges = int(line.split()[0])
+            words = [line.split() for line in lines[k+1:k+1+ngauges]]
+            return {int(w[0]): (float(w[1]), float(w[2])) for w in words}
+    raise Exception("*** ngauges not found in %s" % fname)
+
+
+def check_data_files(rundata, rundir, tol=1e-6):
+    """
+    gauges.data and fgmax_grids.data in rundir list the gauges and fgmax
+    grids of rundata.
+    """
+    from clawpack.geoclaw import fgmax_tools
+    from tools.fgmax_cache import num_fgmax_grids
+
+    problems = []
+    fname = os.path.join(rundir, 'gauges.data')
+    if not os.path.exists(fname):
+        return ['%s does not exist' % fname]
+    written = read_gauges_data(fname)
+    for gauge in rundata.gaugedata.gauges:
+        gaugeno, x, y = gauge[:3]
+        if gaugeno not in written:
+            problems.append('gauge %i is not in %s' % (gaugeno, fname))
+        elif not np.allclose(written[gaugeno], (x, y), atol=tol):
+            problems.append('gauge %i is at (%.5f, %.5f) in %s, (%.5f, %.5f) '
+                            'in setrun' % ((gaugeno,) + written[gaugeno]
+                                           + (fname, x, y)))
+    extra = set(written) - set(gauge[0] for gauge in rundata.gaugedata.gauges)
+    if extra:
+        problems.append('%s has gauges %s that setrun does not' \
+                        % (fname, sorted(extra)))
+
+    fname = os.path.join(rundir, 'fgmax_grids.data')
+    fgmax_grids = rundata.fgmax_data.fgmax_grids
+    if not os.path.exists(fname):
+        return problems + ['%s does not exist' % fname] if fgmax_grids else problems
+    if num_fgmax_grids(fname) != len(fgmax_grids):
+        return problems + ['%s has %i fgmax grids, setrun %i' \
+                           % (fname, num_fgmax_grids(fname), len(fgmax_grids))]
+    for fgno, expected in enumerate(fgmax_grids, start=1):
+        fg = fgmax_tools.FGmaxGrid()
+        fg.read_fgmax_grids_data(fgno=fgno, data_file=fname)
+        for name in ['point_style', 'min_level_check', 'tstart_max', 'tend_max']:
+            if not np.isclose(getattr(fg, name), getattr(expected, name)):
+                problems.append('fgmax grid %i has %s = %s in %s, %s in setrun' \
+                                % (fgno, name, getattr(fg, name), fname,
+                                   getattr(expected, name)))
+        if fg.point_style == 4 and not os.path.exists(fg.xy_fname):
+            problems.append('fgmax grid %i in %s reads %s, which does not exist' \
+                            % (fgno, fname, fg.xy_fname))
+    return problems
+
+
+def preflight(rundata, makeB0=False, rundir=None):
+    """
+    All problems found with rundata (and the .data files in rundir, if
+    given), as a list of messages.  The other checks need the files, so
+    they are only made if all of them exist.
+    """
+    missing = check_files(rundata)
+    problems = check_deformation(rundata, makeB0) + missing
+    if not missing:
+        problems += check_extents(rundata) + check_fgmax_region(rundata) + \
+            check_gauges(rundata)
+    if rundir is not None:
+        problems += check_data_files(rundata, rundir)
+    return problems
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(
+        description='Check the inputs of a test before running xgeoclaw.')
+    parser.add_argument('project')
+    parser.add_argument('test', nargs='?', default=None)
+    parser.add_argument('--rundir', default=None,
+                        help='also check the .data files written there')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    rundata = runs.load_rundata(args.project, args.test)
+    import params
+
+    problems = preflight(rundata, params.makeB0, args.rundir)
+    for problem in problems:
+        print('*** %s' % problem)
+    if problems:
+        raise Exception("*** %i problems with the inputs of %s/%s" \
+                        % (len(problems), args.project, params.which_test))
+    print('Inputs of %s/%s look fine (checked in %.1f s)' \
+          % (args.project, params.which_test, time.time() - t0))
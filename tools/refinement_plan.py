@@ -0,0 +1,130 @@
+"""
+Refinement plan for a test: per-flagregion and per-fgmax-grid time windows
+written by the planning tools (e.g. tools/arrival_times.py) and applied by
+params.py when the test is run.
+
+The plan is a json file in the test directory (scratch/<project>/<test>):
+
+    {"method": "...",
+     "flagregions": {"Region_kushiro": {"t1": 1520.0, "t2": 9000.0,
+                                        "spatial_region": [x1, x2, y1, y2]}, ...},
+     "fgmax_grids": {"1": {"tstart_max": 1400.0, "tend_max": 9200.0}, ...},
+     "end_time": 7200.0,
+     "domain": {"lower": [140.0, 38.0], "upper": [148.0, 44.0]}}
+
+Every entry is optional.  A plan only ever narrows the time windows (and
+rectangles), shortens the end_time and shrinks the domain set in params.py.
+"""
+
+import os
+import json
+
+plan_fname = 'refinement_plan.json'
+
+
+def plan_path(test_dir):
+    return os.path.join(test_dir, plan_fname)
+
+
+def read_plan(fname):
+    """
+    Return the plan in fname, or None if there is no plan.
+    """
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        return json.load(f)
+
+
+def write_plan(fname, plan):
+    """
+    Write plan to fname, keeping entries of an existing plan that plan
+    does not replace.
+    """
+    old = read_plan(fname) or {}
+    for key, value in plan.items():
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            for name, entry in value.items():
+                if isinstance(entry, dict):
+                    old[key].setdefault(name, {}).update(entry)
+                else:
+                    old[key][name] = entry
+        else:
+            old[key] = value
+    with open(fname, 'w') as f:
+        json.dump(old, f, indent=2)
+    print('Created %s' % fname)
+
+
+def planned_end_time(fname, end_time):
+    """
+    end_time, or the shorter one in the plan file (tools/early_stop.py).
+    """
+    plan = read_plan(fname)
+    if plan is None or plan.get('end_time') is None:
+        return end_time
+    return min(end_time, plan['end_time'])
+
+
+def planned_domain(fname, lower, upper, num_cells):
+    """
+    lower, upper and num_cells of the domain in the plan file
+    (tools/domain_size.py), cut to the domain set in params.py and keeping
+    its coarse grid, or the ones passed in if the plan has no domain.
+    """
+    plan = read_plan(fname)
+    if plan is None or plan.get('domain') is None:
+        return lower, upper, num_cells
+    dx = [(upper[k] - lower[k]) / num_cells[k] for k in range(2)]
+    x1, x2, y1, y2 = intersect([lower[0], upper[0], lower[1], upper[1]],
+                               [plan['domain']['lower'][0], plan['domain']['upper'][0],
+                                plan['domain']['lower'][1], plan['domain']['upper'][1]])
+    new_lower, new_upper, new_cells = [], [], []
+    for k, (a, b) in enumerate([(x1, x2), (y1, y2)]):
+        i1 = int(round((a - lower[k]) / dx[k]))
+        i2 = max(i1 + 1, int(round((b - lower[k]) / dx[k])))
+        new_lower.append(lower[k] + i1*dx[k])
+        new_upper.append(lower[k] + i2*dx[k])
+        new_cells.append(i2 - i1)
+    return new_lower, new_upper, new_cells
+
+
+def apply_plan(fname, flagregions, fgmax_grids):
+    """
+    Narrow the time windows of flagregions and fgmax_grids (in place)
+    to those in the plan file, if there is one.
+    """
+    plan = read_plan(fname)
+    if plan is None:
+        return
+
+    for flagregion in flagregions:
+        entry = plan.get('flagregions', {}).get(flagregion.name, {})
+        if entry.get('t2') is not None:
+            flagregion.t2 = max(min(flagregion.t2, entry['t2']), flagregion.t1)
+        if entry.get('t1') is not None:
+            flagregion.t1 = min(max(flagregion.t1, entry['t1']), flagregion.t2)
+        if entry.get('spatial_region') is not None and \
+                flagregion.spatial_region_type == 1:
+            flagregion.spatial_region = intersect(flagregion.spatial_region,
+                                                  entry['spatial_region'])
+
+    for fg in fgmax_grids:
+        entry = plan.get('fgmax_grids', {}).get(str(fg.fgno), {})
+        if entry.get('tend_max') is not None:
+            fg.tend_max = max(min(fg.tend_max, entry['tend_max']), fg.tstart_max)
+        if entry.get('tstart_max') is not None:
+            fg.tstart_max = min(max(fg.tstart_max, entry['tstart_max']),
+                                fg.tend_max)
+
+
+def intersect(rect1, rect2):
+    """
+    Intersection of two rectangles [x1, x2, y1, y2], or rect1 if they
+    do not overlap.
+    """
+    x1, x2 = max(rect1[0], rect2[0]), min(rect1[1], rect2[1])
+    y1, y2 = max(rect1[2], rect2[2]), min(rect1[3], rect2[3])
+    if x1 >= x2 or y1 >= y2:
+        return rect1
+    return [x1, x2, y1, y2]
@@ -0,0 +1,284 @@
+"""
+Content-addressed store of GeoClaw runs.
+
+A run is keyed by a hash of its .data files, the contents of every input
+file they name (topo, dtopo, fgmax point files, ruled rectangles, qinit)
+and the xgeoclaw executable.  cached_run looks the key up in the store
+($OUTPUTS/_run_cache by default) and returns the stored output directory if
+the same run was done before; otherwise it runs xgeoclaw with its output in
+the store.  When the store grows past max_bytes the least recently used
+runs are removed.
+
+Hashing a large topo file takes a while, so file hashes are remembered by
+path, size and modification time in file_hashes.json in the store.
+
+A run in progress holds a lock on running.lock in its directory, which
+goes away with the thread or process that runs it, so a run left behind by
+a crashed job (even in a scheduler that is still going) is not taken for
+one that is still running.
+
+Used by tools/run_scenarios.py with --cache:
+
+    python -m tools.run_scenarios tokachi 'test*' --cache
+    python -m tools.run_cache --list
+"""
+
+import os
+import re
+import glob
+import json
+import time
+import shutil
+import threading
+import hashlib
+import fcntl
+
+from tools import outputs_dir, runs
+
+entry_fname = 'run_cache.json'
+lock_fname = 'running.lock'
+default_max_bytes = 50e9
+
+
+def default_store():
+    return os.path.join(outputs_dir(), '_run_cache')
+
+
+def max_store_bytes():
+    """
+    Size limit of the store, $RUN_CACHE_MAX_GB if it is set.
+    """
+    gb = os.environ.get('RUN_CACHE_MAX_GB')
+    return float(gb) * 1e9 if gb else default_max_bytes
+
+
+def _read_json(fname, default):
+    if not os.path.exists(fname):
+        return default
+    with open(fname) as f:
+        return json.load(f)
+
+
+def _write_json(fname, obj):
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    # several runs may be writing at once (tools/scheduler.py)
+    tmp_fname = '%s.%i.%i.tmp' % (fname, os.getpid(), threading.get_ident())
+    with open(tmp_fname, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_fname, fname)
+
+
+def file_hash(fname, memo=None):
+    """
+    sha256 of the contents of fname, looked up in memo {path: [size,
+    mtime, hash]} if the file has not changed since.
+    """
+    fname = os.path.abspath(fname)
+    stat = os.stat(fname)
+    if memo is not None:
+        size, mtime, digest = memo.get(fname, (None, None, None))
+        if size == stat.st_size and mtime == stat.st_mtime:
+            return digest
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    digest = h.hexdigest()
+    if memo is not None:
+        memo[fname] = [stat.st_size, stat.st_mtime, digest]
+    return digest
+
+
+def input_files(data_fname):
+    """
+    Existing files named in a .data file (paths are written in quotes,
+    or bare in the older formats).
+    """
+    rundir = os.path.dirname(os.path.abspath(data_fname))
+    fnames = []
+    with open(data_fname) as f:
+        for line in f:
+            for token in re.split(r"[\s'\"]+", line.split('#')[0]):
+                if os.sep not in token and not token.endswith(('.tt3', '.tt1',
+                                                               '.txt', '.xyz')):
+                    continue
+                fname = os.path.join(rundir, os.path.expanduser(token))
+                if os.path.isfile(fname) and fname not in fnames:
+                    fnames.append(fname)
+    return fnames
+
+
+def run_key(rundir, xgeoclaw=None, store=None):
+    """
+    Hash of the run defined by the .data files in rundir.
+    """
+    if xgeoclaw is None:
+        xgeoclaw = runs.default_xgeoclaw()
+    if store is None:
+        store = default_store()
+    memo_fname = os.path.join(store, 'file_hashes.json')
+    memo = _read_json(memo_fname, {})
+
+    h = hashlib.sha256()
+    for data_fname in sorted(glob.glob(os.path.join(rundir, '*.data'))):
+        h.update(os.path.basename(data_fname).encode())
+        h.update(file_hash(data_fname).encode())
+        for fname in input_files(data_fname):
+            h.update(file_hash(fname, memo).encode())
+    h.update(b'xgeoclaw')
+    h.update(file_hash(xgeoclaw, memo).encode())
+
+    _write_json(memo_fname, memo)
+    return h.hexdigest()[:20]
+
+
+def entries(store=None):
+    """
+    {key: entry} of the runs in the store, complete or running.
+    """
+    if store is None:
+        store = default_store()
+    result = {}
+    for fname in glob.glob(os.path.join(store, '*', entry_fname)):
+        result[os.path.basename(os.path.dirname(fname))] = _read_json(fname, None)
+    return result
+
+
+def dir_size(path):
+    total = 0
+    for dirpath, dirnames, fnames in os.walk(path):
+        for fname in fnames:
+            total += os.path.getsize(os.path.join(dirpath, fname))
+    return total
+
+
+def lock_run(path):
+    """
+    Open file holding the lock on the run in path, or None if another
+    run (thread or process) holds it.  Closing the file releases it.
+    """
+    os.makedirs(path, exist_ok=True)
+    f = open(os.path.join(path, lock_fname), 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def is_running(path):
+    """
+    True if a run holds the lock of the run in path.
+    """
+    if not os.path.exists(os.path.join(path, lock_fname)):
+        return False
+    lock = lock_run(path)
+    if lock is None:
+        return True
+    lock.close()
+    return False
+
+
+def evict(max_bytes=None, store=None, keep=()):
+    """
+    Remove least recently used runs until the store is below max_bytes,
+    never the keys in keep or runs still going.  Runs that did not finish
+    are removed first.
+    """
+    if max_bytes is None:
+        max_bytes = max_store_bytes()
+    if store is None:
+        store = default_store()
+    all_entries = entries(store)
+    complete = {}
+    for path in glob.glob(os.path.join(store, '*', '')):
+        key = os.path.basename(os.path.dirname(path))
+        entry = all_entries.get(key)
+        if key in keep or is_running(path):
+            continue
+        if entry is None and time.time() - os.path.getmtime(path) < 60.:
+            continue  # just created by another run
+        if entry is None or entry['status'] != 'done':
+            shutil.rmtree(path)
+        else:
+            complete[key] = entry
+
+    total = sum(entry['bytes'] for entry in complete.values())
+    for key, entry in sorted(complete.items(), key=lambda e: e[1]['last_used']):
+        if total <= max_bytes:
+            break
+        if key in keep:
+            continue
+        shutil.rmtree(os.path.join(store, key))
+        total -= entry['bytes']
+        print('Removed cached run %s (%s, %.1f GB)' \
+              % (key, entry.get('label', ''), entry['bytes'] / 1e9))
+
+
+def cached_run(rundir, xgeoclaw=None, env=None, log_fname=None, label='',
+               store=None, max_bytes=None):
+    """
+    Output directory of the run defined by rundir, running xgeoclaw only if
+    the store does not hold it yet.  Returns (outdir, result) where result
+    is the dict of runs.run_xgeoclaw, from the original run on a hit, with
+    'cached' set.
+    """
+    if store is None:
+        store = default_store()
+    key = run_key(rundir, xgeoclaw, store)
+    outdir = os.path.join(store, key, '_output')
+    entry_path = os.path.join(store, key, entry_fname)
+
+    entry = _read_json(entry_path, None)
+    if entry is not None and entry['status'] == 'done':
+        print('Using cached run %s (%s)' % (key, entry.get('label', '')))
+        entry['last_used'] = time.time()
+        _write_json(entry_path, entry)
+        return outdir, dict(entry['result'], cached=True)
+
+    lock = lock_run(os.path.join(store, key))
+    if lock is None:
+        raise Exception("*** Run %s (%s) is already going" \
+                        % (key, entry['label'] if entry else label))
+    try:
+        evict(max_bytes, store, keep=[key])
+        _write_json(entry_path, {'status': 'running', 'pid': os.getpid(),
+                                 'thread': threading.get_ident(),
+                                 'started': time.time(), 'label': label})
+        result = runs.run_xgeoclaw(rundir, outdir, xgeoclaw, env, log_fname)
+        if result['returncode'] == 0:
+            _write_json(entry_path, {'status': 'done', 'label': label,
+                                     'created': time.ctime(),
+                                     'last_used': time.time(),
+                                     'bytes': dir_size(os.path.join(store, key)),
+                                     'result': result})
+        else:
+            _write_json(entry_path, {'status': 'failed', 'label': label})
+    except BaseException:
+        _write_json(entry_path, {'status': 'failed', 'label': label})
+        raise
+    finally:
+        lock.close()
+    evict(max_bytes, store, keep=[key])
+    return outdir, dict(result, cached=False)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Inspect or trim the run cache.')
+    parser.add_argument('--store', default=None,
+                        help='default: $OUTPUTS/_run_cache')
+    parser.add_argument('--list', action='store_true')
+    parser.add_argument('--max-gb', type=float, default=None,
+                        help='evict down to this size (default: $RUN_CACHE_MAX_GB or 50)')
+    args = parser.parse_args()
+
+    if args.list:
+        done = [(key, entry) for key, entry in entries(args.store).items()
+                if entry['status'] == 'done']
+        for key, entry in sorted(done, key=lambda e: -e[1]['last_used']):
+            print('%s  %-28s %8.2f GB  %s' % (key, entry['label'],
+                                             entry['bytes'] / 1e9, entry['created']))
+    else:
+        evict(None if args.max_gb is None else args.max_gb * 1e9, args.store)
@@ -0,0 +1,219 @@
+"""
+Run tests of a project without any prompts.
+
+For each test in scratch/<project> this makes the inputs (make_inputs.py),
+writes the .data files to $OUTPUTS/<project>/<test>/_rundata, checks them
+(tools/preflight.py), runs xgeoclaw with output in
+$OUTPUTS/<project>/<test>/_output and converts the fgmax and gauge output
+to their caches (tools/fgmax_cache.py, tools/gauges.py), optionally
+followed by the plots.  Each step runs in its own process with TSUNAMI_TEST set, since
+params.py can only be imported for one test per process.  Everything is
+logged to $OUTPUTS/<project>/<test>/run.log.
+
+Tests are given as names or glob patterns over scratch/<project>/*, or in
+$TSUNAMI_TESTS (space separated); by default every test is run:
+
+    python -m tools.run_scenarios tokachi test1_TWC 'test[23]*'
+    TSUNAMI_TESTS='test4_TSV test5_TO' python -m tools.run_scenarios tokachi
+"""
+
+import os
+import sys
+import glob
+import fnmatch
+import subprocess
+import time
+
+from tools import root_dir, scratch_dir, outputs_dir, runs
+
+steps = ['inputs', 'data', 'check', 'run', 'post']
+
+
+def find_tests(project, patterns=None):
+    """
+    Tests in scratch/<project> (directories with a fault_model.csv) that
+    match any of the names or glob patterns, all of them if patterns is
+    empty.
+    """
+    project_scratch = os.path.join(scratch_dir, project)
+    all_tests = sorted(os.path.basename(os.path.dirname(fname)) for fname in
+                       glob.glob(os.path.join(project_scratch, '*',
+                                              'fault_model.csv')))
+    if not patterns:
+        return all_tests
+    tests = []
+    for pattern in patterns:
+        matches = fnmatch.filter(all_tests, pattern)
+        if not matches:
+            raise Exception("*** No test in %s matches %s" \
+                            % (project_scratch, pattern))
+        tests += [test for test in matches if test not in tests]
+    return tests
+
+
+def test_dirs(project, test):
+    """
+    Run directory ($OUTPUTS/<project>/<test>) and the _rundata and _output
+    directories in it.
+    """
+    run_dir = os.path.join(outputs_dir(), project, test)
+    return run_dir, os.path.join(run_dir, '_rundata'), \
+        os.path.join(run_dir, '_output')
+
+
+def test_env(test, env=None):
+    run_env = dict(os.environ)
+    run_env['TSUNAMI_TEST'] = test
+    run_env['PROJ'] = os.environ.get('PROJ', root_dir)
+    run_env['PYTHONPATH'] = os.pathsep.join(
+        [root_dir] + [p for p in [os.environ.get('PYTHONPATH')] if p])
+    if env is not None:
+        run_env.update(env)
+    return run_env
+
+
+def run_step(step, cmd, project, test, log, env=None):
+    """
+    Run cmd in the project directory for this test, with no stdin so
+    nothing can wait on a prompt.
+    """
+    log.write('\n$ %s\n' % ' '.join(cmd))
+    log.flush()
+    returncode = subprocess.call(cmd, cwd=runs.project_dir(project),
+                                 env=test_env(test, env),
+                                 stdin=subprocess.DEVNULL, stdout=log,
+                                 stderr=subprocess.STDOUT)
+    if returncode != 0:
+        raise Exception("*** %s step failed for %s/%s, see %s" \
+                        % (step, project, test, log.name))
+
+
+def link_output(outdir, cached_outdir):
+    """
+    Point the _output directory of a test at a run in the run cache.
+    """
+    if os.path.islink(outdir):
+        os.remove(outdir)
+    elif os.path.exists(outdir):
+        print('*** Not replacing %s, output of this test is in %s' \
+              % (outdir, cached_outdir))
+        return cached_outdir
+    os.symlink(cached_outdir, outdir)
+    return outdir
+
+
+def run_inputs(project, test, env=None):
+    """
+    The inputs step alone.  make_inputs.py writes files shared by all tests
+    of a project (scratch/curr_topo.tt3, the fgmax and site masks) if they
+    are missing, so tools/scheduler.py runs this for its jobs one at a time
+    before running them in parallel.
+    """
+    run_dir = test_dirs(project, test)[0]
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, 'run.log'), 'a') as log:
+        log.write('\n*** %s/%s inputs %s\n' % (project, test, time.ctime()))
+        run_step('inputs', [sys.executable, 'make_inputs.py'], project, test,
+                 log, env)
+
+
+def run_test(project, test, xgeoclaw=None, env=None, plots=False,
+             skip=(), cache=False, profile=None):
+    """
+    All steps for one test.  env is added to the environment of every step
+    (e.g. OMP_NUM_THREADS).  With cache, the run is looked up in (and added
+    to) tools/run_cache.py, and _output links to it.  With profile, the
+    cached build of tools/build_cache.py is used.  A run that did not
+    finish is continued from its newest checkpoint (tools/checkpoint.py).
+    Returns the result of runs.run_xgeoclaw, or None if the run step was
+    skipped.
+    """
+    from tools.fgmax_cache import cache_run
+    from tools.gauges import read_gauges, gauge_files
+    from tools.checkpoint import checkpoints, is_complete, write_step_cost, \
+        step_cost_path
+
+    run_dir, rundir, outdir = test_dirs(project, test)
+    os.makedirs(run_dir, exist_ok=True)
+    log_fname = os.path.join(run_dir, 'run.log')
+    python = sys.executable
+    result = None
+    if profile is not None:
+        from tools.build_cache import executable
+        xgeoclaw = executable(project, profile)
+    restart = not cache and not os.path.islink(outdir) and \
+        os.path.isdir(outdir) and not is_complete(outdir) and \
+        len(checkpoints(outdir)) > 0
+
+    with open(log_fname, 'a') as log:
+        log.write('\n*** %s/%s started %s\n' % (project, test, time.ctime()))
+        if 'inputs' not in skip:
+            run_step('inputs', [python, 'make_inputs.py'], project, test, log, env)
+        if 'data' not in skip:
+            restart_args = ['--restart-from', outdir] if restart else []
+            run_step('data', [python, '-m', 'tools.runs', project, test, rundir]
+                     + restart_args, project, test, log, env)
+        if 'check' not in skip and 'run' not in skip:
+            run_step('check', [python, '-m', 'tools.preflight', project, test,
+                               '--rundir', rundir], project, test, log, env)
+
+    if 'run' not in skip and cache:
+        from tools.run_cache import cached_run
+        cached_outdir, result = cached_run(rundir, xgeoclaw, test_env(test, env),
+                                           log_fname, '%s/%s' % (project, test))
+        if result['returncode'] == 0:
+            outdir = link_output(outdir, cached_outdir)
+    elif 'run' not in skip:
+        log_start = os.path.getsize(log_fname)
+        result = runs.run_xgeoclaw(rundir, outdir, xgeoclaw, test_env(test, env),
+                                   log_fname, restart=restart)
+        # wall time per level 1 step, for the checkpoint interval next time
+        with open(log_fname) as log:
+            log.seek(log_start)
+            write_step_cost(step_cost_path(project, test), result['wall'],
+                            log.read())
+    if result is not None and result['returncode'] != 0:
+        raise Exception("*** xgeoclaw failed for %s/%s, see %s" \
+                        % (project, test, log_fname))
+
+    if 'post' not in skip:
+        cache_run(outdir, '%s/%s' % (project, test))
+        if gauge_files(outdir):
+            read_gauges(outdir)   # all gauges into gauges.npy
+    if plots:
+        with open(log_fname, 'a') as log:
+            # frames that changed only, over $PLOT_WORKERS processes
+            run_step('plots', [python, '-m', 'tools.frame_plots', outdir,
+                      os.path.join(run_dir, '_plots'), 'setplot.py'],
+                     project, test, log, env)
+    return result
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Run tests of a project without prompts.')
+    parser.add_argument('project')
+    parser.add_argument('tests', nargs='*',
+                        help='test names or glob patterns (default: $TSUNAMI_TESTS, '
+                             'or all tests)')
+    parser.add_argument('--skip', nargs='*', default=[], choices=steps,
+                        help='steps to leave out')
+    parser.add_argument('--plots', action='store_true',
+                        help='also make the plots in $OUTPUTS/<project>/<test>/_plots')
+    parser.add_argument('--cache', action='store_true',
+                        help='reuse identical earlier runs (tools/run_cache.py)')
+    parser.add_argument('--profile', default=None, choices=['debug', 'opt', 'omp'],
+                        help='use a cached build (tools/build_cache.py)')
+    parser.add_argument('--xgeoclaw', default=None)
+    args = parser.parse_args()
+
+    patterns = args.tests or os.environ.get('TSUNAMI_TESTS', '').split()
+    for test in find_tests(args.project, patterns):
+        print('Running %s/%s' % (args.project, test))
+        result = run_test(args.project, test, args.xgeoclaw, plots=args.plots,
+                          skip=args.skip, cache=args.cache,
+                          profile=args.profile)
+        if result is not None:
+            print('  xgeoclaw took %.1f s wall, %.1f s CPU' \
+                  % (result['wall'], result['user'] + result['sys']))
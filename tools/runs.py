@@ -0,0 +1,168 @@
+"""
+Write run data for a project and run xgeoclaw on it outside of make.
+
+Used by the benchmark and workflow tools that need many variants of a
+project's setrun.py, each written to its own run directory.
+
+Only one project can be loaded per Python process, since setrun.py imports
+the project's params.py by name.
+"""
+
+import os
+import sys
+import glob
+import shutil
+import subprocess
+import time
+
+from tools import root_dir
+
+
+def project_dir(project):
+    return os.path.join(root_dir, project)
+
+
+def default_xgeoclaw():
+    """
+    Executable built by the project Makefiles (EXE = $(PROJ)/xgeoclaw).
+    """
+    return os.path.join(os.environ.get('PROJ', root_dir), 'xgeoclaw')
+
+
+def load_params(project, test=None):
+    """
+    Import the project's params.py and return it.  If test is given it is
+    passed to params.py through $TSUNAMI_TEST.  Settings changed on it
+    before load_rundata are seen by setrun.py.
+    """
+    pdir = project_dir(project)
+    if test is not None:
+        os.environ['TSUNAMI_TEST'] = test
+    params = sys.modules.get('params')
+    if params is not None and \
+            os.path.dirname(os.path.abspath(params.__file__)) != pdir:
+        raise Exception("*** params.py of another project is already loaded: %s" \
+                        % params.__file__)
+    if pdir not in sys.path:
+        sys.path.insert(0, pdir)
+    import params
+    return params
+
+
+def load_rundata(project, test=None):
+    """
+    Import the project's setrun.py and return setrun.setrun().  If test is
+    given it is passed to params.py through $TSUNAMI_TEST.
+    """
+    load_params(project, test)
+    import setrun
+    return setrun.setrun()
+
+
+def write_rundata(rundata, rundir):
+    """
+    Write all .data files for rundata into rundir.
+    """
+    os.makedirs(rundir, exist_ok=True)
+    rundata.write(out_dir=rundir)
+
+
+def run_xgeoclaw(rundir, outdir, xgeoclaw=None, env=None, log_fname=None,
+                 restart=False):
+    """
+    Run xgeoclaw on the .data files in rundir, with output in outdir.
+
+    Old fort.* and timing files in outdir are removed unless restarting
+    (a timing.txt left from an earlier run would mark a crashed rerun as
+    complete, see checkpoint.is_complete).  Returns a
+    dict with the return code and the wall, user and system time of the
+    xgeoclaw process.
+    """
+    if xgeoclaw is None:
+        xgeoclaw = default_xgeoclaw()
+    if not os.path.exists(xgeoclaw):
+        raise Exception("*** xgeoclaw not found: %s (run make .exe first)" % xgeoclaw)
+
+    os.makedirs(outdir, exist_ok=True)
+    if not restart:
+        for fname in glob.glob(os.path.join(outdir, 'fort.*')) + \
+                glob.glob(os.path.join(outdir, 'timing.*')):
+            os.remove(fname)
+    for fname in glob.glob(os.path.join(rundir, '*.data')):
+        if os.path.dirname(os.path.abspath(fname)) != os.path.abspath(outdir):
+            shutil.copy(fname, outdir)
+
+    if log_fname is None:
+        log_fname = os.path.join(outdir, 'xgeoclaw.log')
+    run_env = dict(os.environ)
+    if env is not None:
+        run_env.update(env)
+
+    t0 = time.time()
+    with open(log_fname, 'a') as log:
+        p = subprocess.Popen([os.path.abspath(xgeoclaw)], cwd=outdir,
+                             env=run_env, stdout=log,
+                             stderr=subprocess.STDOUT)
+        # wait4 gives the CPU time of this child alone, even when several
+        # runs are going at once
+        _, status, usage = os.wait4(p.pid, 0)
+    wall = time.time() - t0
+    p.returncode = os.waitstatus_to_exitcode(status)
+
+    return {'returncode': p.returncode, 'wall': wall,
+            'user': usage.ru_utime, 'sys': usage.ru_stime,
+            'log': log_fname}
+
+
+def reduce_rundata(rundata, end_time=None, amr_max=None, num_output_times=None):
+    """
+    Shorten and coarsen a run in place, for benchmarks: stop at end_time,
+    use at most amr_max levels, and write num_output_times frames.
+    Flagregions and fgmax grids are clipped to match.
+    """
+    clawdata = rundata.clawdata
+    amrdata = rundata.amrdata
+    fgmax_grids = rundata.fgmax_data.fgmax_grids
+
+    if end_time is not None:
+        clawdata.tfinal = end_time
+        for fg in fgmax_grids:
+            fg.tstart_max = min(fg.tstart_max, end_time)
+            fg.tend_max = min(fg.tend_max, end_time)
+
+    if num_output_times is not None:
+        clawdata.output_style = 1
+        clawdata.num_output_times = num_output_times
+
+    if amr_max is not None:
+        amrdata.amr_levels_max = amr_max
+        for flagregion in rundata.flagregiondata.flagregions:
+            flagregion.minlevel = min(flagregion.minlevel, amr_max)
+            flagregion.maxlevel = min(flagregion.maxlevel, amr_max)
+        for fg in fgmax_grids:
+            fg.min_level_check = min(fg.min_level_check, amr_max)
+
+    return rundata
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Write the .data files of a project test to a run directory.')
+    parser.add_argument('project')
+    parser.add_argument('test')
+    parser.add_argument('rundir')
+    parser.add_argument('--restart-from', default=None, metavar='OUTDIR',
+                        help='restart from the newest checkpoint in OUTDIR '
+                             'if that run did not finish')
+    args = parser.parse_args()
+
+    rundata = load_rundata(args.project, args.test)
+    if args.restart_from is not None:
+        from tools.checkpoint import restart_rundata
+        t = restart_rundata(rundata, args.restart_from)
+        if t is not None:
+            print('Restarting from %s at t = %.1f' \
+                  % (rundata.clawdata.restart_file, t))
+    write_rundata(rundata, args.rundir)
+    print('Created .data files in %s' % args.rundir)
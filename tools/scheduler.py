@@ -0,0 +1,219 @@
+"""
+Run many tests at once on one node.
+
+Tests are queued and run with tools/run_scenarios.py, several xgeoclaw
+processes at a time, each in its own $OUTPUTS/<project>/<test>/_output and
+with its own log in $OUTPUTS/<project>/<test>/run.log.  Their inputs are
+made first, one test at a time, since make_inputs.py writes files shared
+by the tests of a project (topo, fgmax masks).  The cores are split
+between the running jobs through OMP_NUM_THREADS: each job gets about
+--threads of them, and once the queue is shorter than the free slots the
+last jobs get the cores left over.  Several jobs with few threads each give
+more runs per hour than one job with all of them, since AMR runs do not
+scale well past a handful of threads.  The jobs run the cached OpenMP
+build (tools/build_cache.py, --profile omp) unless given another profile or
+--xgeoclaw: $(PROJ)/xgeoclaw is built without -fopenmp and would ignore
+OMP_NUM_THREADS.
+
+A test that finished is recorded in $OUTPUTS/<project>/<test>/run_status.json
+and skipped when the scheduler is started again (unless --rerun), so an
+interrupted batch picks up where it stopped.  Jobs are given as <project>
+(all of its tests) or <project>:<test or glob>:
+
+    python -m tools.scheduler tokachi ishikari urakawa1982 tokachi2003 --threads 4
+    python -m tools.scheduler tokachi:test1_TWC 'tokachi:test[23]*' --cores 16
+"""
+
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from tools import outputs_dir
+from tools.run_scenarios import find_tests, run_inputs, run_test, test_dirs
+
+status_fname = 'run_status.json'
+
+
+def status_path(project, test):
+    return os.path.join(test_dirs(project, test)[0], status_fname)
+
+
+def read_status(project, test):
+    fname = status_path(project, test)
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        return json.load(f)
+
+
+def write_status(project, test, status):
+    fname = status_path(project, test)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname, 'w') as f:
+        json.dump(status, f, indent=2)
+
+
+def parse_jobs(specs):
+    """
+    [(project, test)] for specs of the form project or project:pattern.
+    """
+    jobs = []
+    for spec in specs:
+        project, _, pattern = spec.partition(':')
+        for test in find_tests(project, [pattern] if pattern else None):
+            if (project, test) not in jobs:
+                jobs.append((project, test))
+    return jobs
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def run_job(project, test, threads, xgeoclaw, cache=False, profile=None):
+    status = {'status': 'running', 'threads': threads, 'started': time.ctime()}
+    write_status(project, test, status)
+    try:
+        # inputs were made by schedule before the jobs started
+        result = run_test(project, test, xgeoclaw,
+                          env={'OMP_NUM_THREADS': str(threads)}, cache=cache,
+                          profile=profile, skip=('inputs',))
+    except Exception as e:
+        status.update({'status': 'failed', 'error': str(e)})
+        write_status(project, test, status)
+        raise
+    status.update({'status': 'done', 'finished': time.ctime(),
+                   'wall': result['wall'],
+                   'cpu': result['user'] + result['sys']})
+    write_status(project, test, status)
+    return status
+
+
+def schedule(jobs, cores=None, threads=4, xgeoclaw=None, rerun=False,
+             cache=False, profile=None):
+    """
+    Run all jobs [(project, test)], at most cores // threads at a time.
+    Returns {(project, test): status}.
+    """
+    if cores is None:
+        cores = available_cores()
+    threads = max(1, min(threads, cores))
+    max_running = max(1, cores // threads)
+
+    statuses = {}
+    pending = []
+    for job in jobs:
+        status = read_status(*job)
+        outdir = test_dirs(*job)[2]
+        if status is not None and os.path.islink(outdir) and \
+                not os.path.exists(outdir):
+            status = None   # its cached run was evicted from tools/run_cache.py
+        if not rerun and status is not None and status['status'] == 'done':
+            print('*** Not rerunning %s/%s (done %s)' % (job + (status['finished'],)))
+            statuses[job] = status
+        else:
+            pending.append(job)
+
+    # make_inputs.py writes files shared by the tests of a project without
+    # locking, so the inputs are made one test at a time first
+    for job in list(pending):
+        print('Making inputs for %s/%s' % job)
+        try:
+            run_inputs(*job)
+        except Exception as e:
+            write_status(*job, {'status': 'failed', 'threads': 0,
+                                'error': str(e)})
+            statuses[job] = read_status(*job)
+            pending.remove(job)
+            print(e)
+
+    print('Running %i jobs on %i cores, up to %i at a time' \
+          % (len(pending), cores, max_running))
+    t0 = time.time()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_running) as pool:
+        while pending or running:
+            used = sum(n for job, n in running.values())
+            while pending and len(running) < max_running and used < cores:
+                # share the free cores among the jobs that can still start
+                slots = min(len(pending), max_running - len(running))
+                n = max(1, (cores - used) // slots)
+                job = pending.pop(0)
+                print('Starting %s/%s with %i threads' % (job + (n,)))
+                running[pool.submit(run_job, *job, n, xgeoclaw, cache,
+                                      profile)] = (job, n)
+                used += n
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, n = running.pop(future)
+                try:
+                    statuses[job] = future.result()
+                    print('Finished %s/%s in %.1f s' \
+                          % (job + (statuses[job]['wall'],)))
+                except Exception as e:
+                    statuses[job] = read_status(*job)
+                    print(e)
+
+    print('All jobs took %.1f s' % (time.time() - t0))
+    return {job: statuses[job] for job in jobs}
+
+
+def summary(statuses):
+    lines = ['%-32s %8s %8s %10s %10s %8s' % ('test', 'status', 'threads',
+                                             'wall (s)', 'CPU (s)', 'CPU/core')]
+    total_wall = total_cpu = 0.
+    for (project, test), status in statuses.items():
+        if status['status'] == 'done':
+            wall, cpu = status['wall'], status['cpu']
+            total_wall += wall
+            total_cpu += cpu
+            lines.append('%-32s %8s %8i %10.1f %10.1f %8.2f' \
+                         % ('%s/%s' % (project, test), status['status'],
+                            status['threads'], wall, cpu,
+                            cpu / (wall * status['threads'])))
+        else:
+            lines.append('%-32s %8s %8i' % ('%s/%s' % (project, test),
+                                            status['status'], status['threads']))
+    lines.append('%-32s %8s %8s %10.1f %10.1f' % ('total', '', '', total_wall,
+                                                  total_cpu))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Run many tests concurrently, splitting the cores between them.')
+    parser.add_argument('jobs', nargs='+',
+                        help='project (all tests) or project:test (names or globs)')
+    parser.add_argument('--cores', type=int, default=None,
+                        help='cores to use (default: all available)')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='OMP_NUM_THREADS per job (default 4)')
+    parser.add_argument('--rerun', action='store_true',
+                        help='also rerun tests that are already done')
+    parser.add_argument('--cache', action='store_true',
+                        help='reuse identical earlier runs (tools/run_cache.py)')
+    parser.add_argument('--profile', default=None, choices=['debug', 'opt', 'omp'],
+                        help='cached build to run (tools/build_cache.py, default omp '
+                             'unless --xgeoclaw is given)')
+    parser.add_argument('--xgeoclaw', default=None)
+    args = parser.parse_args()
+    profile = args.profile
+    if profile is None and args.xgeoclaw is None:
+        profile = 'omp'
+    if profile in ('debug', 'opt') and args.threads > 1:
+        raise Exception("*** The %s build has no OpenMP, use --profile omp "
+                        "or --threads 1" % profile)
+
+    statuses = schedule(parse_jobs(args.jobs), args.cores, args.threads,
+                        args.xgeoclaw, args.rerun, args.cache, profile)
+    report = summary(statuses)
+    print(report)
+    fname = os.path.join(outputs_dir(), 'scheduler_summary.txt')
+    with open(fname, 'w') as f:
+        f.write(report + '\n')
+    print('Created %s' % fname)
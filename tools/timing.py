@@ -0,0 +1,78 @@
+"""
+Read the timing summary GeoClaw writes to timing.txt at the end of a run.
+
+The file has a table of wall time, CPU time and cell updates per AMR level
+for the integration (stepgrid + BC + overhead), followed by totals for
+stepgrid, BC/ghost cells, regridding, output and the whole run.
+"""
+
+import os
+import re
+
+_number = r'([-+]?\d*\.?\d+(?:[EeDd][-+]?\d+)?)'
+_level_row = re.compile(r'^\s*(\d+)\s+' + r'\s+'.join([_number]*3) + r'\s*$')
+_total_row = re.compile(r'^\s*total\s+' + r'\s+'.join([_number]*3) + r'\s*$')
+_named_row = re.compile(r'^\s*([A-Za-z][A-Za-z/ ()]*?):?\s+' + _number + r'\s+' + _number)
+_threads = re.compile(r'Using\s+(\d+)\s+thread')
+
+
+def _float(s):
+    return float(s.replace('D', 'E').replace('d', 'e'))
+
+
+def read_timing(outdir):
+    """
+    Parse outdir/timing.txt and return a dict with
+
+        levels:     {level: {'wall': .., 'cpu': .., 'cells': ..}}
+        integration: {'wall': .., 'cpu': .., 'cells': ..} summed over levels
+        wall, cpu:  total wall and CPU time of the run (seconds)
+        parts:      {'stepgrid': (wall, cpu), 'Regridding': (wall, cpu), ...}
+        threads:    number of OpenMP threads, if reported
+
+    Returns None if the run did not finish (no timing.txt).
+    """
+    fname = os.path.join(outdir, 'timing.txt')
+    if not os.path.exists(fname):
+        return None
+
+    timing = {'levels': {}, 'integration': None, 'wall': None, 'cpu': None,
+              'parts': {}, 'threads': None}
+    in_levels = False
+    with open(fname) as f:
+        for line in f:
+            if 'Integration Time' in line:
+                in_levels = True
+                continue
+            m = _level_row.match(line)
+            if in_levels and m:
+                level, wall, cpu, cells = m.groups()
+                timing['levels'][int(level)] = {'wall': _float(wall),
+                                                'cpu': _float(cpu),
+                                                'cells': _float(cells)}
+                continue
+            m = _total_row.match(line)
+            if in_levels and m:
+                wall, cpu, cells = m.groups()
+                timing['integration'] = {'wall': _float(wall),
+                                         'cpu': _float(cpu),
+                                         'cells': _float(cells)}
+                in_levels = False
+                continue
+            m = _threads.search(line)
+            if m:
+                timing['threads'] = int(m.group(1))
+                continue
+            m = _named_row.match(line)
+            if m and not in_levels:
+                name, wall, cpu = m.groups()
+                name = name.strip()
+                timing['parts'][name] = (_float(wall), _float(cpu))
+                if name.startswith('Total time'):
+                    timing['wall'], timing['cpu'] = _float(wall), _float(cpu)
+
+    if timing['integration'] is None and timing['levels']:
+        levels = timing['levels'].values()
+        timing['integration'] = {k: sum(v[k] for v in levels)
+                                 for k in ['wall', 'cpu', 'cells']}
+    return timing
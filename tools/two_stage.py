@@ -0,0 +1,213 @@
+"""
+Two-stage run: a coarse pre-run plans the refinement of the fine run.
+
+Stage 1 runs the project's setrun.py with amr_max reduced and frequent binary
+output.  From its frames we take, for each flagregion that forces refinement
+(minlevel > 1) and each fgmax grid, the first and last time |eta| exceeds
+eta_tol inside it, and the extent of those cells.  These become time windows
+(and, for rectangles, a smaller rectangle) in the refinement plan of the test
+(see tools/refinement_plan.py), which params.py applies to the fine run.
+
+Regions that only cap refinement, like Region_domain, are left alone: outside
+every region GeoClaw may refine to amr_levels_max, so narrowing them would
+add refined cells instead of removing them.
+
+Usage, from the top of the repo:
+
+    python -m tools.two_stage tokachi --coarse-amr-max 3 --run-fine
+"""
+
+import os
+import copy
+import glob
+import numpy as np
+
+from tools import outputs_dir, runs
+from tools.refinement_plan import plan_path, write_plan, apply_plan
+from tools.timing import read_timing
+
+
+def coarse_rundata(rundata, amr_max, dt_output):
+    """
+    Copy of rundata limited to amr_max levels, with a frame every dt_output
+    seconds in binary format.
+    """
+    rundata = copy.deepcopy(rundata)
+    num_output_times = int(np.ceil(rundata.clawdata.tfinal / dt_output))
+    runs.reduce_rundata(rundata, amr_max=amr_max,
+                        num_output_times=num_output_times)
+    rundata.clawdata.output_format = 'binary'
+    rundata.clawdata.output_t0 = True
+    return rundata
+
+
+def activity(outdir, regions, eta_tol, dry_tolerance, sea_level=0.,
+             file_format=None):
+    """
+    For each region {name: inside(X, Y)}, the first and last frame time with
+    |eta - sea_level| > eta_tol on wet cells inside it, and the extent
+    [x1, x2, y1, y2] of those cells.  Regions that never see such cells are
+    not in the result.  file_format defaults to that of the run.
+    """
+    from clawpack.pyclaw.solution import Solution
+    from tools.output_format import output_format
+
+    if file_format is None:
+        file_format = output_format(outdir)
+    nframes = len(glob.glob(os.path.join(outdir, 'fort.t*')))
+    result = {}
+    for frameno in range(nframes):
+        sol = Solution(frameno, path=outdir, file_format=file_format)
+        for state in sol.states:
+            X, Y = state.grid.c_centers
+            h = state.q[0]
+            eta = state.q[-1]  # GeoClaw appends eta = h + B to q in the output
+            active = (h > dry_tolerance) & (np.abs(eta - sea_level) > eta_tol)
+            if not active.any():
+                continue
+            for name, inside in regions.items():
+                mask = active & inside(X, Y)
+                if not mask.any():
+                    continue
+                x, y = X[mask], Y[mask]
+                r = result.setdefault(name, {'first': sol.t, 'last': sol.t,
+                                             'extent': [x.min(), x.max(),
+                                                        y.min(), y.max()]})
+                r['first'] = min(r['first'], sol.t)
+                r['last'] = max(r['last'], sol.t)
+                e = r['extent']
+                r['extent'] = [min(e[0], x.min()), max(e[1], x.max()),
+                               min(e[2], y.min()), max(e[3], y.max())]
+    return result
+
+
+def flagregion_inside(flagregion):
+    from tools.arrival_times import region_mask
+    return lambda X, Y: region_mask(X, Y, flagregion)
+
+
+def fgmax_inside(fg):
+    from tools.arrival_times import extent_mask
+    from tools.fgmax_sites import mask_extent
+    extent = mask_extent(fg.xy_fname)
+    return lambda X, Y: extent_mask(X, Y, extent)
+
+
+def refinement_plan(rundata, act, margin, dt_output, pad):
+    """
+    Plan from the activity of the coarse run.  Windows are widened by margin
+    (plus one output interval after the last active frame), rectangles by pad
+    degrees.
+    """
+    tfinal = rundata.clawdata.tfinal
+    plan = {'method': 'coarse_run', 'margin': margin,
+            'flagregions': {}, 'fgmax_grids': {}}
+
+    for flagregion in rundata.flagregiondata.flagregions:
+        r = act.get(flagregion.name)
+        if flagregion.minlevel <= 1 or r is None:
+            continue
+        entry = {'t1': max(0., r['first'] - margin)}
+        if r['last'] + dt_output < tfinal:
+            entry['t2'] = r['last'] + dt_output + margin
+        if flagregion.spatial_region_type == 1:
+            x1, x2, y1, y2 = r['extent']
+            entry['spatial_region'] = [x1 - pad, x2 + pad, y1 - pad, y2 + pad]
+        plan['flagregions'][flagregion.name] = entry
+
+    for fg in rundata.fgmax_data.fgmax_grids:
+        r = act.get('fgmax%i' % fg.fgno)
+        if r is None:
+            continue
+        entry = {'tstart_max': max(0., r['first'] - margin)}
+        if r['last'] + dt_output < tfinal:
+            entry['tend_max'] = r['last'] + dt_output + margin
+        plan['fgmax_grids'][str(fg.fgno)] = entry
+
+    return plan
+
+
+def run_two_stage(project, coarse_amr_max=3, dt_output=300., eta_tol=0.01,
+                  margin=600., pad=0.1, run_fine=False, xgeoclaw=None):
+    rundata = runs.load_rundata(project)
+    import params
+
+    run_dir = os.path.join(outputs_dir(), project, params.which_test)
+
+    # Stage 1: coarse run
+    coarse = coarse_rundata(rundata, coarse_amr_max, dt_output)
+    coarse_dir = os.path.join(run_dir, '_coarse')
+    coarse_outdir = os.path.join(coarse_dir, '_output')
+    print('Coarse run with amr_max = %i in %s' % (coarse_amr_max, coarse_outdir))
+    runs.write_rundata(coarse, coarse_dir)
+    result = runs.run_xgeoclaw(coarse_dir, coarse_outdir, xgeoclaw)
+    if result['returncode'] != 0:
+        raise Exception("*** coarse run failed, see %s" % result['log'])
+    coarse_wall = result['wall']
+
+    # Stage 2: plan
+    regions = {}
+    for flagregion in rundata.flagregiondata.flagregions:
+        if flagregion.minlevel > 1:
+            regions[flagregion.name] = flagregion_inside(flagregion)
+    for fg in rundata.fgmax_data.fgmax_grids:
+        if fg.point_style == 4:
+            regions['fgmax%i' % fg.fgno] = fgmax_inside(fg)
+    act = activity(coarse_outdir, regions, eta_tol,
+                   rundata.geo_data.dry_tolerance, rundata.geo_data.sea_level)
+
+    plan = refinement_plan(rundata, act, margin, dt_output, pad)
+    fname = plan_path(params.test_dir)
+    write_plan(fname, plan)
+    for name, entry in list(plan['flagregions'].items()) + \
+            list(plan['fgmax_grids'].items()):
+        print('  %-24s %s' % (name, entry))
+
+    if not run_fine:
+        print('Coarse run took %.1f s' % coarse_wall)
+        return
+
+    # Stage 3: fine run, params.py was imported before the plan existed
+    fine = copy.deepcopy(rundata)
+    apply_plan(fname, fine.flagregiondata.flagregions,
+               fine.fgmax_data.fgmax_grids)
+    fine_dir = os.path.join(run_dir, '_rundata')
+    fine_outdir = os.path.join(run_dir, '_output')
+    print('Fine run in %s' % fine_outdir)
+    runs.write_rundata(fine, fine_dir)
+    result = runs.run_xgeoclaw(fine_dir, fine_outdir, xgeoclaw)
+    if result['returncode'] != 0:
+        raise Exception("*** fine run failed, see %s" % result['log'])
+
+    coarse_timing = read_timing(coarse_outdir) or {}
+    fine_timing = read_timing(fine_outdir) or {}
+    print('Coarse run: %8.1f s wall, %.3e cell updates' % (coarse_wall,
+          (coarse_timing.get('integration') or {}).get('cells', np.nan)))
+    print('Fine run:   %8.1f s wall, %.3e cell updates' % (result['wall'],
+          (fine_timing.get('integration') or {}).get('cells', np.nan)))
+    print('Coarse stage cost %.1f%% of the fine run' \
+          % (100. * coarse_wall / result['wall']))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Plan refinement of a run from a coarse pre-run.')
+    parser.add_argument('project')
+    parser.add_argument('--coarse-amr-max', type=int, default=3)
+    parser.add_argument('--dt-output', type=float, default=300.,
+                        help='seconds between coarse frames (default 300)')
+    parser.add_argument('--eta-tol', type=float, default=0.01,
+                        help='|eta| (m) that counts as wave activity (default 0.01)')
+    parser.add_argument('--margin', type=float, default=600.,
+                        help='seconds added to each side of the windows (default 600)')
+    parser.add_argument('--pad', type=float, default=0.1,
+                        help='degrees added around active rectangles (default 0.1)')
+    parser.add_argument('--run-fine', action='store_true',
+                        help='also run the fine simulation with the plan')
+    parser.add_argument('--xgeoclaw', default=None)
+    args = parser.parse_args()
+
+    run_two_stage(args.project, args.coarse_amr_max, args.dt_output,
+                  args.eta_tol, args.margin, args.pad, args.run_fine,
+                  args.xgeoclaw)